@@ -1,17 +1,36 @@
-from flask import Flask, request, jsonify, render_template, send_file, url_for
+from flask import Flask, Request, Response, request, jsonify, render_template, send_file, url_for, stream_with_context
 from werkzeug.utils import secure_filename
 import os
 import uuid
 from datetime import datetime
 import threading
-from process import analyze_video  # Sizin process.py dosyasından
+import time
+import hashlib
+import json
+import shutil
+from process import build_analysis_options, estimate_analysis_cost, render_annotated_video, DEFAULT_ANALYSIS_OPTIONS, ANALYSIS_VERSION  # Sizin process.py dosyasından
+from inference_server import start_inference_server
+from queries import open_results_database, query_frames, query_track, query_alarms
+from job_queue import JobQueue, QueueFull
+from status_store import open_status_store, FINISHED_STATES
+from feed import feed_path, line_frame_number, read_feed_lines
+from result_cache import HashingFile, ResultCache, file_sha256, result_cache_key
+
+class UploadRequest(Request):
+    """Request that spools uploaded files into the upload folder, hashing them as they arrive"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(app.config['UPLOAD_FOLDER'])
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'outputs'
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'webm'}
+# Containers browsers play; other uploads always get a server-rendered video
+BROWSER_VIDEO_EXTENSIONS = {'mp4', 'mov', 'webm'}
 
 # Klasörleri oluştur
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -23,47 +42,192 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 
-# Global dictionary to track processing status
-processing_status = {}
+# Shared inference server: one model copy batching frames across all jobs
+app.config['INFERENCE_SERVER'] = os.environ.get('INFERENCE_SERVER', '0') == '1'
+app.config['INFERENCE_SERVER_BATCH_FRAMES'] = int(os.environ.get('INFERENCE_SERVER_BATCH_FRAMES', 16))
+app.config['INFERENCE_SERVER_MAX_LATENCY_MS'] = int(os.environ.get('INFERENCE_SERVER_MAX_LATENCY_MS', 50))
+
+# Analysis job queue: worker processes, max waiting jobs, seconds before a job skips cheaper ones
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_LIMIT'] = int(os.environ.get('JOB_QUEUE_LIMIT', 20))
+app.config['JOB_MAX_WAIT'] = int(os.environ.get('JOB_MAX_WAIT', 600))
+# Jobs running at once on the host, over all web processes sharing outputs/jobs.db
+app.config['JOB_MAX_RUNNING'] = int(os.environ.get('JOB_MAX_RUNNING', app.config['JOB_WORKERS']))
+# Worker crashes (e.g. out of memory) after which a job fails instead of being queued again
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# Sampled frames between job checkpoints (0 = off); a job interrupted by a crash or restart resumes from its last one
+app.config['JOB_CHECKPOINT_INTERVAL'] = int(os.environ.get('JOB_CHECKPOINT_INTERVAL', 0))
+
+# Annotated video: rendered by every job (1), or headless jobs whose video is rendered on request (0)
+app.config['RENDER_VIDEO'] = os.environ.get('RENDER_VIDEO', '1') == '1'
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', 1))
+
+# Task status store: sqlite (shared by all web processes on the host) or memory; finished tasks expire after STATUS_TTL seconds
+app.config['STATUS_STORE'] = os.environ.get('STATUS_STORE', 'sqlite')
+app.config['STATUS_DB'] = os.environ.get('STATUS_DB', os.path.join(OUTPUT_FOLDER, 'status.db'))
+app.config['STATUS_TTL'] = int(os.environ.get('STATUS_TTL', 7 * 24 * 3600))
+
+# Live updates: progress/alarm events per second per job, seconds between SSE keepalive comments
+app.config['PROGRESS_MAX_RATE'] = float(os.environ.get('PROGRESS_MAX_RATE', 2))
+app.config['SSE_KEEPALIVE'] = int(os.environ.get('SSE_KEEPALIVE', 15))
+
+# Result cache: repeat uploads of the same video with the same options reuse the earlier result
+app.config['RESULT_CACHE'] = os.environ.get('RESULT_CACHE', '1') == '1'
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', os.path.join(OUTPUT_FOLDER, 'cache'))
+app.config['RESULT_CACHE_MAX_MB'] = int(os.environ.get('RESULT_CACHE_MAX_MB', 5120))
+
+# Seconds between checks for new lines of a running job's frame feed
+FEED_POLL_INTERVAL = 0.5
+
+# Options that are server configuration, not per-job settings
+SERVER_ONLY_OPTIONS = {'inference_server_address', 'inference_server_authkey', 'scoring_rules'}
+
+# Task status (metadata, progress, results) by task id
+status_store = open_status_store(app.config['STATUS_STORE'], app.config['STATUS_DB'], app.config['STATUS_TTL'])
+
+result_cache = None
+if app.config['RESULT_CACHE']:
+    result_cache = ResultCache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024)
+
+inference_server = None
+inference_server_lock = threading.Lock()
+# Address and key of this process's inference server, added to the jobs it dispatches
+inference_job_options = {}
+
+# On-demand renders running in this process, at most RENDER_WORKERS at a time
+rendering_tasks = set()
+rendering_lock = threading.Lock()
+render_slots = threading.Semaphore(app.config['RENDER_WORKERS'])
+
+job_queue = None
+job_queue_lock = threading.Lock()
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_analysis_options(form, filename=''):
+    """Read per-job analysis options from the upload form, typed like their defaults"""
+    options = {}
+    for key, default in DEFAULT_ANALYSIS_OPTIONS.items():
+        if key in SERVER_ONLY_OPTIONS:
+            continue
+        value = form.get(key)
+        if value is None or value == '':
+            continue
+
+        if isinstance(default, bool):
+            options[key] = value.lower() in ('1', 'true', 'yes', 'on')
+        elif isinstance(default, int):
+            options[key] = int(value)
+        elif isinstance(default, float):
+            options[key] = float(value)
+        else:
+            options[key] = value
+
+    if app.config['INFERENCE_SERVER'] and 'analysis_mode' not in options:
+        options['analysis_mode'] = 'server'
+    if 'checkpoint_interval' not in options:
+        options['checkpoint_interval'] = app.config['JOB_CHECKPOINT_INTERVAL']
+    if 'render_video' not in options:
+        options['render_video'] = app.config['RENDER_VIDEO']
+    if filename.rsplit('.', 1)[-1].lower() not in BROWSER_VIDEO_EXTENSIONS:
+        # The browser cannot play the original under a frames.ndjson overlay
+        options['render_video'] = True
+
+    # Validate early so bad options are rejected before the upload is stored
+    build_analysis_options(options)
+    return options
+
+def ensure_inference_server():
+    """Start the shared inference server on first use (only in the process serving requests)"""
+    global inference_server
+    with inference_server_lock:
+        if inference_server is None or not inference_server.is_alive():
+            inference_server = start_inference_server(
+                max_batch_frames=app.config['INFERENCE_SERVER_BATCH_FRAMES'],
+                max_latency_ms=app.config['INFERENCE_SERVER_MAX_LATENCY_MS'])
+            inference_job_options.update({
+                'inference_server_address': inference_server.address,
+                'inference_server_authkey': inference_server.authkey.hex()
+            })
+
+def get_job_queue():
+    """Start the job queue on first use, restoring jobs left queued by a previous run"""
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(os.path.join(app.config['OUTPUT_FOLDER'], 'jobs.db'),
+                                 workers=app.config['JOB_WORKERS'],
+                                 max_queued=app.config['JOB_QUEUE_LIMIT'],
+                                 max_wait=app.config['JOB_MAX_WAIT'],
+                                 on_start=job_started,
+                                 on_progress=progress_callback,
+                                 on_done=job_finished,
+                                 on_alarm=job_alarm,
+                                 on_retry=job_retried,
+                                 job_options=inference_job_options,
+                                 max_progress_rate=app.config['PROGRESS_MAX_RATE'],
+                                 max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+                                 max_running=app.config['JOB_MAX_RUNNING'])
+            pending = job_queue.pending_jobs()
+            # Restored server-mode jobs need this process's inference server before they are dispatched
+            if any(options.get('analysis_mode') == 'server' for _, _, _, options in pending):
+                ensure_inference_server()
+            for task_id, video_path, output_dir, options in pending:
+                if status_store.get(task_id) is not None:
+                    continue
+                status_store.create(task_id, {
+                    'status': 'queued',
+                    'progress': 0,
+                    'message': 'Waiting in queue (restored after restart)...',
+                    'filename': os.path.basename(video_path),
+                    'task_id': task_id,
+                    'options': options,
+                    'start_time': datetime.now().isoformat()
+                })
+            job_queue.start()
+    return job_queue
+
 def progress_callback(task_id, progress):
-    """Progress callback function"""
-    processing_status[task_id]['progress'] = progress
+    """Progress callback function (throttled by the job queue)"""
+    if status_store.update(task_id, progress=progress) is None:
+        return
+    status_store.publish(task_id, 'progress', {'progress': progress})
     print(f"Task {task_id}: {progress:.1f}% completed")
 
-def analyze_video_background(task_id, video_path, output_dir):
-    """Background video analysis task"""
-    try:
-        processing_status[task_id]['status'] = 'processing'
-        processing_status[task_id]['message'] = 'Video analysis started...'
-        
-        # Progress callback wrapper
-        def progress_wrapper(progress):
-            progress_callback(task_id, progress)
-        
-        # Analyze video
-        result = analyze_video(video_path, output_dir, progress_wrapper)
-        
-        # Update status
-        if result['success']:
-            processing_status[task_id]['status'] = 'completed'
-            processing_status[task_id]['result'] = result
-            processing_status[task_id]['message'] = 'Video analysis completed successfully!'
-        else:
-            processing_status[task_id]['status'] = 'failed'
-            processing_status[task_id]['error'] = result['message']
-            processing_status[task_id]['message'] = f'Analysis failed: {result["message"]}'
-            
-    except Exception as e:
-        processing_status[task_id]['status'] = 'failed'
-        processing_status[task_id]['error'] = str(e)
-        processing_status[task_id]['message'] = f'Error during analysis: {str(e)}'
-        print(f"Background analysis error: {e}")
+def publish_status(task_id, status):
+    """Tell event stream clients that a task's state changed"""
+    if status is not None:
+        status_store.publish(task_id, 'status', {'status': status['status'], 'message': status.get('message', '')})
+
+def job_started(task_id):
+    """A worker picked up the job"""
+    publish_status(task_id, status_store.update(task_id, status='processing', message='Video analysis started...'))
+
+def job_retried(task_id, error):
+    """The job's worker crashed; it is queued again and resumes from its last checkpoint"""
+    publish_status(task_id, status_store.update(task_id, status='queued',
+                                                message=f'Worker crashed, waiting to resume: {error}'))
+
+def job_alarm(task_id, event):
+    """An alarm in a running job"""
+    status_store.publish(task_id, 'alarm', event)
+
+def job_finished(task_id, result):
+    """Store the result of a finished job"""
+    if result['success']:
+        status = status_store.update(task_id, status='completed', result=result,
+                                     message='Video analysis completed successfully!')
+        # Frames whose analysis failed (e.g. a model error) would be served from the cache for good
+        if result_cache and status and status.get('cache_key') and not result['stats'].get('error_frames'):
+            result_cache.store(status['cache_key'], result)
+    else:
+        status = status_store.update(task_id, status='failed', error=result['message'],
+                                     message=f'Analysis failed: {result["message"]}')
+        print(f"Background analysis error: {result['message']}")
+    publish_status(task_id, status)
 
 @app.route('/')
 def index():
@@ -97,43 +261,92 @@ def upload_video():
                 'message': f'Invalid file type. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'
             }), 400
 
+        # Per-job analysis options
+        try:
+            options = parse_analysis_options(request.form, file.filename)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid analysis options: {str(e)}'
+            }), 400
+
         # Generate unique task ID and filename
         task_id = str(uuid.uuid4())
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = secure_filename(file.filename)
         filename = f"{timestamp}_{filename}"
         
-        # Save uploaded file
+        # Save uploaded file (hashed while it was streamed to disk)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+        if isinstance(file.stream, HashingFile):
+            file.stream.save_as(file_path)
+            content_hash = file.stream.hexdigest()
+        else:
+            file.save(file_path)
+            content_hash = file_sha256(file_path)
         
         # Create output directory for this task
         output_dir = os.path.join(app.config['OUTPUT_FOLDER'], task_id)
         os.makedirs(output_dir, exist_ok=True)
+
+        # Same video analyzed with the same options before: reuse the result
+        cache_key = result_cache_key(content_hash, build_analysis_options(options), ANALYSIS_VERSION)
+        cached = None
+        if result_cache:
+            cached = result_cache.restore(cache_key, output_dir, os.path.splitext(filename)[0])
+        if cached:
+            status_store.create(task_id, {
+                'status': 'completed',
+                'progress': 100,
+                'message': 'Video analysis completed successfully! (cached result)',
+                'filename': filename,
+                'task_id': task_id,
+                'options': options,
+                'content_hash': content_hash,
+                'cache_key': cache_key,
+                'result': cached,
+                'start_time': datetime.now().isoformat()
+            })
+            return jsonify({
+                'success': True,
+                'message': 'Video already analyzed, cached result returned',
+                'task_id': task_id,
+                'filename': filename,
+                'cached': True
+            })
+
+        if options.get('analysis_mode') == 'server':
+            ensure_inference_server()
         
         # Initialize processing status
-        processing_status[task_id] = {
-            'status': 'uploaded',
+        status_store.create(task_id, {
+            'status': 'queued',
             'progress': 0,
-            'message': 'Video uploaded successfully, starting analysis...',
+            'message': 'Video uploaded successfully, waiting in queue...',
             'filename': filename,
             'task_id': task_id,
+            'options': options,
+            'content_hash': content_hash,
+            'cache_key': cache_key,
             'start_time': datetime.now().isoformat()
-        }
-        
-        # Start background analysis
-        thread = threading.Thread(
-            target=analyze_video_background,
-            args=(task_id, file_path, output_dir)
-        )
-        thread.daemon = True
-        thread.start()
-        
+        })
+
+        # Queue the analysis; cheaper jobs (fewer analyzed frames) are run first.
+        # Admission control: rejected when too many jobs are already waiting
+        try:
+            position = get_job_queue().submit(task_id, file_path, output_dir, options,
+                                              estimate_analysis_cost(file_path, options))
+        except QueueFull:
+            status_store.delete(task_id)
+            os.remove(file_path)
+            shutil.rmtree(output_dir, ignore_errors=True)
+            return queue_full_response()
         return jsonify({
             'success': True,
-            'message': 'Video uploaded and analysis started',
+            'message': 'Video uploaded and queued for analysis',
             'task_id': task_id,
-            'filename': filename
+            'filename': filename,
+            'queue_position': position
         })
         
     except Exception as e:
@@ -143,42 +356,125 @@ def upload_video():
             'message': f'Upload failed: {str(e)}'
         }), 500
 
+def queue_full_response():
+    """503 answer when the analysis queue does not accept more jobs"""
+    response = jsonify({
+        'success': False,
+        'message': 'Analysis queue is full, please try again later'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '60'
+    return response
+
+def describe_status(task_id, status):
+    """Status as shown to clients: queue position while waiting, download links when completed"""
+    # Position in the analysis queue while waiting
+    if status['status'] == 'queued':
+        status['queue_position'] = get_job_queue().position(task_id)
+        if status['queue_position']:
+            status['message'] = f"Waiting in queue (position {status['queue_position']})..."
+    
+    # Add download links if completed
+    if status['status'] == 'completed' and 'result' in status:
+        result = status['result']
+        status['download_links'] = {
+            'database': url_for('download_database', task_id=task_id),
+            'original_video': url_for('original_video', task_id=task_id),
+            'frame_feed': url_for('get_result_feed', task_id=task_id)
+        }
+        # Headless jobs: the annotated video exists once rendered (POST /render/<task_id>)
+        if 'analyzed_video' in result['files']:
+            status['download_links']['video'] = url_for('download_video', task_id=task_id)
+    return status
+
+def sse_message(event_type, data, event_id=None):
+    """One server-sent event"""
+    message = f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\n{message}" if event_id else message
+
 @app.route('/status/<task_id>')
 def get_status(task_id):
     """Get analysis status"""
-    if task_id not in processing_status:
+    status = status_store.get(task_id)
+    if status is None:
         return jsonify({
             'success': False,
             'message': 'Task not found'
         }), 404
-    
-    status = processing_status[task_id]
-    
-    # Add download links if completed
-    if status['status'] == 'completed' and 'result' in status:
-        result = status['result']
-        status['download_links'] = {
-            'video': url_for('download_video', task_id=task_id),
-            'database': url_for('download_database', task_id=task_id)
-        }
-    
+
     return jsonify({
         'success': True,
-        'data': status
+        'data': describe_status(task_id, status)
     })
 
+@app.route('/events/<task_id>')
+def task_events(task_id):
+    """
+    Server-sent events of a task: the current status, then 'progress', 'alarm' and 'status'
+    events until the task is finished. Reconnecting clients send Last-Event-ID and continue
+    after the last event they received.
+    """
+    if status_store.get(task_id) is None:
+        return jsonify({
+            'success': False,
+            'message': 'Task not found'
+        }), 404
+
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    after = int(last_event_id) if last_event_id.isdigit() else status_store.latest_event_id(task_id)
+
+    def generate():
+        nonlocal after
+        status = status_store.get(task_id)
+        if status is None:
+            return
+        status = describe_status(task_id, status)
+        yield sse_message('status', status)
+
+        while status['status'] not in FINISHED_STATES:
+            # Queue positions move without events: re-check them now and then while waiting
+            timeout = 2 if status['status'] == 'queued' else app.config['SSE_KEEPALIVE']
+            events = status_store.wait_events(task_id, after, timeout)
+            if not events:
+                current = status_store.get(task_id)
+                if current is None:
+                    return
+                current = describe_status(task_id, current)
+                if current.get('queue_position') != status.get('queue_position'):
+                    status = current
+                    yield sse_message('status', status)
+                else:
+                    yield ": keepalive\n\n"
+                continue
+
+            for event_id, event_type, data in events:
+                after = event_id
+                if event_type == 'status':
+                    # Sent with the full status (result, download links) like /status
+                    current = status_store.get(task_id)
+                    if current is None:
+                        return
+                    status = describe_status(task_id, current)
+                    data = status
+                yield sse_message(event_type, data, event_id)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/download/video/<task_id>')
 def download_video(task_id):
     """Download analyzed video"""
-    if task_id not in processing_status:
+    status = status_store.get(task_id)
+    if status is None:
         return jsonify({'error': 'Task not found'}), 404
     
-    status = processing_status[task_id]
     if status['status'] != 'completed':
         return jsonify({'error': 'Analysis not completed'}), 400
     
     try:
-        video_path = status['result']['files']['analyzed_video']
+        video_path = status['result']['files'].get('analyzed_video')
+        if video_path is None:
+            return jsonify({'error': 'Video not rendered yet (POST /render/<task_id>)'}), 404
         if os.path.exists(video_path):
             return send_file(video_path, as_attachment=True)
         else:
@@ -186,13 +482,72 @@ def download_video(task_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/video/original/<task_id>')
+def original_video(task_id):
+    """Uploaded video, for playback with the annotation overlay (supports range requests)"""
+    status = status_store.get(task_id)
+    if status is None:
+        return jsonify({'error': 'Task not found'}), 404
+
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], status['filename'])
+    if not os.path.exists(video_path):
+        return jsonify({'error': 'Video file not found'}), 404
+    return send_file(video_path, conditional=True)
+
+def render_task_video(task_id, video_path, output_dir, options):
+    """Render the annotated video of a headless job (background thread)"""
+    try:
+        with render_slots:
+            output_video_path = render_annotated_video(video_path, output_dir, options)
+        status = status_store.get(task_id)
+        if status is not None:
+            result = status['result']
+            result['files']['analyzed_video'] = output_video_path
+            status_store.update(task_id, result=result, render='completed')
+    except Exception as e:
+        print(f"Render error: {e}")
+        status_store.update(task_id, render='failed', render_error=str(e))
+    finally:
+        with rendering_lock:
+            rendering_tasks.discard(task_id)
+
+@app.route('/render/<task_id>', methods=['GET', 'POST'])
+def render_video(task_id):
+    """Render state of a task's annotated video; POST starts rendering it if needed"""
+    status = status_store.get(task_id)
+    if status is None:
+        return jsonify({'success': False, 'message': 'Task not found'}), 404
+
+    if status['status'] != 'completed':
+        return jsonify({'success': False, 'message': 'Analysis not completed yet'}), 400
+
+    if 'analyzed_video' in status['result']['files']:
+        return jsonify({'success': True, 'render': 'completed',
+                        'video': url_for('download_video', task_id=task_id)})
+
+    if request.method == 'POST':
+        with rendering_lock:
+            started = task_id not in rendering_tasks
+            rendering_tasks.add(task_id)
+        if started:
+            output_dir = os.path.join(app.config['OUTPUT_FOLDER'], task_id)
+            video_path = os.path.join(app.config['UPLOAD_FOLDER'], status['filename'])
+            status = status_store.update(task_id, render='rendering', render_error=None) or status
+            threading.Thread(target=render_task_video, args=(task_id, video_path, output_dir, status['options']),
+                             daemon=True).start()
+
+    response = jsonify({'success': True, 'render': status.get('render', 'not_started'),
+                        'error': status.get('render_error')})
+    response.status_code = 202 if status.get('render') == 'rendering' else 200
+    return response
+
 @app.route('/download/database/<task_id>')
 def download_database(task_id):
     """Download analysis database"""
-    if task_id not in processing_status:
+    status = status_store.get(task_id)
+    if status is None:
         return jsonify({'error': 'Task not found'}), 404
     
-    status = processing_status[task_id]
     if status['status'] != 'completed':
         return jsonify({'error': 'Analysis not completed'}), 400
     
@@ -208,13 +563,13 @@ def download_database(task_id):
 @app.route('/results/<task_id>')
 def get_results(task_id):
     """Get detailed analysis results"""
-    if task_id not in processing_status:
+    status = status_store.get(task_id)
+    if status is None:
         return jsonify({
             'success': False,
             'message': 'Task not found'
         }), 404
     
-    status = processing_status[task_id]
     if status['status'] != 'completed':
         return jsonify({
             'success': False,
@@ -226,25 +581,134 @@ def get_results(task_id):
         'data': status['result']
     })
 
+def run_results_query(task_id, query, **filters):
+    """Run a paginated results query for a completed task, answering 304 when the ETag matches"""
+    status = status_store.get(task_id)
+    if status is None:
+        return jsonify({
+            'success': False,
+            'message': 'Task not found'
+        }), 404
+
+    if status['status'] != 'completed':
+        return jsonify({
+            'success': False,
+            'message': 'Analysis not completed yet'
+        }), 400
+
+    db_path = status['result']['files']['database']
+    if not os.path.exists(db_path):
+        return jsonify({'success': False, 'message': 'Database file not found'}), 404
+
+    # The database no longer changes once the task is completed
+    db_stat = os.stat(db_path)
+    etag = hashlib.sha1(f"{task_id}:{db_stat.st_mtime_ns}:{db_stat.st_size}:{request.full_path}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        conn = open_results_database(db_path)
+        try:
+            page = query(conn,
+                         start=request.args.get('start', type=float),
+                         end=request.args.get('end', type=float),
+                         after=request.args.get('after'),
+                         limit=request.args.get('limit', 100, type=int),
+                         **filters)
+        finally:
+            conn.close()
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid query parameters: {str(e)}'
+        }), 400
+
+    response = jsonify({
+        'success': True,
+        'data': page
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/results/<task_id>/frames')
+def get_result_frames(task_id):
+    """Per-frame results in a time range (?start=&end=&after=&limit=)"""
+    return run_results_query(task_id, query_frames)
+
+@app.route('/api/results/<task_id>/tracks/<int(signed=True):face_id>')
+def get_result_track(task_id, face_id):
+    """Detections of one tracked face (?start=&end=&after=&limit=)"""
+    return run_results_query(task_id, query_track, face_id=face_id)
+
+@app.route('/api/results/<task_id>/alarms')
+def get_result_alarms(task_id):
+    """Alarm events at or above a danger level (?min_level=&start=&end=&after=&limit=)"""
+    return run_results_query(task_id, query_alarms, min_level=request.args.get('min_level', 0, type=int))
+
+@app.route('/api/results/<task_id>/feed')
+def get_result_feed(task_id):
+    """
+    Per-frame records (faces, track IDs, danger levels, alarms) as NDJSON, streamed while the
+    job runs; ends when the job is finished. ?from_frame= resumes at a frame number.
+    """
+    status = status_store.get(task_id)
+    if status is None:
+        return jsonify({
+            'success': False,
+            'message': 'Task not found'
+        }), 404
+
+    from_frame = request.args.get('from_frame', 0, type=int)
+    path = feed_path(os.path.join(app.config['OUTPUT_FOLDER'], task_id))
+
+    def generate():
+        position = 0
+        while True:
+            # Checked before reading: the feed is complete once the job has finished
+            status = status_store.get(task_id)
+            finished = status is None or status['status'] in FINISHED_STATES
+            lines = []
+            for line, position in read_feed_lines(path, position):
+                if line_frame_number(line) >= from_frame:
+                    lines.append(line)
+                    if len(lines) >= 100:
+                        yield b''.join(lines)
+                        lines = []
+            if lines:
+                yield b''.join(lines)
+            if finished:
+                return
+            time.sleep(FEED_POLL_INTERVAL)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/cleanup/<task_id>', methods=['DELETE'])
 def cleanup_task(task_id):
     """Clean up task files and data"""
     try:
-        if task_id in processing_status:
+        status = status_store.get(task_id)
+        if status is not None:
+            # Drop the job if it is still waiting in the queue
+            if status['status'] == 'queued':
+                get_job_queue().cancel(task_id)
+
             # Delete uploaded video
-            if 'filename' in processing_status[task_id]:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], processing_status[task_id]['filename'])
+            if 'filename' in status:
+                file_path = os.path.join(app.config['UPLOAD_FOLDER'], status['filename'])
                 if os.path.exists(file_path):
                     os.remove(file_path)
             
             # Delete output directory
             output_dir = os.path.join(app.config['OUTPUT_FOLDER'], task_id)
             if os.path.exists(output_dir):
-                import shutil
                 shutil.rmtree(output_dir)
             
-            # Remove from memory
-            del processing_status[task_id]
+            # Remove the task's status
+            status_store.delete(task_id)
             
             return jsonify({
                 'success': True,
@@ -268,7 +732,9 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'active_tasks': len(processing_status)
+        'active_tasks': status_store.count(),
+        'queue': get_job_queue().stats(),
+        'result_cache': result_cache.stats() if result_cache else None
     })
 
 @app.errorhandler(413)
@@ -292,5 +758,9 @@ if __name__ == '__main__':
     print("🎥 Allowed formats:", ", ".join(ALLOWED_EXTENSIONS))
     print("💾 Max file size: 500MB")
     print("🌐 Server running on: http://localhost:5000")
+
+    # Resume queued jobs right away (in the reloader's serving process only)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_job_queue()
     
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,85 @@
+import glob
+import os
+import pickle
+
+CHECKPOINT_FILE = 'checkpoint.pkl'
+
+# Tables of the storage schemas that analysis rows are written to
+LEGACY_ROW_TABLES = ('video_analysis', 'person_details', 'person_distances', 'alarm_events')
+COMPACT_ROW_TABLES = ('frames', 'persons', 'pair_distances', 'alarms')
+
+def checkpoint_path(output_dir):
+    return os.path.join(output_dir, CHECKPOINT_FILE)
+
+def video_part_path(output_video_path, index):
+    """Path of the index-th part of an output video written between checkpoints"""
+    base, ext = os.path.splitext(output_video_path)
+    return f"{base}.part{index:03d}{ext}"
+
+# Options that may change between a run and its resume (the inference server gets a new address and key)
+RESUMABLE_OPTIONS = ('checkpoint_interval', 'inference_server_address', 'inference_server_authkey')
+
+def checkpoint_options(options):
+    """Options that must match for a checkpoint to be resumed"""
+    return {key: value for key, value in options.items() if key not in RESUMABLE_OPTIONS}
+
+def save_checkpoint(output_dir, checkpoint):
+    """Atomically replace the checkpoint of an output directory"""
+    path = checkpoint_path(output_dir)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def load_checkpoint(output_dir, video_path, options, version):
+    """Checkpoint of an interrupted run of the same video/options/analysis version, or None"""
+    path = checkpoint_path(output_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except Exception as e:
+        print(f"Checkpoint unreadable, starting over: {e}")
+        return None
+
+    if (checkpoint.get('video_path') != video_path or checkpoint.get('version') != version
+            or checkpoint.get('options') != checkpoint_options(options)):
+        print("Checkpoint belongs to another video or settings, starting over")
+        return None
+    if not all(os.path.exists(part) for part in checkpoint['video_parts']):
+        print("Checkpoint video parts missing, starting over")
+        return None
+    return checkpoint
+
+def remove_checkpoint(output_dir, output_video_path=None):
+    """Delete the checkpoint and any leftover video parts"""
+    path = checkpoint_path(output_dir)
+    if os.path.exists(path):
+        os.remove(path)
+    if output_video_path:
+        # Parts of an interrupted run may be left after the ones the checkpoint lists
+        base, ext = os.path.splitext(output_video_path)
+        for part in glob.glob(f"{glob.escape(base)}.part[0-9][0-9][0-9]{glob.escape(ext)}"):
+            os.remove(part)
+
+def database_marks(conn, storage_schema):
+    """Last committed row id per legacy table (compact rows are trimmed by frame number)"""
+    if storage_schema == 'compact':
+        return {}
+    return {table: conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+            for table in LEGACY_ROW_TABLES}
+
+def trim_database(conn, storage_schema, marks, next_frame):
+    """Delete rows written after a checkpoint so the resumed run continues the same sequence"""
+    if storage_schema == 'compact':
+        for table in COMPACT_ROW_TABLES:
+            conn.execute(f'DELETE FROM {table} WHERE frame >= ?', (next_frame,))
+    else:
+        for table in LEGACY_ROW_TABLES:
+            conn.execute(f'DELETE FROM {table} WHERE id > ?', (marks[table],))
+            # AUTOINCREMENT continues from the checkpoint, as if the run had not been interrupted
+            conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (marks[table], table))
+    conn.commit()
@@ -0,0 +1,162 @@
+import queue
+import sqlite3
+import threading
+import time
+from schema import COMPACT_INSERT_SQL
+
+INSERT_SQL = {
+    'video_analysis': '''
+        INSERT INTO video_analysis
+        (timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis_date, alarm_triggered, alarm_reason)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'person_details': '''
+        INSERT INTO person_details
+        (timestamp, face_id, gender, emotion, speed, angle, bbox_area, distance_category, x, y, width, height, danger_status, danger_level, alarm_triggered)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'person_distances': '''
+        INSERT INTO person_distances
+        (timestamp, person1_id, person2_id, distance, is_close)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+    'alarm_events': '''
+        INSERT INTO alarm_events
+        (timestamp, formatted_time, dangerous_person_id, dangerous_person_emotion, dangerous_person_speed,
+         nearby_persons, alarm_reason, danger_level, analysis_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    **COMPACT_INSERT_SQL
+}
+
+# Tables with one row per analyzed frame: a submission writing one of them is a frame
+FRAME_TABLES = ('video_analysis', 'frames')
+
+_CLOSE = object()
+_FLUSH = object()
+
+def insert_rows(conn, rows):
+    """Insert {table: [row tuples]} with one executemany per table (no commit)"""
+    for table, table_rows in rows.items():
+        if table_rows:
+            conn.executemany(INSERT_SQL[table], table_rows)
+
+def write_rows(conn, rows):
+    """Hand rows to a DatabaseWriter, or insert and commit them directly on a connection"""
+    if isinstance(conn, DatabaseWriter):
+        conn.submit(rows)
+    else:
+        insert_rows(conn, rows)
+        conn.commit()
+
+class DatabaseWriter:
+    """
+    Writes analysis rows from a background thread
+
+    Rows submitted by the analysis loop are grouped into one transaction per batch_frames
+    frames (alarm events do not count) or flush_ms milliseconds, whichever comes first. The database runs in WAL
+    mode with synchronous=NORMAL; flush() waits until everything queued is committed, and
+    close() flushes, checkpoints the WAL into the database file (synced to disk) and closes
+    the connection. A batch that fails to commit is lost; its error is raised again by every
+    later submit(), flush() and close().
+    """
+
+    def __init__(self, db_path, batch_frames=50, flush_ms=500):
+        self.db_path = db_path
+        self.batch_frames = batch_frames
+        self.flush_ms = flush_ms
+        self._queue = queue.Queue(maxsize=1000)
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _raise_error(self):
+        """Raise the error of a failed batch"""
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, rows):
+        """Queue {table: [row tuples]} of one frame (or one alarm event)"""
+        self._raise_error()
+        self._queue.put(rows)
+
+    def flush(self):
+        """Wait until everything submitted so far is committed"""
+        self._raise_error()
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait()
+        self._raise_error()
+
+    def close(self):
+        """Write everything still queued and wait for the writer thread"""
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._raise_error()
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        pending = []
+        pending_frames = 0
+        deadline = None
+        closing = False
+        flushed = None
+        while not closing:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is _CLOSE:
+                    closing = True
+                elif isinstance(item, tuple) and item[0] is _FLUSH:
+                    flushed = item[1]
+                else:
+                    pending.append(item)
+                    if any(table in item for table in FRAME_TABLES):
+                        pending_frames += 1
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_ms / 1000
+            except queue.Empty:
+                pass
+
+            if pending and (closing or flushed or pending_frames >= self.batch_frames or time.monotonic() >= deadline):
+                self._flush(conn, pending)
+                pending = []
+                pending_frames = 0
+                deadline = None
+            if flushed:
+                flushed.set()
+                flushed = None
+
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except Exception as e:
+            print(f"Database checkpoint error: {e}")
+        conn.close()
+
+    def _flush(self, conn, pending):
+        # Merge per table so each table gets a single executemany, keeping submission order
+        rows = {}
+        for item in pending:
+            for table, table_rows in item.items():
+                rows.setdefault(table, []).extend(table_rows)
+
+        try:
+            with conn:
+                insert_rows(conn, rows)
+        except Exception as e:
+            print(f"Database save error: {e}")
+            if self._error is None:
+                self._error = e
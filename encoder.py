@@ -0,0 +1,158 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import cv2
+import numpy as np
+
+# Output video backends (see open_video_encoder)
+VIDEO_ENCODERS = ('opencv', 'ffmpeg')
+
+# x264 speed presets, fastest first
+ENCODER_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+
+OUTPUT_SIZE = (1280, 720)
+
+def ffmpeg_binary():
+    """Path of the ffmpeg executable (FFMPEG_BINARY or the one on PATH), None if missing"""
+    return shutil.which(os.environ.get('FFMPEG_BINARY', 'ffmpeg'))
+
+class VideoEncoder:
+    """
+    Writes frames to a video file at a fixed frame rate
+
+    Frames of another size are resized to the output size. Passing the output slot
+    (index) of a frame keeps time when frames are missing: the slots skipped since
+    the previous frame repeat it. Backends implement _write and _close.
+    """
+
+    def __init__(self, path, fps, size=OUTPUT_SIZE, start_index=0, hold_frame=None):
+        self.path = path
+        self.fps = fps
+        self.size = size
+        self.index = start_index
+        self.last_frame = hold_frame
+        self.closed = False
+
+    def write(self, frame, index=None):
+        if frame.shape[1] != self.size[0] or frame.shape[0] != self.size[1]:
+            frame = cv2.resize(frame, self.size)
+        if index is not None:
+            # A part started without a previous frame shows this one early instead
+            self.hold_until(index, frame if self.last_frame is None else self.last_frame)
+        self._write(frame)
+        self.last_frame = frame
+        self.index += 1
+
+    def hold_until(self, index, frame=None):
+        """Repeat the last frame (or the given one) up to output slot index"""
+        frame = self.last_frame if frame is None else frame
+        while frame is not None and self.index < index:
+            self._write(frame)
+            self.index += 1
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._close()
+
+class OpenCVEncoder(VideoEncoder):
+    """cv2.VideoWriter with the mp4v codec, in this thread"""
+
+    def __init__(self, path, fps, size=OUTPUT_SIZE, start_index=0, hold_frame=None):
+        super().__init__(path, fps, size, start_index, hold_frame)
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        if not self.writer.isOpened():
+            raise Exception(f"Could not open video writer: {path}")
+
+    def _write(self, frame):
+        self.writer.write(frame)
+
+    def _close(self):
+        self.writer.release()
+
+class FFmpegEncoder(VideoEncoder):
+    """
+    H.264 (libx264) in an ffmpeg subprocess, fed raw BGR frames through a pipe
+
+    Frame buffers are written to the pipe as they are (no copy), and ffmpeg encodes
+    on its own threads while the analysis continues.
+    """
+
+    def __init__(self, path, fps, size=OUTPUT_SIZE, start_index=0, hold_frame=None,
+                 preset='veryfast', crf=23, threads=0):
+        super().__init__(path, fps, size, start_index, hold_frame)
+        binary = ffmpeg_binary()
+        if binary is None:
+            raise Exception("ffmpeg not found (install it or set FFMPEG_BINARY)")
+        command = [binary, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{size[0]}x{size[1]}', '-r', f'{fps:.6f}', '-i', '-',
+                   '-an', '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-threads', str(threads),
+                   '-pix_fmt', 'yuv420p', '-movflags', '+faststart', path]
+        # Errors go to a file: a full stderr pipe would block ffmpeg
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.log, bufsize=0)
+
+    def _write(self, frame):
+        # Unbuffered pipe: each write is one os.write that may take only part of the frame
+        data = memoryview(np.ascontiguousarray(frame)).cast('B')
+        try:
+            while data:
+                written = self.process.stdin.write(data)
+                data = data[written:]
+        except BrokenPipeError:
+            # ffmpeg exited: report its error
+            self.close()
+            raise Exception("ffmpeg exited while encoding")
+
+    def _close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self.log.seek(0)
+        error = self.log.read().decode(errors='replace').strip()
+        self.log.close()
+        if returncode != 0:
+            raise Exception(f"ffmpeg failed ({returncode}): {error[-500:]}")
+
+def open_video_encoder(path, fps, options, start_index=0, hold_frame=None):
+    """Encoder for an output video, using the backend chosen by options['video_encoder']"""
+    if options['video_encoder'] == 'ffmpeg':
+        return FFmpegEncoder(path, fps, OUTPUT_SIZE, start_index, hold_frame,
+                             options['encoder_preset'], options['encoder_crf'], options['encoder_threads'])
+    return OpenCVEncoder(path, fps, OUTPUT_SIZE, start_index, hold_frame)
+
+def concat_videos(paths, output_path, fps, options):
+    """
+    Join videos written by the same encoder settings into one
+
+    ffmpeg copies the streams without re-encoding; the OpenCV backend decodes and
+    re-encodes every frame.
+    """
+    if options['video_encoder'] == 'ffmpeg':
+        list_path = f"{output_path}.concat.txt"
+        with open(list_path, 'w') as f:
+            for path in paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        try:
+            result = subprocess.run([ffmpeg_binary(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                                     '-i', list_path, '-c', 'copy', '-movflags', '+faststart', output_path],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        finally:
+            os.remove(list_path)
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg concat failed: {result.stderr.decode(errors='replace').strip()[-500:]}")
+        return
+
+    out = OpenCVEncoder(output_path, fps)
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        cap.release()
+    out.close()
@@ -0,0 +1,102 @@
+import json
+import os
+
+FEED_FILE = 'frames.ndjson'
+
+def feed_path(output_dir):
+    return os.path.join(output_dir, FEED_FILE)
+
+def _json_default(value):
+    # numpy scalars
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+def feed_record(record):
+    """Feed line of a frame record (frame_number first, so readers can skip frames cheaply)"""
+    return {
+        'frame_number': record['frame_number'],
+        'timestamp': record['timestamp'],
+        'formatted_time': record['formatted_time'],
+        'person_count': record['person_count'],
+        'persons': [{
+            'id': person['id'],
+            'gender': person['gender'],
+            'emotion': person['emotion'],
+            'box': [person['x'], person['y'], person['w'], person['h']],
+            'speed': person['speed'],
+            'angle': person['angle'],
+            'danger_level': person['danger_level'],
+            'is_dangerous': person['is_dangerous'],
+            'distance_category': person['distance_category'],
+            'prev_center': person['prev_center']
+        } for person in record['persons']],
+        'close_pairs': [list(pair) for pair in record['close_pairs']],
+        'alarm': record['alarm'],
+        'error': record['error']
+    }
+
+class FrameFeed:
+    """
+    Appends per-frame records to <output_dir>/frames.ndjson while a job runs
+
+    Lines become visible to readers at flush(), which the analysis loop calls once per batch.
+    A resumed job reopens the feed at the offset saved in its checkpoint.
+    """
+
+    def __init__(self, path, offset=None):
+        self.path = path
+        if offset is None:
+            self.file = open(path, 'wb')
+        else:
+            self.file = open(path, 'r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+
+    def write(self, record):
+        line = json.dumps(feed_record(record), default=_json_default)
+        self.file.write(line.encode() + b'\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def offset(self):
+        """Byte length of the flushed feed"""
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+def line_frame_number(line):
+    """frame_number of a feed line, read without parsing the whole record"""
+    return int(line[len(b'{"frame_number": '):line.index(b',')])
+
+def read_feed_lines(path, position=0):
+    """Complete lines from byte position on, as (line, position after the line)"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        f.seek(position)
+        for line in f:
+            if not line.endswith(b'\n'):
+                # Still being written
+                return
+            position += len(line)
+            yield line, position
+
+def frame_record(entry):
+    """Frame record (as drawn by draw_frame_record) of a parsed feed line"""
+    persons = []
+    for person in entry['persons']:
+        x, y, w, h = person['box']
+        persons.append(dict(person, x=x, y=y, w=w, h=h))
+    return dict(entry, persons=persons)
+
+def load_feed_records(path):
+    """All frame records of a finished feed by frame number"""
+    records = {}
+    for line, _ in read_feed_lines(path):
+        entry = json.loads(line)
+        records[entry['frame_number']] = frame_record(entry)
+    return records
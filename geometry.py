@@ -0,0 +1,74 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import pdist
+
+# Above this many faces, neighbor searches use a KD-tree instead of the full distance matrix
+DEFAULT_CROWD_SIZE = 50
+
+def _pair_distances(points, i, j):
+    """Euclidean distances of index pairs (same rounding as math.sqrt on integer coordinates)"""
+    diff = points[i] - points[j]
+    return np.sqrt((diff * diff).sum(axis=1))
+
+def frame_geometry(face_centers, close_threshold=150, nearby_threshold=200, crowd_size=DEFAULT_CROWD_SIZE):
+    """
+    Pairwise geometry of the faces of one frame, computed once
+
+    Returns a dict with:
+        pairs: [(i, j, distance)] for every i < j (row-major order, as stored in the database)
+        close_pairs: the pairs closer than close_threshold, same order
+        nearby: per face, [(j, distance)] of the other faces closer than nearby_threshold
+    """
+    n = len(face_centers)
+    nearby = [[] for _ in range(n)]
+    if n < 2:
+        return {'pairs': [], 'close_pairs': [], 'nearby': nearby}
+
+    points = np.asarray(face_centers, dtype=np.float64)
+    upper_i, upper_j = np.triu_indices(n, 1)
+    distances = pdist(points) if n > crowd_size else _pair_distances(points, upper_i, upper_j)
+    pairs = list(zip(upper_i.tolist(), upper_j.tolist(), distances.tolist()))
+
+    if n > crowd_size:
+        # Only pairs within the search radius are examined
+        radius = max(close_threshold, nearby_threshold)
+        candidates = cKDTree(points).query_pairs(radius, output_type='ndarray')
+        if len(candidates):
+            order = np.lexsort((candidates[:, 1], candidates[:, 0]))
+            near_i, near_j = candidates[order, 0], candidates[order, 1]
+        else:
+            near_i = near_j = np.empty(0, dtype=np.intp)
+        near_distances = _pair_distances(points, near_i, near_j)
+    else:
+        near_i, near_j, near_distances = upper_i, upper_j, distances
+
+    close = near_distances < close_threshold
+    close_pairs = list(zip(near_i[close].tolist(), near_j[close].tolist(), near_distances[close].tolist()))
+
+    within = near_distances < nearby_threshold
+    for i, j, distance in zip(near_i[within].tolist(), near_j[within].tolist(), near_distances[within].tolist()):
+        nearby[i].append((j, distance))
+        nearby[j].append((i, distance))
+    for neighbors in nearby:
+        neighbors.sort()
+
+    return {'pairs': pairs, 'close_pairs': close_pairs, 'nearby': nearby}
+
+def assign_track_ids(face_centers, tracked_objects, crowd_size=DEFAULT_CROWD_SIZE):
+    """ID of the nearest tracked object estimate for every face center (-1 without tracks)"""
+    tracks = [obj for obj in tracked_objects if len(obj.estimate) > 0]
+    if not face_centers:
+        return []
+    if not tracks:
+        return [-1] * len(face_centers)
+
+    centers = np.asarray(face_centers, dtype=np.float64)
+    estimates = np.asarray([obj.estimate[0] for obj in tracks], dtype=np.float64)
+
+    if len(tracks) > crowd_size:
+        _, nearest = cKDTree(estimates).query(centers, k=1)
+    else:
+        diff = centers[:, None, :] - estimates[None, :, :]
+        nearest = np.argmin(np.hypot(diff[..., 0], diff[..., 1]), axis=1)
+
+    return [tracks[k].id for k in nearest.tolist()]
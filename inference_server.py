@@ -0,0 +1,210 @@
+import os
+import atexit
+import queue
+import secrets
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+
+# Server run separately (python inference_server.py): its socket and hex authkey
+DEFAULT_ADDRESS = os.environ.get('INFERENCE_SERVER_ADDRESS', '')
+DEFAULT_AUTHKEY = os.environ.get('INFERENCE_SERVER_AUTHKEY', '')
+
+def private_socket_address():
+    """Socket path in a new directory only this user can access (0700)"""
+    directory = tempfile.mkdtemp(prefix='video_analysis_inference_')
+    os.chmod(directory, 0o700)
+    atexit.register(shutil.rmtree, directory, True)
+    return os.path.join(directory, 'inference.sock')
+
+def server_answers(address):
+    """True if something accepts connections on the Unix socket"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        return True
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    finally:
+        sock.close()
+
+def check_socket_free(address):
+    """Remove a socket left by a crashed server; refuse to take over a live one or another file"""
+    if not os.path.lexists(address):
+        return
+    if not stat.S_ISSOCK(os.lstat(address).st_mode):
+        raise Exception(f"Inference server address is not a socket: {address}")
+    if server_answers(address):
+        raise Exception(f"An inference server is already running on {address}")
+    os.remove(address)
+
+def run_inference_server(address, authkey, max_batch_frames=16, max_latency_ms=50):
+    """
+    Serve face analysis requests from all analysis jobs over a Unix socket
+
+    Only clients with authkey can connect. Requests that arrive within max_latency_ms of each other are merged into one
+    micro-batch (up to max_batch_frames frames) so detection and attribute models
+    are loaded once and run on larger batches. Each request carries its own detection
+    settings; requests with different settings are run as separate groups.
+    """
+    # Imported here so clients do not need the models
+    from process import analyze_frames_batched
+
+    check_socket_free(address)
+    listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    requests = queue.Queue()
+
+    def serve_connection(conn):
+        try:
+            while True:
+                request_id, frames, detection = conn.recv()
+                requests.put((conn, request_id, frames, tuple(detection)))
+        except (EOFError, OSError):
+            conn.close()
+
+    def accept_connections():
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Inference server accept error: {e}")
+                continue
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_connections, daemon=True).start()
+    print(f"Inference server listening on {address}")
+
+    while True:
+        batch = [requests.get()]
+        frame_count = len(batch[0][2])
+        deadline = time.monotonic() + max_latency_ms / 1000
+
+        # Coalesce requests until the batch is full or the oldest one has waited long enough
+        while frame_count < max_batch_frames:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            frame_count += len(request[2])
+
+        groups = {}
+        for request in batch:
+            groups.setdefault(request[3], []).append(request)
+
+        for detection, group in groups.items():
+            frames = [frame for request in group for frame in request[2]]
+            try:
+                results = analyze_frames_batched(frames, *detection)
+            except Exception as e:
+                results = [e] * len(frames)
+
+            offset = 0
+            for conn, request_id, request_frames, _ in group:
+                response = results[offset:offset + len(request_frames)]
+                offset += len(request_frames)
+                try:
+                    conn.send((request_id, response))
+                except (EOFError, OSError) as e:
+                    print(f"Inference server send error: {e}")
+
+def start_inference_server(address=None, max_batch_frames=16, max_latency_ms=50, timeout=60):
+    """
+    Start the inference server in a separate process and wait until it accepts connections
+
+    The socket goes in a private directory unless an address is given, and every server
+    gets a new random authkey. The returned process carries both (server.address,
+    server.authkey) for the clients.
+    """
+    if address is None:
+        address = private_socket_address()
+    else:
+        check_socket_free(address)
+    authkey = secrets.token_bytes(32)
+
+    context = multiprocessing.get_context('spawn')
+    server = context.Process(target=run_inference_server,
+                             args=(address, authkey, max_batch_frames, max_latency_ms),
+                             name="inference-server",
+                             daemon=True)
+    server.start()
+    server.address = address
+    server.authkey = authkey
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            Client(address, family='AF_UNIX', authkey=authkey).close()
+            return server
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not server.is_alive():
+                raise Exception("Inference server exited during startup")
+            time.sleep(0.2)
+
+    server.terminate()
+    raise Exception("Inference server did not start in time")
+
+class InferenceClient:
+    """Sends frames to the inference server; each thread uses its own connection"""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def analyze(self, frames, detection=("retinaface", 0, 0)):
+        """Analyze frames on the server; detection holds the analyze_frames_batched detector arguments"""
+        with self._lock:
+            self._counter += 1
+            request_id = self._counter
+
+        conn = self._connection()
+        try:
+            conn.send((request_id, list(frames), tuple(detection)))
+            response_id, results = conn.recv()
+        except (EOFError, OSError):
+            # Drop the broken connection so the next call reconnects
+            self._local.conn = None
+            raise
+
+        if response_id != request_id:
+            raise Exception("Inference server returned a mismatched response")
+        return results
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_inference_client(address, authkey):
+    """Process-wide client for the given server address and authkey"""
+    with _clients_lock:
+        if (address, authkey) not in _clients:
+            _clients[(address, authkey)] = InferenceClient(address, authkey)
+        return _clients[(address, authkey)]
+
+if __name__ == "__main__":
+    address = DEFAULT_ADDRESS or private_socket_address()
+    if DEFAULT_AUTHKEY:
+        authkey = bytes.fromhex(DEFAULT_AUTHKEY)
+    else:
+        authkey = secrets.token_bytes(32)
+        print(f"Inference server authkey (INFERENCE_SERVER_AUTHKEY for jobs): {authkey.hex()}")
+    run_inference_server(address, authkey,
+                         int(os.environ.get('INFERENCE_SERVER_BATCH_FRAMES', 16)),
+                         int(os.environ.get('INFERENCE_SERVER_MAX_LATENCY_MS', 50)))
@@ -0,0 +1,383 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Set in each worker process by init_worker (progress / alarm events back to the web process)
+_worker_events = None
+_progress_interval = 0.5
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when admission control rejects a job"""
+
+def init_worker(events, progress_interval=0.5):
+    """Process pool initializer"""
+    global _worker_events, _progress_interval
+    _worker_events = events
+    _progress_interval = progress_interval
+
+def run_job(task_id, video_path, output_dir, options):
+    """Run one analysis job in a worker process"""
+    # Imported in the worker process
+    from process import analyze_video
+
+    # Progress is reported per decoded frame; send at most one update per progress interval
+    last_sent = [0.0]
+
+    def progress(value):
+        now = time.monotonic()
+        if now - last_sent[0] >= _progress_interval:
+            last_sent[0] = now
+            _worker_events.put((task_id, 'progress', value))
+
+    # Alarms as well, folding the ones in between into the next (or a more dangerous one right away)
+    last_alarm = {'time': 0.0, 'level': 0, 'suppressed': 0}
+
+    def alarm(event):
+        now = time.monotonic()
+        if now - last_alarm['time'] < _progress_interval and event['danger_level'] <= last_alarm['level']:
+            last_alarm['suppressed'] += 1
+            return
+        event['suppressed'] = last_alarm['suppressed']
+        last_alarm.update(time=now, level=event['danger_level'], suppressed=0)
+        _worker_events.put((task_id, 'alarm', event))
+
+    # A job restarted after a crash continues from its last checkpoint
+    return analyze_video(video_path, output_dir, progress, options, resume=True, alarm_callback=alarm)
+
+def owner_gone(pid):
+    """True if the web process that claimed a job (pid on this host) can no longer be running it"""
+    if not pid or pid == os.getpid():
+        # A queue being created in this process has not started any job yet
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+class JobQueue:
+    """
+    Persistent analysis job queue served by a fixed pool of worker processes
+
+    Jobs are stored in SQLite so queued (and interrupted) jobs survive a restart, and several
+    web processes on one host can share the queue (each runs its own pool of `workers`
+    processes). At most max_running jobs (default: workers) run at once on the host, counted
+    over all processes sharing the queue; the next job is the cheapest queued one (estimated analyzed
+    frames), except that jobs waiting longer than max_wait seconds go first so long videos
+    are not starved. submit() raises QueueFull once max_queued jobs are waiting.
+
+    Workers send at most max_progress_rate progress updates per second per job; updates that
+    pile up are coalesced to the latest one per job before on_progress is called. Alarms of
+    running jobs are passed to on_alarm at the same rate (more dangerous ones immediately).
+
+    A job whose worker process dies (e.g. out of memory) is queued again and resumes from
+    its last checkpoint; every job of the broken pool is, since they all lose their worker.
+    After max_attempts such crashes the job fails. on_retry(task_id, error) is called when a
+    job is queued again.
+
+    job_options are added to each job's options when it is dispatched without being stored
+    in the queue (the inference server address and key of this process).
+    """
+
+    def __init__(self, db_path, workers=2, max_queued=20, max_wait=600,
+                 on_start=None, on_progress=None, on_done=None, on_alarm=None, on_retry=None,
+                 job_options=None, max_progress_rate=2.0, max_attempts=3, max_running=None):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_running = max_running or workers
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.on_start = on_start
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_alarm = on_alarm
+        self.on_retry = on_retry
+        self.max_attempts = max_attempts
+        self.job_options = job_options if job_options is not None else {}
+        self.progress_interval = 1.0 / max_progress_rate if max_progress_rate > 0 else 0.0
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.running = 0
+        self.stopped = False
+
+        context = multiprocessing.get_context('spawn')
+        self.events = context.Queue()
+        self.context = context
+        self.executor = self._create_executor()
+
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                task_id TEXT PRIMARY KEY,
+                video_path TEXT NOT NULL,
+                output_dir TEXT NOT NULL,
+                options TEXT NOT NULL,
+                cost REAL NOT NULL,
+                status TEXT NOT NULL,
+                submitted REAL NOT NULL,
+                started REAL,
+                owner INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # Queues created before crashed jobs were retried
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+        if 'attempts' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_cost ON jobs (status, cost, submitted)')
+        # Jobs whose web process is gone (server stopped or crashed) are run again
+        for task_id, owner in conn.execute("SELECT task_id, owner FROM jobs WHERE status = 'running'").fetchall():
+            if owner_gone(owner):
+                conn.execute("UPDATE jobs SET status = 'queued', started = NULL, owner = NULL WHERE task_id = ?", (task_id,))
+        conn.commit()
+        conn.close()
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+                                   initializer=init_worker, initargs=(self.events, self.progress_interval))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def start(self):
+        """Start the dispatcher and progress threads"""
+        threading.Thread(target=self._dispatch_loop, daemon=True).start()
+        threading.Thread(target=self._progress_loop, daemon=True).start()
+
+    def stop(self):
+        """Stop dispatching; running jobs are left to finish"""
+        with self.lock:
+            self.stopped = True
+            self.wakeup.notify_all()
+        self.executor.shutdown(wait=False)
+
+    def submit(self, task_id, video_path, output_dir, options, cost):
+        """Queue a job; returns its queue position"""
+        with self.lock:
+            conn = self._connect()
+            try:
+                queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if queued >= self.max_queued:
+                    raise QueueFull(f"{queued} jobs are already waiting")
+                conn.execute('''
+                    INSERT INTO jobs (task_id, video_path, output_dir, options, cost, status, submitted)
+                    VALUES (?, ?, ?, ?, ?, 'queued', ?)
+                ''', (task_id, video_path, output_dir, json.dumps(options or {}), cost, time.time()))
+                conn.commit()
+            finally:
+                conn.close()
+            self.wakeup.notify_all()
+        return self.position(task_id)
+
+    def cancel(self, task_id):
+        """Remove a job that has not started yet; returns True if it was removed"""
+        with self.lock:
+            conn = self._connect()
+            try:
+                removed = conn.execute("DELETE FROM jobs WHERE task_id = ? AND status = 'queued'", (task_id,)).rowcount
+                conn.commit()
+            finally:
+                conn.close()
+        return removed > 0
+
+    def _ordered_queued(self, conn):
+        """Queued jobs in dispatch order"""
+        return conn.execute('''
+            SELECT task_id, video_path, output_dir, options FROM jobs WHERE status = 'queued'
+            ORDER BY submitted >= :overdue, CASE WHEN submitted < :overdue THEN submitted ELSE cost END, submitted
+        ''', {'overdue': time.time() - self.max_wait}).fetchall()
+
+    def position(self, task_id):
+        """1-based position of a queued job in dispatch order (None if not queued)"""
+        conn = self._connect()
+        try:
+            for position, row in enumerate(self._ordered_queued(conn), 1):
+                if row[0] == task_id:
+                    return position
+        finally:
+            conn.close()
+        return None
+
+    def pending_jobs(self):
+        """(task_id, video_path, output_dir, options) of jobs not finished yet, in dispatch order"""
+        conn = self._connect()
+        try:
+            return [(task_id, video_path, output_dir, json.loads(options))
+                    for task_id, video_path, output_dir, options in self._ordered_queued(conn)]
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Queued / running job counts"""
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        finally:
+            conn.close()
+        return {'queued': counts.get('queued', 0), 'running': counts.get('running', 0), 'workers': self.workers,
+                'max_running': self.max_running}
+
+    def _claim_next(self):
+        """Mark the next queued job as running and return it (None if the queue is empty or the host is busy)"""
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            # Several web processes may share the queue: count and claim under one write lock
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Jobs of a web process that died in the meantime would hold their slots forever
+                for task_id, owner in conn.execute(
+                        "SELECT task_id, owner FROM jobs WHERE status = 'running' AND owner != ?", (os.getpid(),)).fetchall():
+                    if owner_gone(owner):
+                        conn.execute("UPDATE jobs SET status = 'queued', started = NULL, owner = NULL WHERE task_id = ?",
+                                     (task_id,))
+
+                running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+                job = None
+                if running < self.max_running:
+                    for task_id, video_path, output_dir, options in self._ordered_queued(conn)[:1]:
+                        conn.execute('''
+                            UPDATE jobs SET status = 'running', started = ?, owner = ? WHERE task_id = ?
+                        ''', (time.time(), os.getpid(), task_id))
+                        job = task_id, video_path, output_dir, json.loads(options)
+                conn.execute('COMMIT')
+                return job
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def _dispatch_loop(self):
+        while True:
+            with self.lock:
+                job = None
+                while not self.stopped:
+                    if self.running < self.workers:
+                        try:
+                            job = self._claim_next()
+                        except Exception as e:
+                            print(f"Job claim error: {e}")
+                        if job:
+                            break
+                    self.wakeup.wait(timeout=1.0)
+                if self.stopped:
+                    return
+                self.running += 1
+
+            task_id, video_path, output_dir, options = job
+            job = (task_id, video_path, output_dir, dict(options, **self.job_options))
+            with self.lock:
+                executor = self.executor
+            try:
+                if self.on_start:
+                    self.on_start(task_id)
+                try:
+                    future = executor.submit(run_job, *job)
+                except BrokenProcessPool:
+                    executor = self._replace_executor(executor)
+                    future = executor.submit(run_job, *job)
+            except Exception as e:
+                # Finish the claimed job like one whose worker failed (queued again after a crash, else failed)
+                print(f"Could not start job {task_id}: {e}")
+                failed = Future()
+                failed.set_exception(e)
+                try:
+                    self._job_done(task_id, failed, executor)
+                except Exception as e:
+                    print(f"Job {task_id} cleanup error: {e}")
+                continue
+            future.add_done_callback(lambda f, task_id=task_id, executor=executor: self._job_done(task_id, f, executor))
+
+    def _replace_executor(self, broken):
+        """New worker pool after a worker died (once per broken pool)"""
+        with self.lock:
+            if self.executor is broken:
+                self.executor = self._create_executor()
+            return self.executor
+
+    def _requeue(self, task_id):
+        """Queue a job again after its worker died; False once it has crashed max_attempts times"""
+        conn = self._connect()
+        try:
+            requeued = conn.execute('''
+                UPDATE jobs SET status = 'queued', started = NULL, owner = NULL, attempts = attempts + 1
+                WHERE task_id = ? AND attempts + 1 < ?
+            ''', (task_id, self.max_attempts)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return requeued > 0
+
+    def _job_done(self, task_id, future, executor):
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory) and took the pool's other jobs with it: the pool
+            # is replaced and the jobs run again from their last checkpoint
+            self._replace_executor(executor)
+            if self._requeue(task_id):
+                print(f"Worker process crashed, job {task_id} queued again: {e}")
+                with self.lock:
+                    self.running -= 1
+                    self.wakeup.notify_all()
+                if self.on_retry:
+                    self.on_retry(task_id, str(e))
+                return
+            result = {'success': False, 'message': f'Worker process crashed {self.max_attempts} times: {e}',
+                      'error': str(e)}
+        except Exception as e:
+            result = {'success': False, 'message': f'Video analysis failed: {e}', 'error': str(e)}
+
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM jobs WHERE task_id = ?', (task_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self.lock:
+            self.running -= 1
+            self.wakeup.notify_all()
+        if self.on_done:
+            self.on_done(task_id, result)
+
+    def _progress_loop(self):
+        while not self.stopped:
+            events = []
+            try:
+                events.append(self.events.get(timeout=1.0))
+                # Drain what else is waiting so stale progress values are skipped
+                while True:
+                    events.append(self.events.get_nowait())
+            except queue.Empty:
+                pass
+            except Exception:
+                continue
+
+            progress = {}
+            for task_id, event_type, value in events:
+                if event_type == 'progress':
+                    progress[task_id] = value
+                elif self.on_alarm:
+                    self._notify(self.on_alarm, task_id, value)
+            if self.on_progress:
+                for task_id, value in progress.items():
+                    self._notify(self.on_progress, task_id, value)
+
+    def _notify(self, callback, task_id, value):
+        try:
+            callback(task_id, value)
+        except Exception as e:
+            print(f"Progress update error: {e}")
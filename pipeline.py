@@ -0,0 +1,124 @@
+import heapq
+import queue
+import threading
+
+_DONE = object()
+
+def run_pipeline(source, stages, queue_size=8):
+    """
+    Run items from an iterable through threaded stages connected by bounded queues
+
+    Args:
+        source (iterable): Produces the pipeline items (iterated in its own thread)
+        stages (list): (name, function, workers) tuples; each function maps an item
+            to the item passed on to the next stage
+        queue_size (int): Capacity of each inter-stage queue, a full queue blocks
+            the stage in front of it (backpressure)
+
+    Single-worker stages receive items in source order, so stages that depend on
+    frame order (tracking, encoding) stay correct after a parallel stage. The first
+    exception raised by the source or any stage stops the pipeline and is re-raised.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stop = threading.Event()
+    errors = []
+
+    def fail(error):
+        errors.append(error)
+        stop.set()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def feed():
+        try:
+            for seq, item in enumerate(source):
+                if not put(queues[0], (seq, item)):
+                    return
+        except Exception as e:
+            fail(e)
+            return
+        put(queues[0], _DONE)
+
+    def run_stage(index, name, function, workers):
+        input_queue = queues[index]
+        output_queue = queues[index + 1] if index + 1 < len(queues) else None
+        remaining = [workers]
+        lock = threading.Lock()
+
+        def finish():
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and output_queue is not None:
+                put(output_queue, _DONE)
+
+        def emit(seq, item):
+            result = function(item)
+            if output_queue is not None:
+                return put(output_queue, (seq, result))
+            return True
+
+        def unordered_worker():
+            try:
+                while True:
+                    entry = get(input_queue)
+                    if entry is _DONE:
+                        # Let the sibling workers see the end marker too
+                        put(input_queue, _DONE)
+                        break
+                    if not emit(*entry):
+                        return
+            except Exception as e:
+                fail(e)
+                return
+            finish()
+
+        def ordered_worker():
+            buffered = []
+            next_seq = 0
+            try:
+                while True:
+                    entry = get(input_queue)
+                    if entry is _DONE:
+                        break
+                    heapq.heappush(buffered, entry)
+                    while buffered and buffered[0][0] == next_seq:
+                        seq, item = heapq.heappop(buffered)
+                        if not emit(seq, item):
+                            return
+                        next_seq += 1
+            except Exception as e:
+                fail(e)
+                return
+            finish()
+
+        target = ordered_worker if workers == 1 else unordered_worker
+        return [threading.Thread(target=target, name=f"pipeline-{name}-{i}", daemon=True)
+                for i in range(workers)]
+
+    threads = [threading.Thread(target=feed, name="pipeline-source", daemon=True)]
+    for index, (name, function, workers) in enumerate(stages):
+        threads.extend(run_stage(index, name, function, max(1, workers)))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
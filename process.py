@@ -1,5 +1,9 @@
 from deepface import DeepFace
+from deepface.commons import functions as deepface_functions
+from deepface.detectors import FaceDetector
+from deepface.extendedmodels import Emotion, Gender
 import cv2
+import copy
 import math
 import numpy as np
 from norfair import Detection, Tracker
@@ -9,17 +13,165 @@ from datetime import datetime
 import time
 import traceback
 import os
-
-def setup_database(db_path="alarm_analysis.db"):
+import pickle
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pipeline import run_pipeline
+from db_writer import DatabaseWriter, write_rows
+from checkpoint import (video_part_path, checkpoint_options, save_checkpoint, load_checkpoint, remove_checkpoint,
+                        database_marks, trim_database)
+from feed import FrameFeed, feed_path, load_feed_records
+from encoder import VIDEO_ENCODERS, ENCODER_PRESETS, ffmpeg_binary, open_video_encoder, concat_videos
+from geometry import DEFAULT_CROWD_SIZE, assign_track_ids, frame_geometry
+from track_state import TrackStateStore
+from scoring import load_scoring_rules, score_danger, emotion_codes, render_reasons
+from schema import (STORAGE_SCHEMAS, GENDERS, EMOTIONS, DANGER_STATUSES, enum_code, pack_distances,
+                    register_functions, drop_schema, create_compact_schema, create_query_indexes, read_compact_rows)
+from inference_server import (DEFAULT_ADDRESS as INFERENCE_SERVER_ADDRESS, DEFAULT_AUTHKEY as INFERENCE_SERVER_AUTHKEY,
+                              get_inference_client)
+
+# Analysis modes:
+#   deepface - DeepFace.analyze per sampled frame (detection + per-face attribute calls)
+#   batched  - detect once per frame, classify all face crops of several frames in one batch
+#   server   - send frame batches to the shared inference server (inference_server.py)
+ANALYSIS_MODES = ('deepface', 'batched', 'server')
+
+# Sampling modes:
+#   decode_all  - decode every frame, analyze every frame_stride-th one, write all of them
+#   skip_decode - grab() past unsampled frames (seek for large strides), decode/write sampled ones only
+#   adaptive    - check every min_stride-th frame for motion, analyze/write only frames that changed
+#                 (always while an alarm is active, at least every max_stride frames)
+SAMPLING_MODES = ('decode_all', 'skip_decode', 'adaptive')
+
+# Frames of the annotated video: every decoded frame (real-time playback) or only the analyzed ones
+VIDEO_FRAME_MODES = ('all', 'analyzed')
+
+# Adaptive sampling: gray level change that counts a (downscaled) pixel as moving
+MOTION_PIXEL_THRESHOLD = 25
+
+# Sharded analysis: Kalman filter round-off tolerated when comparing tracking state at a segment boundary
+SHARD_STATE_TOLERANCE = 1e-3
+
+# Bump when a change alters analysis results (invalidates cached results, see result_cache.py)
+ANALYSIS_VERSION = 1
+
+DEFAULT_ANALYSIS_OPTIONS = {
+    'analysis_mode': 'deepface',
+    'batch_frames': 4,             # sampled frames per attribute batch (batched/server mode)
+    'detector_backend': 'retinaface',
+    'inference_server_address': INFERENCE_SERVER_ADDRESS,
+    'inference_server_authkey': INFERENCE_SERVER_AUTHKEY,   # hex; both set by the web app for the server it starts
+    'detection_width': 0,          # batched/server: detect on a frame downscaled to this width (0 = 1280)
+    'detection_refine_width': 0,   # re-detect at this larger width when faces are Far/Very Far (0 = off)
+    'attribute_cache': False,      # batched: classify gender/emotion per track instead of per face
+    'gender_votes': 5,             # attribute cache: observations before a track's gender can freeze
+    'gender_confidence': 80.0,     # attribute cache: mean gender score (%) needed to freeze
+    'emotion_refresh_interval': 10,  # attribute cache: reclassify emotion every N sampled frames
+    'emotion_hash_distance': 12,   # attribute cache: or when the crop hash changes by more bits
+    'sampling_mode': 'decode_all',
+    'frame_stride': 5,             # analyze every Nth frame
+    'seek_threshold': 30,          # skip_decode: seek instead of grab() when stride exceeds this
+    'min_stride': 2,               # adaptive: frames between motion checks (densest sampling)
+    'max_stride': 50,              # adaptive: analyze at least every Nth frame even without motion
+    'motion_threshold': 0.005,     # adaptive: fraction of moving pixels that triggers analysis
+    'motion_width': 160,           # adaptive: width of the downscaled frame used for differencing
+    'render_video': True,          # False = headless: no annotated video, frames.ndjson is the annotation sidecar
+    'video_encoder': 'opencv',     # opencv (mp4v VideoWriter) or ffmpeg (H.264 in a subprocess, see encoder.py)
+    'video_frames': 'all',         # all = plays in real time, analyzed = one video frame per analyzed frame
+    'encoder_preset': 'veryfast',  # ffmpeg: x264 speed preset
+    'encoder_crf': 23,             # ffmpeg: x264 quality (lower = better, larger)
+    'encoder_threads': 0,          # ffmpeg: encoder threads (0 = automatic)
+    'pipeline': False,             # run decode/detect/annotate/encode as threaded stages
+    'pipeline_detect_workers': 2,
+    'pipeline_queue_size': 8,      # bounded queue between stages (backpressure)
+    'storage_schema': 'legacy',    # legacy JSON tables or compact coded tables + compatibility views (schema.py)
+    'distance_blob': False,        # compact: pack pairwise distances into a float32 blob per frame
+    'db_writer': True,             # write database rows from a background thread in batched transactions
+    'db_batch_frames': 50,         # db_writer: frames per transaction
+    'db_flush_ms': 500,            # db_writer: max time rows wait before being committed
+    'checkpoint_interval': 0,      # save a resumable checkpoint every N sampled frames (0 = off; serial loop only)
+    'shards': 1,                   # >1: analyze time segments in a process pool
+    'shard_workers': 0,            # pool size, 0 = one per CPU core
+    'shard_overlap': 10,           # sampled frames re-analyzed before each segment to rebuild the tracking state
+    'crowd_size': DEFAULT_CROWD_SIZE,  # faces per frame above which neighbor searches use a KD-tree
+    'scoring_rules': os.environ.get('SCORING_RULES', ''),  # danger scoring table JSON (empty = scoring.py defaults)
+    'detect_interval': 1,          # run face detection on every Nth sampled frame, track faces in between
+    'track_min_score': 0.6,        # template match score below which a tracked frame is re-detected
+    'track_search_margin': 0.5,    # template search window around the predicted box, in box sizes
+}
+
+def build_analysis_options(overrides=None):
+    """Merge per-job overrides into the default analysis options and validate them"""
+    options = dict(DEFAULT_ANALYSIS_OPTIONS)
+    for key, value in (overrides or {}).items():
+        if key not in DEFAULT_ANALYSIS_OPTIONS:
+            raise ValueError(f"Unknown analysis option: {key}")
+        options[key] = value
+
+    if options['analysis_mode'] not in ANALYSIS_MODES:
+        raise ValueError(f"Invalid analysis_mode: {options['analysis_mode']}")
+    if options['detection_width'] < 0 or options['detection_refine_width'] < 0:
+        raise ValueError("Detection widths cannot be negative")
+    if options['detection_width'] and options['analysis_mode'] == 'deepface':
+        raise ValueError("detection_width requires the batched or server analysis mode")
+    if options['attribute_cache'] and options['analysis_mode'] != 'batched':
+        raise ValueError("attribute_cache requires the batched analysis mode")
+    if options['gender_votes'] < 1 or options['emotion_refresh_interval'] < 1:
+        raise ValueError("gender_votes and emotion_refresh_interval must be at least 1")
+    if options['batch_frames'] < 1:
+        raise ValueError("batch_frames must be at least 1")
+    if options['sampling_mode'] not in SAMPLING_MODES:
+        raise ValueError(f"Invalid sampling_mode: {options['sampling_mode']}")
+    if options['frame_stride'] < 1:
+        raise ValueError("frame_stride must be at least 1")
+    if not 1 <= options['min_stride'] <= options['max_stride'] or options['motion_width'] < 16:
+        raise ValueError("Invalid adaptive sampling settings")
+    if options['pipeline_detect_workers'] < 1 or options['pipeline_queue_size'] < 1:
+        raise ValueError("pipeline_detect_workers and pipeline_queue_size must be at least 1")
+    if options['shards'] < 1 or options['shard_workers'] < 0 or options['shard_overlap'] < 0:
+        raise ValueError("Invalid shard settings")
+    if options['storage_schema'] not in STORAGE_SCHEMAS:
+        raise ValueError(f"Invalid storage_schema: {options['storage_schema']}")
+    if options['distance_blob'] and options['storage_schema'] != 'compact':
+        raise ValueError("distance_blob requires the compact storage_schema")
+    if options['db_batch_frames'] < 1 or options['db_flush_ms'] < 0:
+        raise ValueError("Invalid database writer settings")
+    if options['checkpoint_interval'] < 0:
+        raise ValueError("checkpoint_interval cannot be negative")
+    if options['video_encoder'] not in VIDEO_ENCODERS:
+        raise ValueError(f"Invalid video_encoder: {options['video_encoder']}")
+    if options['video_encoder'] == 'ffmpeg' and options['render_video'] and ffmpeg_binary() is None:
+        raise ValueError("video_encoder ffmpeg needs the ffmpeg executable (PATH or FFMPEG_BINARY)")
+    if options['video_frames'] not in VIDEO_FRAME_MODES:
+        raise ValueError(f"Invalid video_frames: {options['video_frames']}")
+    if options['encoder_preset'] not in ENCODER_PRESETS:
+        raise ValueError(f"Invalid encoder_preset: {options['encoder_preset']}")
+    if not 0 <= options['encoder_crf'] <= 51 or options['encoder_threads'] < 0:
+        raise ValueError("Invalid encoder settings")
+    if options['detect_interval'] < 1 or options['track_search_margin'] < 0:
+        raise ValueError("Invalid detect/track settings")
+    if options['scoring_rules']:
+        try:
+            load_scoring_rules(options['scoring_rules'])
+        except (OSError, json.JSONDecodeError) as e:
+            raise ValueError(f"Cannot load scoring rules: {e}")
+
+    return options
+
+def setup_database(db_path="alarm_analysis.db", storage_schema="legacy", distance_blob=False):
     """Database setup with custom path"""
-    conn = sqlite3.connect(db_path)
+    # The connection may be handed to a pipeline thread; it is never used concurrently
+    conn = register_functions(sqlite3.connect(db_path, check_same_thread=False))
     cursor = conn.cursor()
 
-    # Drop existing tables and recreate
-    cursor.execute('DROP TABLE IF EXISTS video_analysis')
-    cursor.execute('DROP TABLE IF EXISTS person_details')
-    cursor.execute('DROP TABLE IF EXISTS person_distances')
-    cursor.execute('DROP TABLE IF EXISTS alarm_events')
+    # Drop existing tables (and views) and recreate
+    drop_schema(cursor)
+
+    if storage_schema == 'compact':
+        create_compact_schema(cursor, distance_blob)
+        conn.commit()
+        return conn
 
     # Main analysis table
     cursor.execute('''
@@ -93,92 +245,61 @@ def setup_database(db_path="alarm_analysis.db"):
     conn.commit()
     return conn
 
-def calculate_danger_level(emotion, speed, bbox_area):
-    """Calculate danger level with clear scoring system (0-10)"""
-    level = 0
-    reasons = []
-
-    # Emotion score (0-4)
-    if emotion:
-        if emotion.lower() == 'fear':
-            level += 4
-            reasons.append("Fear detected")
-        elif emotion.lower() == 'angry':
-            level += 3
-            reasons.append("Anger detected")
-        elif emotion.lower() == 'sad':
-            level += 2
-            reasons.append("Sadness detected")
-
-    # Speed score (0-3)
-    if speed > 100:
-        level += 3
-        reasons.append("Very high speed")
-    elif speed > 60:
-        level += 2
-        reasons.append("High speed")
-    elif speed > 30:
-        level += 1
-        reasons.append("Medium speed")
-
-    # Proximity score (0-2)
-    if bbox_area > 8000:
-        level += 2
-        reasons.append("Very close")
-    elif bbox_area > 5000:
-        level += 1
-        reasons.append("Close")
-
-    # Critical combination bonus
-    if emotion and emotion.lower() == 'fear' and speed > 60:
-        level += 1
-        reasons.append("CRITICAL: Fear + High speed")
-
-    # Cap at 10
-    level = min(level, 10)
+def open_database_writer(conn, db_path, options):
+    """Background writer for a freshly set up database, or the connection itself when disabled"""
+    if options['db_writer']:
+        return DatabaseWriter(db_path, options['db_batch_frames'], options['db_flush_ms'])
+    return conn
 
-    # Determine if dangerous (level >= 5)
-    is_dangerous = level >= 5
-    reason = " | ".join(reasons) if reasons else "Normal"
+def close_database_writer(writer, conn):
+    """Flush and stop a writer returned by open_database_writer"""
+    if writer is not conn:
+        writer.close()
 
-    return is_dangerous, level, reason
+def calculate_danger_level(emotion, speed, bbox_area, rules=None):
+    """Calculate danger level of one person (0-10) with the scoring table (scoring.py)"""
+    rules = rules or load_scoring_rules()
+    levels, masks = score_danger(emotion_codes([emotion]), [speed], [bbox_area], rules)
+    level = int(levels[0])
+    return level >= rules['alarm_level'], level, render_reasons(masks[0], rules)
 
-def find_nearby_persons(current_person_idx, face_centers, face_ids, proximity_threshold=200):
-    """Find nearby persons"""
-    nearby_persons = []
+def find_nearby_persons(current_person_idx, face_centers, face_ids, proximity_threshold=200, neighbors=None):
+    """Find nearby persons (neighbors: the person's precomputed frame_geometry 'nearby' entry)"""
     if current_person_idx >= len(face_centers):
-        return nearby_persons
+        return []
 
-    current_x, current_y = face_centers[current_person_idx]
+    if neighbors is None:
+        neighbors = frame_geometry(face_centers, nearby_threshold=proximity_threshold)['nearby'][current_person_idx]
 
-    for i, (x, y) in enumerate(face_centers):
-        if i != current_person_idx:
-            distance = math.sqrt((current_x - x)**2 + (current_y - y)**2)
-            if distance < proximity_threshold:
-                nearby_persons.append({
-                    'id': face_ids[i] if i < len(face_ids) else -1,
-                    'distance': distance,
-                    'position': (x, y)
-                })
+    return [{
+        'id': face_ids[i] if i < len(face_ids) else -1,
+        'distance': distance,
+        'position': face_centers[i]
+    } for i, distance in neighbors]
 
-    return nearby_persons
-
-def save_alarm_event(conn, timestamp, formatted_time, dangerous_person_id, emotion, speed, nearby_persons, reason, danger_level):
-    """Save alarm event to database"""
+def save_alarm_event(conn, timestamp, formatted_time, dangerous_person_id, emotion, speed, nearby_persons, reason, danger_level, compact=None):
+    """Save alarm event to database (compact: {'frame', 'slot'} of the person for the compact schema)"""
     try:
-        cursor = conn.cursor()
-
         nearby_persons_json = json.dumps([{
             'id': person['id'],
             'distance': person['distance']
         } for person in nearby_persons])
 
-        cursor.execute('''
-            INSERT INTO alarm_events
-            (timestamp, formatted_time, dangerous_person_id, dangerous_person_emotion, dangerous_person_speed,
-             nearby_persons, alarm_reason, danger_level, analysis_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        if compact is not None:
+            write_rows(conn, {'alarms': [(
+                compact['frame'],
+                compact['slot'],
+                dangerous_person_id,
+                enum_code(EMOTIONS, emotion or ''),
+                speed,
+                nearby_persons_json,
+                reason,
+                danger_level,
+                time.time()
+            )]})
+            return
+
+        write_rows(conn, {'alarm_events': [(
             timestamp,
             formatted_time,
             dangerous_person_id,
@@ -188,9 +309,7 @@ def save_alarm_event(conn, timestamp, formatted_time, dangerous_person_id, emoti
             reason,
             danger_level,
             datetime.now().isoformat()
-        ))
-
-        conn.commit()
+        )]})
     except Exception as e:
         print(f"Alarm save error: {e}")
 
@@ -211,21 +330,76 @@ def draw_alarm_warning(frame, alarm_active, alarm_count, max_danger_level):
         cv2.putText(frame, level_text, (50, 120),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
 
-def save_to_database(conn, timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis_results, alarm_data=None):
-    """Save analysis data to database"""
+def save_to_database(conn, timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis_results, alarm_data=None, compact=None):
+    """Save analysis data to database (compact: {'frame', 'distance_blob'} for the compact schema)"""
     try:
-        cursor = conn.cursor()
+        if compact is not None:
+            rows = build_compact_rows(compact['frame'], timestamp, person_count, genders, emotions, speeds, angles,
+                                      face_ids, distances, analysis_results, alarm_data, compact['distance_blob'])
+        else:
+            rows = build_analysis_rows(timestamp, formatted_time, person_count, genders, emotions, speeds,
+                                       angles, face_ids, distances, analysis_results, alarm_data)
+        write_rows(conn, rows)
+    except Exception as e:
+        print(f"Database save error: {e}")
+
+def person_danger_status(face_id, alarm_data):
+    """(danger_status, danger_level, alarm_triggered) stored for a person of an analyzed frame"""
+    if alarm_data:
+        if face_id == alarm_data.get('dangerous_person_id'):
+            return 'dangerous', alarm_data.get('danger_level', 0), 1
+        if face_id in [p['id'] for p in alarm_data.get('nearby_persons', [])]:
+            return 'at_risk', 0, 0
+    return 'normal', 0, 0
+
+def build_compact_rows(frame, timestamp, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis_results, alarm_data=None, distance_blob=False):
+    """Rows of one analyzed frame for the compact schema as {table: [row tuples]}"""
+    rows = {
+        'frames': [(
+            frame,
+            timestamp,
+            person_count,
+            alarm_data.get('reason', '') if alarm_data else None,
+            time.time(),
+            pack_distances(distances) if distance_blob else None
+        )],
+        'persons': [],
+        'pair_distances': []
+    }
+
+    for i, analysis in enumerate(analysis_results[:len(face_ids)]):
+        region = analysis.get('region', {})
+        danger_status, danger_level, _ = person_danger_status(face_ids[i], alarm_data)
+        rows['persons'].append((
+            frame,
+            i,
+            face_ids[i],
+            enum_code(GENDERS, genders[i] if i < len(genders) else ''),
+            enum_code(EMOTIONS, emotions[i] if i < len(emotions) else ''),
+            speeds[i] if i < len(speeds) else 0,
+            angles[i] if i < len(angles) else 0,
+            region.get('x', 0),
+            region.get('y', 0),
+            region.get('w', 0),
+            region.get('h', 0),
+            enum_code(DANGER_STATUSES, danger_status),
+            danger_level
+        ))
+
+    if not distance_blob:
+        rows['pair_distances'] = [(frame, i, j, distance) for i, j, distance in distances]
 
-        # Prepare alarm info
-        alarm_triggered = 1 if alarm_data else 0
-        alarm_reason = alarm_data.get('reason', '') if alarm_data else ''
+    return rows
 
-        # Save main analysis data
-        cursor.execute('''
-            INSERT INTO video_analysis
-            (timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis_date, alarm_triggered, alarm_reason)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+def build_analysis_rows(timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis_results, alarm_data=None):
+    """Rows of one analyzed frame as {table: [row tuples]}"""
+    # Prepare alarm info
+    alarm_triggered = 1 if alarm_data else 0
+    alarm_reason = alarm_data.get('reason', '') if alarm_data else ''
+
+    # Main analysis data
+    rows = {
+        'video_analysis': [(
             timestamp,
             formatted_time,
             person_count,
@@ -238,69 +412,51 @@ def save_to_database(conn, timestamp, formatted_time, person_count, genders, emo
             datetime.now().isoformat(),
             alarm_triggered,
             alarm_reason
-        ))
-
-        # Save detailed person data
-        for i, analysis in enumerate(analysis_results):
-            if i < len(face_ids):
-                region = analysis.get('region', {})
-
-                # Check alarm status
-                is_dangerous = 0
-                danger_status = 'normal'
-                danger_level = 0
-
-                if alarm_data:
-                    if face_ids[i] == alarm_data.get('dangerous_person_id'):
-                        is_dangerous = 1
-                        danger_status = 'dangerous'
-                        danger_level = alarm_data.get('danger_level', 0)
-                    elif face_ids[i] in [p['id'] for p in alarm_data.get('nearby_persons', [])]:
-                        danger_status = 'at_risk'
-
-                cursor.execute('''
-                    INSERT INTO person_details
-                    (timestamp, face_id, gender, emotion, speed, angle, bbox_area, distance_category, x, y, width, height, danger_status, danger_level, alarm_triggered)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
+        )],
+        'person_details': [],
+        'person_distances': []
+    }
+
+    # Detailed person data
+    for i, analysis in enumerate(analysis_results):
+        if i < len(face_ids):
+            region = analysis.get('region', {})
+
+            # Check alarm status
+            danger_status, danger_level, is_dangerous = person_danger_status(face_ids[i], alarm_data)
+
+            rows['person_details'].append((
+                timestamp,
+                face_ids[i],
+                genders[i] if i < len(genders) else '',
+                emotions[i] if i < len(emotions) else '',
+                speeds[i] if i < len(speeds) else 0,
+                angles[i] if i < len(angles) else 0,
+                region.get('w', 0) * region.get('h', 0),
+                get_distance_category(region.get('w', 0) * region.get('h', 0)),
+                region.get('x', 0),
+                region.get('y', 0),
+                region.get('w', 0),
+                region.get('h', 0),
+                danger_status,
+                danger_level,
+                is_dangerous
+            ))
+
+    # Distance data
+    for dist_data in distances:
+        if len(dist_data) >= 3:
+            person1_idx, person2_idx, distance = dist_data[:3]
+            if person1_idx < len(face_ids) and person2_idx < len(face_ids):
+                rows['person_distances'].append((
                     timestamp,
-                    face_ids[i],
-                    genders[i] if i < len(genders) else '',
-                    emotions[i] if i < len(emotions) else '',
-                    speeds[i] if i < len(speeds) else 0,
-                    angles[i] if i < len(angles) else 0,
-                    region.get('w', 0) * region.get('h', 0),
-                    get_distance_category(region.get('w', 0) * region.get('h', 0)),
-                    region.get('x', 0),
-                    region.get('y', 0),
-                    region.get('w', 0),
-                    region.get('h', 0),
-                    danger_status,
-                    danger_level,
-                    is_dangerous
+                    face_ids[person1_idx],
+                    face_ids[person2_idx],
+                    distance,
+                    1 if distance < 150 else 0
                 ))
 
-        # Save distance data
-        for dist_data in distances:
-            if len(dist_data) >= 3:
-                person1_idx, person2_idx, distance = dist_data[:3]
-                if person1_idx < len(face_ids) and person2_idx < len(face_ids):
-                    cursor.execute('''
-                        INSERT INTO person_distances
-                        (timestamp, person1_id, person2_id, distance, is_close)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (
-                        timestamp,
-                        face_ids[person1_idx],
-                        face_ids[person2_idx],
-                        distance,
-                        1 if distance < 150 else 0
-                    ))
-
-        conn.commit()
-
-    except Exception as e:
-        print(f"Database save error: {e}")
+    return rows
 
 def format_time(seconds):
     mins = int(seconds // 60)
@@ -385,8 +541,1444 @@ def print_database_stats(conn):
     except Exception as e:
         print(f"Statistics error: {e}")
 
+def iter_video_frames(cap, options, state, start_frame=0, end_frame=None):
+    """Yield (frame_number, frame, is_sampled) for [start_frame, end_frame); sampled frames are resized to 1280x720"""
+    stride = options['frame_stride']
+    frame_number = start_frame
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    if options['sampling_mode'] == 'adaptive':
+        yield from iter_adaptive_frames(cap, options, state, start_frame, end_frame)
+        return
+
+    if options['sampling_mode'] == 'decode_all':
+        while end_frame is None or frame_number < end_frame:
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            state['frames_read'] = frame_number + 1
+            is_sampled = frame_number % stride == 0
+            if is_sampled:
+                frame = cv2.resize(frame, (1280, 720))
+
+            yield frame_number, frame, is_sampled
+            frame_number += 1
+        return
+
+    # skip_decode: only sampled frames are decoded
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if end_frame is not None and frame_count > 0:
+        frame_count = min(frame_count, end_frame)
+    use_seek = stride > options['seek_threshold'] and frame_count > 0
+    while end_frame is None or frame_number < end_frame:
+        ret, frame = cap.read()
+        if not ret:
+            if use_seek:
+                state['frames_read'] = max(state['frames_read'], frame_count)
+            break
+
+        state['frames_read'] = frame_number + 1
+        yield frame_number, cv2.resize(frame, (1280, 720)), True
+
+        frame_number += stride
+        if use_seek:
+            # Seeking avoids demuxing long gaps but is keyframe-bound on some codecs
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        else:
+            for _ in range(stride - 1):
+                if not cap.grab():
+                    return
+                state['frames_read'] += 1
+
+def motion_frame(frame, width):
+    """Downscaled, blurred grayscale copy of a frame for cheap differencing"""
+    height = max(1, int(frame.shape[0] * width / frame.shape[1]))
+    small = cv2.cvtColor(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(small, (5, 5), 0)
+
+def frame_changed(small, reference, threshold):
+    """Whether enough pixels of a motion frame moved since the reference (always True without one)"""
+    if reference is None:
+        return True
+    changed = cv2.absdiff(small, reference) > MOTION_PIXEL_THRESHOLD
+    return np.count_nonzero(changed) >= threshold * changed.size
+
+def iter_adaptive_frames(cap, options, state, start_frame=0, end_frame=None):
+    """Yield only frames that changed since the last analyzed one (see SAMPLING_MODES)"""
+    step = options['min_stride']
+    frame_number = start_frame
+    # Kept in the state so a resumed run compares against the same frame
+    reference = state['motion_reference']
+    last_sampled = state['last_sampled']
+
+    while end_frame is None or frame_number < end_frame:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        state['frames_read'] = frame_number + 1
+
+        # Compare against the last analyzed frame so slow motion still adds up
+        small = motion_frame(frame, options['motion_width'])
+        moving = frame_changed(small, reference, options['motion_threshold'])
+
+        if (moving or state['alarm_active'] or last_sampled is None
+                or frame_number - last_sampled >= options['max_stride']):
+            reference = state['motion_reference'] = small
+            last_sampled = state['last_sampled'] = frame_number
+            yield frame_number, cv2.resize(frame, (1280, 720)), True
+
+        frame_number += step
+        for _ in range(step - 1):
+            if not cap.grab():
+                return
+            state['frames_read'] += 1
+
+def sampling_stride(options):
+    """Frame grid that sampled frames fall on"""
+    if options['sampling_mode'] == 'adaptive':
+        return options['min_stride']
+    return options['frame_stride']
+
+def output_video_timing(fps, options):
+    """
+    Frame rate of the annotated video and the source frames per video frame
+
+    The step is None for analyzed-only videos (one video frame per analyzed frame,
+    at the sampling rate). Otherwise source frame n goes to video frame n // step,
+    and video frames without an analyzed frame repeat the previous one.
+    """
+    if options['video_frames'] == 'analyzed':
+        return fps / sampling_stride(options), None
+    if options['sampling_mode'] == 'decode_all':
+        return fps, 1
+    return fps / sampling_stride(options), sampling_stride(options)
+
+def write_video_frames(out, pending, step):
+    """Write the frames of a batch at their place in the output video"""
+    for frame_number, frame, is_sampled in pending:
+        if step is None:
+            if is_sampled:
+                out.write(frame)
+        else:
+            out.write(frame, frame_number // step)
+
+def estimate_analysis_cost(video_path, options=None):
+    """Estimated number of analyzed frames of a job (frame count / sampling stride), for queue ordering"""
+    options = build_analysis_options(options)
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    cap.release()
+    return max(total_frames, 1) / sampling_stride(options)
+
+def extract_frame_faces(frame, detector_backend="retinaface", detection_width=0, refine_width=0):
+    """
+    Detect faces once and return preprocessed 224x224 crops with their regions
+
+    With detection_width set, detection runs on a downscaled copy of the frame and the boxes
+    are mapped back to frame coordinates; crops are still cut from the frame itself. If any face
+    comes out "Far"/"Very Far" and refine_width is larger, detection is repeated at refine_width.
+    """
+    faces = detect_frame_faces(frame, detector_backend, detection_width)
+
+    if detection_width and refine_width > detection_width:
+        small_faces = [face for face in faces if face['confidence'] > 0 and
+                       get_distance_category(face['region']['w'] * face['region']['h']) in ("Far", "Very Far")]
+        if small_faces:
+            faces = detect_frame_faces(frame, detector_backend, refine_width)
+
+    return faces
+
+def detect_frame_faces(frame, detector_backend, detection_width=0):
+    """Face crops and frame-coordinate regions from detection at the given width (0 = frame size)"""
+    frame_h, frame_w = frame.shape[:2]
+    if not detection_width or detection_width >= frame_w:
+        face_objs = deepface_functions.extract_faces(img=frame,
+                                                     target_size=(224, 224),
+                                                     detector_backend=detector_backend,
+                                                     grayscale=False,
+                                                     enforce_detection=False,
+                                                     align=True)
+        return [{'region': region, 'confidence': confidence, 'face': img_content[0]}
+                for img_content, region, confidence in face_objs
+                if img_content.shape[0] > 0 and img_content.shape[1] > 0]
+
+    scale = frame_w / detection_width
+    small = cv2.resize(frame, (detection_width, max(1, round(frame_h / scale))), interpolation=cv2.INTER_AREA)
+    detector = FaceDetector.build_model(detector_backend)
+    detections = FaceDetector.detect_faces(detector, detector_backend, small, False)
+
+    boxes = []
+    for _, (x, y, w, h), confidence in detections:
+        x0, y0 = max(0, int(x * scale)), max(0, int(y * scale))
+        x1, y1 = min(frame_w, int((x + w) * scale)), min(frame_h, int((y + h) * scale))
+        if x1 > x0 and y1 > y0:
+            boxes.append(((x0, y0, x1 - x0, y1 - y0), confidence))
+
+    # Same fallback as extract_faces(enforce_detection=False): the whole frame
+    if not boxes:
+        boxes = [((0, 0, frame_w, frame_h), 0)]
+
+    faces = []
+    for (x, y, w, h), confidence in boxes:
+        # Reuse DeepFace's resize/pad/normalize on the full resolution crop (no alignment: no landmarks)
+        crop = deepface_functions.extract_faces(img=frame[y:y + h, x:x + w],
+                                                target_size=(224, 224),
+                                                detector_backend="skip",
+                                                grayscale=False,
+                                                enforce_detection=False,
+                                                align=False)
+        faces.append({'region': {'x': x, 'y': y, 'w': w, 'h': h}, 'confidence': confidence, 'face': crop[0][0][0]})
+
+    return faces
+
+def classify_faces(faces):
+    """Run gender and emotion models once over all face crops (same output as DeepFace.analyze)"""
+    classify_gender(faces)
+    classify_emotion(faces)
+    return faces
+
+def classify_gender(faces):
+    """Gender model over a batch of face crops"""
+    if not faces:
+        return faces
+
+    crops = np.stack([face['face'] for face in faces])
+    gender_predictions = DeepFace.build_model("Gender").predict(crops, verbose=0)
+
+    for face, gender_pred in zip(faces, gender_predictions):
+        face['gender'] = {label: 100 * gender_pred[i] for i, label in enumerate(Gender.labels)}
+        face['dominant_gender'] = Gender.labels[np.argmax(gender_pred)]
+
+    return faces
+
+def classify_emotion(faces):
+    """Emotion model over a batch of face crops"""
+    if not faces:
+        return faces
+
+    grays = np.stack([cv2.resize(cv2.cvtColor(face['face'], cv2.COLOR_BGR2GRAY), (48, 48)) for face in faces])
+    emotion_predictions = DeepFace.build_model("Emotion").predict(grays, verbose=0)
+
+    for face, emotion_pred in zip(faces, emotion_predictions):
+        emotion_sum = emotion_pred.sum()
+        face['emotion'] = {label: 100 * emotion_pred[i] / emotion_sum for i, label in enumerate(Emotion.labels)}
+        face['dominant_emotion'] = Emotion.labels[np.argmax(emotion_pred)]
+
+    return faces
+
+def analyze_frames_batched(frames, detector_backend="retinaface", detection_width=0, refine_width=0, classify=True):
+    """Detect faces per frame, then classify the crops of all frames in a single batch"""
+    frame_faces = [extract_frame_faces(frame, detector_backend, detection_width, refine_width) for frame in frames]
+    if not classify:
+        # Attributes come from the per-track cache after tracking; keep the crops
+        return frame_faces
+
+    classify_faces([face for faces in frame_faces for face in faces])
+
+    # Crops are only needed for classification
+    for faces in frame_faces:
+        for face in faces:
+            face.pop('face', None)
+
+    return frame_faces
+
+def perceptual_hash(crop):
+    """64-bit DCT hash of a face crop; a large Hamming distance means the face looks different"""
+    gray = cv2.cvtColor(np.float32(crop), cv2.COLOR_BGR2GRAY)
+    dct = cv2.dct(cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA))[:8, :8]
+    return dct > np.median(dct)
+
+def create_attribute_cache(options):
+    """Per-track gender/emotion cache (see apply_attribute_cache)"""
+    return {
+        'tracks': {},
+        'gender_votes': options['gender_votes'],
+        'gender_confidence': options['gender_confidence'],
+        'emotion_refresh_interval': options['emotion_refresh_interval'],
+        'emotion_hash_distance': options['emotion_hash_distance'],
+        'faces': 0,
+        'gender_calls': 0,
+        'emotion_calls': 0
+    }
+
+def apply_attribute_cache(analysis, face_ids, state):
+    """
+    Fill gender/emotion of detected faces from the per-track cache, classifying only misses
+
+    Gender is frozen once the mean of the first gender_votes observations is confident enough.
+    Emotion is reclassified every emotion_refresh_interval sampled frames, or earlier when the
+    crop's perceptual hash moved more than emotion_hash_distance bits. Dead tracks are evicted.
+    """
+    cache = state['attribute_cache']
+    tracks = cache['tracks']
+
+    alive = {obj.id for obj in state['tracker'].tracked_objects if obj.id is not None}
+    for track_id in list(tracks):
+        if track_id not in alive:
+            del tracks[track_id]
+
+    need_gender, need_emotion, hashes = [], [], {}
+    for i, person in enumerate(analysis):
+        if 'face' not in person:
+            # Tracked (not detected) face: attributes were carried over
+            continue
+
+        cache['faces'] += 1
+        entry = tracks.get(face_ids[i]) if face_ids[i] != -1 else None
+        hashes[i] = perceptual_hash(person['face'])
+
+        if entry is None or entry['gender'] is None:
+            need_gender.append(i)
+        else:
+            person['gender'] = entry['gender_scores']
+            person['dominant_gender'] = entry['gender']
+
+        if (entry is None or entry['emotion'] is None
+                or entry['emotion_age'] >= cache['emotion_refresh_interval']
+                or np.count_nonzero(hashes[i] != entry['hash']) > cache['emotion_hash_distance']):
+            need_emotion.append(i)
+        else:
+            person['emotion'] = entry['emotion']
+            person['dominant_emotion'] = entry['dominant_emotion']
+            entry['emotion_age'] += 1
+
+    classify_gender([analysis[i] for i in need_gender])
+    classify_emotion([analysis[i] for i in need_emotion])
+    cache['gender_calls'] += len(need_gender)
+    cache['emotion_calls'] += len(need_emotion)
+
+    for i in hashes:
+        person = analysis[i]
+        person.pop('face')
+        if face_ids[i] == -1:
+            continue
+
+        entry = tracks.setdefault(face_ids[i], {
+            'votes': np.zeros(len(Gender.labels)),
+            'observations': 0,
+            'gender': None,
+            'gender_scores': None,
+            'emotion': None,
+            'dominant_emotion': None,
+            'emotion_age': 0,
+            'hash': None
+        })
+
+        if i in need_gender:
+            entry['votes'] += [person['gender'][label] for label in Gender.labels]
+            entry['observations'] += 1
+            mean_votes = entry['votes'] / entry['observations']
+            if entry['observations'] >= cache['gender_votes'] and mean_votes.max() >= cache['gender_confidence']:
+                entry['gender'] = Gender.labels[int(np.argmax(mean_votes))]
+                entry['gender_scores'] = {label: mean_votes[k] for k, label in enumerate(Gender.labels)}
+
+        if i in need_emotion:
+            entry['emotion'] = person['emotion']
+            entry['dominant_emotion'] = person['dominant_emotion']
+            entry['emotion_age'] = 0
+            entry['hash'] = hashes[i]
+
+def detection_settings(options):
+    """Detector arguments of analyze_frames_batched for a job"""
+    return options['detector_backend'], options['detection_width'], options['detection_refine_width']
+
+def analyze_frames(frames, options):
+    """Analyze sampled frames; a failed frame yields its exception instead of a result list"""
+    if options['analysis_mode'] == 'batched':
+        try:
+            return analyze_frames_batched(frames, *detection_settings(options), classify=not options['attribute_cache'])
+        except Exception as e:
+            return [e] * len(frames)
+
+    if options['analysis_mode'] == 'server':
+        if not options['inference_server_address']:
+            raise Exception("No inference server address configured")
+        try:
+            client = get_inference_client(options['inference_server_address'],
+                                          bytes.fromhex(options['inference_server_authkey']))
+            return client.analyze(frames, detection_settings(options))
+        except (ConnectionError, FileNotFoundError, EOFError, multiprocessing.AuthenticationError):
+            # The server is gone or rejects us: every later frame would fail too, so fail the job
+            raise
+        except Exception as e:
+            return [e] * len(frames)
+
+    results = []
+    for frame in frames:
+        try:
+            analysis = DeepFace.analyze(frame,
+                                        actions=['gender', 'emotion'],
+                                        detector_backend=options['detector_backend'],
+                                        enforce_detection=False)
+            if isinstance(analysis, dict):
+                analysis = [analysis]
+            results.append(analysis)
+        except Exception as e:
+            results.append(e)
+
+    return results
+
+def create_analysis_state(options=None):
+    """Per-video tracking state shared across sampled frames"""
+    return {
+        'tracker': Tracker(distance_function="euclidean", distance_threshold=40),
+        'track_state': TrackStateStore(),
+        'frame_results': [],
+        'processed_frames': 0,
+        'error_frames': 0,
+        'total_alarms': 0,
+        'max_danger_detected': 0,
+        'frames_read': 0,
+        'tracked_faces': None,
+        'alarm_active': False,
+        'attribute_cache': create_attribute_cache(options) if options and options['attribute_cache'] else None,
+        'storage_schema': options['storage_schema'] if options else 'legacy',
+        'distance_blob': bool(options and options['distance_blob']),
+        'frame_number': None,
+        'motion_reference': None,
+        'last_sampled': None,
+        'crowd_size': options['crowd_size'] if options else DEFAULT_CROWD_SIZE,
+        'scoring_rules': load_scoring_rules(options['scoring_rules'] if options else '')
+    }
+
+def process_frame_analysis(analysis, timestamp, formatted_time, state, conn):
+    """Track, score and store the faces found on one sampled frame; returns the frame record"""
+    record = {
+        'timestamp': timestamp,
+        'formatted_time': formatted_time,
+        'person_count': len(analysis),
+        'persons': [],
+        'close_pairs': [],
+        'alarm': None,
+        'error': None
+    }
+
+    if len(analysis) == 0:
+        # No person detected
+        return record
+
+    # Calculate face centers and bbox areas
+    face_centers = []
+    bbox_areas = []
+
+    for person in analysis:
+        region = person.get('region', {})
+        x, y, w, h = region.get('x', 0), region.get('y', 0), region.get('w', 50), region.get('h', 50)
+        cx, cy = x + w // 2, y + h // 2
+        bbox_area = w * h
+
+        face_centers.append((cx, cy))
+        bbox_areas.append(bbox_area)
+
+    # Tracking
+    norfair_detections = [Detection(points=np.array([[cx, cy]])) for cx, cy in face_centers]
+    tracked_objects = state['tracker'].update(detections=norfair_detections)
+
+    # Drop the motion state of tracks Norfair has forgotten
+    track_state = state['track_state']
+    track_state.evict({obj.id for obj in state['tracker'].tracked_objects if obj.id is not None})
+
+    # Face ID matching and pairwise distances, once per frame
+    face_ids = assign_track_ids(face_centers, tracked_objects, state['crowd_size'])
+    geometry = frame_geometry(face_centers, crowd_size=state['crowd_size'])
+
+    # Attributes are looked up per track once IDs are known
+    if state['attribute_cache'] is not None:
+        apply_attribute_cache(analysis, face_ids, state)
+
+    # Compact schema rows are keyed by frame number
+    compact = None
+    if state['storage_schema'] == 'compact':
+        compact = {'frame': state['frame_number'], 'distance_blob': state['distance_blob']}
+
+    # Motion analysis
+    genders, speeds, angles = [], [], []
+    alarm_active = False
+    alarm_count = 0
+    max_danger_level = 0
+    alarm_data = None
+    dangerous_persons = []
+
+    motions = []
+    for i, person in enumerate(analysis):
+        region = person.get('region', {})
+        x, y, w, h = region.get('x', 0), region.get('y', 0), region.get('w', 50), region.get('h', 50)
+        cx, cy = x + w // 2, y + h // 2
+        bbox_area = w * h
+
+        matched_id = face_ids[i] if i < len(face_ids) else -1
+        prev_center = None
+
+        # Speed calculation
+        prev_data = track_state.get_position(matched_id)
+        if prev_data is not None:
+            px, py, prev_bbox_area, prev_timestamp = prev_data
+
+            dx = cx - px
+            dy = cy - py
+            dt = timestamp - prev_timestamp
+
+            if abs(dx) < 2 and abs(dy) < 2:
+                speed = 0.0
+                angle = 0.0
+            else:
+                speed = calculate_normalized_speed(dx, dy, bbox_area, dt)
+                angle = math.degrees(math.atan2(dy, dx))
+
+                # Speed smoothing (ring buffer of the last speeds)
+                speed = track_state.add_speed(matched_id, speed)
+
+                # Motion arrow start
+                prev_center = (int(px), int(py))
+        else:
+            speed = 0.0
+            angle = 0.0
+
+        # Update position
+        track_state.set_position(matched_id, cx, cy, bbox_area, timestamp)
+
+        motions.append((matched_id, speed, angle, prev_center))
+        speeds.append(speed)
+        angles.append(angle)
+
+    # Danger levels of all persons of the frame in one call
+    rules = state['scoring_rules']
+    emotions = [person.get('dominant_emotion', '') for person in analysis]
+    danger_levels, reason_masks = score_danger(emotion_codes(emotions), speeds, bbox_areas, rules)
+    danger_levels = danger_levels.tolist()
+    if danger_levels:
+        state['max_danger_detected'] = max(state['max_danger_detected'], max(danger_levels))
+
+    for i, person in enumerate(analysis):
+        dominant_gender = person.get('dominant_gender', '')
+        dominant_emotion = emotions[i]
+        region = person.get('region', {})
+        x, y, w, h = region.get('x', 0), region.get('y', 0), region.get('w', 50), region.get('h', 50)
+        matched_id, speed, angle, prev_center = motions[i]
+        danger_level = danger_levels[i]
+        is_dangerous = danger_level >= rules['alarm_level']
+
+        record['persons'].append({
+            'id': matched_id,
+            'gender': dominant_gender,
+            'emotion': dominant_emotion,
+            'x': x, 'y': y, 'w': w, 'h': h,
+            'speed': speed,
+            'angle': angle,
+            'danger_level': danger_level,
+            'is_dangerous': is_dangerous,
+            'distance_category': get_distance_category(bbox_areas[i]),
+            'prev_center': prev_center
+        })
+
+        genders.append(dominant_gender)
+
+        # Alarm processing
+        if is_dangerous:
+            alarm_active = True
+            alarm_count += 1
+            max_danger_level = max(max_danger_level, danger_level)
+
+            nearby_persons = find_nearby_persons(i, face_centers, face_ids, neighbors=geometry['nearby'][i])
+            # Reason text is only rendered for alarms
+            danger_reason = render_reasons(reason_masks[i], rules)
+
+            dangerous_persons.append({
+                'id': matched_id,
+                'emotion': dominant_emotion,
+                'speed': speed,
+                'nearby_persons': nearby_persons,
+                'reason': danger_reason,
+                'danger_level': danger_level
+            })
+
+            # Save alarm event
+            if conn is not None:
+                save_alarm_event(conn, timestamp, formatted_time, matched_id,
+                               dominant_emotion, speed, nearby_persons, danger_reason, danger_level,
+                               compact=dict(compact, slot=i) if compact else None)
+
+                print(f"ALARM! Time: {formatted_time}, Person ID: {matched_id}, Level: {danger_level}")
+            state['total_alarms'] += 1
+
+    if alarm_active:
+        record['alarm'] = {'count': alarm_count, 'danger_level': max_danger_level}
+        alarm_data = {
+            'dangerous_person_id': dangerous_persons[0]['id'] if dangerous_persons else -1,
+            'nearby_persons': dangerous_persons[0]['nearby_persons'] if dangerous_persons else [],
+            'reason': f"{alarm_count} person(s) in dangerous state",
+            'danger_level': max_danger_level
+        }
+
+    # Distance checking
+    distances = geometry['pairs']
+    for i, j, distance in geometry['close_pairs']:
+        x1, y1 = face_centers[i]
+        x2, y2 = face_centers[j]
+        record['close_pairs'].append((x1, y1, x2, y2, distance))
+
+    # Save to database
+    person_count = len(analysis)
+    if conn is not None:
+        save_to_database(conn, timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis, alarm_data, compact)
+
+    state['frame_results'].append((timestamp, person_count, genders, emotions, speeds, distances, face_ids))
+    state['processed_frames'] += 1
+
+    # Progress
+    if state['processed_frames'] % 20 == 0:
+        print(f"Processed frames: {state['processed_frames']}, Persons: {person_count}, Time: {formatted_time}")
+
+    return record
+
+def draw_frame_record(frame, record):
+    """Draw boxes, labels, motion arrows, close pairs and alarm banner of a frame record"""
+    if record['error'] is not None:
+        cv2.putText(frame, f"{record['formatted_time']} -> ERROR", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        return
+
+    if record['person_count'] == 0:
+        cv2.putText(frame, f"{record['formatted_time']} -> No person detected", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        return
+
+    for person in record['persons']:
+        x, y, w, h = person['x'], person['y'], person['w'], person['h']
+        danger_level = person['danger_level']
+
+        # Draw motion arrow
+        if person['prev_center'] is not None:
+            cx, cy = x + w // 2, y + h // 2
+            cv2.arrowedLine(frame, tuple(person['prev_center']), (int(cx), int(cy)), (0, 255, 0), 2, tipLength=0.3)
+
+        # Choose box color based on danger level
+        box_color = get_danger_color(danger_level)
+        box_thickness = 3 if person['is_dangerous'] else 1
+
+        # Draw bounding box
+        cv2.rectangle(frame, (x, y), (x + w, y + h), box_color, box_thickness)
+
+        # Clean label - only essential info
+        label = f"ID:{person['id']} {person['gender']} {person['emotion']} {person['distance_category']}"
+        cv2.putText(frame, label, (x, y - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 2)
+
+        # Speed display
+        if person['speed'] > 0:
+            speed_color = get_danger_color(danger_level)
+            speed_text = f"{person['speed']:.1f} px/s"
+            cv2.putText(frame, speed_text, (x, y - 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, speed_color, 2)
+
+        # Danger level display for dangerous persons
+        if person['is_dangerous']:
+            level_text = f"DANGER: {danger_level}/10"
+            cv2.putText(frame, level_text, (x, y - 50),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+    # Draw alarm warning
+    if record['alarm']:
+        draw_alarm_warning(frame, True, record['alarm']['count'], record['alarm']['danger_level'])
+
+    # Close pairs
+    for x1, y1, x2, y2, distance in record['close_pairs']:
+        mid_x, mid_y = (x1 + x2) // 2, (y1 + y2) // 2
+        cv2.line(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        cv2.putText(frame, f"{int(distance)} px", (mid_x, mid_y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+    # Time information
+    cv2.putText(frame, f"{record['formatted_time']} -> {record['person_count']} person(s)", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+
+def process_sampled_frame(frame_number, fps, analysis, state, conn, timestamp=None):
+    """Process a sampled frame; a failed analysis yields an error record"""
+    # Calculate timestamp (live streams pass the capture time instead)
+    if timestamp is None:
+        timestamp = frame_number / fps
+    formatted_time = format_time(timestamp)
+
+    try:
+        if isinstance(analysis, Exception):
+            raise analysis
+
+        state['frame_number'] = frame_number
+        record = process_frame_analysis(analysis, timestamp, formatted_time, state, conn)
+
+    except Exception as e:
+        print(f"Frame {frame_number} error: {e}")
+        print(traceback.format_exc())
+        state['error_frames'] += 1
+        record = {
+            'timestamp': timestamp,
+            'formatted_time': formatted_time,
+            'person_count': 0,
+            'persons': [],
+            'close_pairs': [],
+            'alarm': None,
+            'error': str(e)
+        }
+
+    record['frame_number'] = frame_number
+    # Adaptive sampling keeps analyzing every checked frame while an alarm is on
+    state['alarm_active'] = record['alarm'] is not None
+    return record
+
+def needs_detection(frame_number, options):
+    """Whether a sampled frame runs face detection or follows the faces of the previous one"""
+    return (frame_number // sampling_stride(options)) % options['detect_interval'] == 0
+
+def track_frame_faces(frame, state, options):
+    """Move the faces of the previous sampled frame using tracker prediction + template search; None if lost"""
+    if state['tracked_faces'] is None:
+        return None
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    frame_h, frame_w = gray.shape
+    estimates = {obj.id: (obj.estimate[0], obj.estimate_velocity[0])
+                 for obj in state['tracker'].tracked_objects if obj.id is not None}
+
+    analysis = []
+    for face in state['tracked_faces']:
+        template = face['template']
+        h, w = template.shape
+        region = face['analysis']['region']
+        cx, cy = region['x'] + w / 2, region['y'] + h / 2
+        vx = vy = 0.0
+
+        # Center the search on the tracker's prediction for this face
+        if face['id'] in estimates:
+            (ex, ey), (vx, vy) = estimates[face['id']]
+            cx, cy = ex + vx, ey + vy
+
+        margin = int(max(w, h) * options['track_search_margin'] + abs(vx) + abs(vy))
+        x0 = max(0, int(cx - w / 2) - margin)
+        y0 = max(0, int(cy - h / 2) - margin)
+        x1 = min(frame_w, int(cx + w / 2) + margin)
+        y1 = min(frame_h, int(cy + h / 2) + margin)
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < h or window.shape[1] < w:
+            return None
+
+        scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(scores)
+        if not score >= options['track_min_score']:
+            return None
+
+        person = dict(face['analysis'])
+        person['region'] = dict(region, x=x0 + location[0], y=y0 + location[1], w=w, h=h)
+        analysis.append(person)
+
+    return analysis
+
+def update_tracked_faces(frame, analysis, record, state):
+    """Keep the boxes, attributes and grayscale templates of a processed frame for tracking"""
+    if record['error'] is not None:
+        state['tracked_faces'] = None
+        return
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    frame_h, frame_w = gray.shape
+    tracked_faces = []
+    for person_analysis, person in zip(analysis, record['persons']):
+        x0, y0 = max(0, person['x']), max(0, person['y'])
+        x1, y1 = min(frame_w, person['x'] + person['w']), min(frame_h, person['y'] + person['h'])
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            # Nothing left to match against: re-detect on the next frame
+            state['tracked_faces'] = None
+            return
+
+        person_analysis = dict(person_analysis)
+        person_analysis['region'] = {'x': x0, 'y': y0, 'w': x1 - x0, 'h': y1 - y0}
+        tracked_faces.append({
+            'id': person['id'],
+            'analysis': person_analysis,
+            'template': gray[y0:y1, x0:x1].copy()
+        })
+
+    state['tracked_faces'] = tracked_faces
+
+def analyze_sampled_frame(frame_number, frame, fps, analysis, state, conn, options, timestamp=None):
+    """Process a sampled frame, tracking its faces when detection was skipped (analysis is None)"""
+    if analysis is None:
+        analysis = track_frame_faces(frame, state, options)
+        if analysis is None:
+            # Tracker lost confidence: fall back to a full detection
+            analysis = analyze_frames([frame], options)[0]
+
+    record = process_sampled_frame(frame_number, fps, analysis, state, conn, timestamp)
+
+    if options['detect_interval'] > 1:
+        update_tracked_faces(frame, analysis, record, state)
+
+    return record
+
+def iter_frame_batches(frames, batch_size):
+    """Group frames into runs holding batch_size sampled frames (plus the unsampled ones between)"""
+    pending = []
+    sampled_count = 0
+    for item in frames:
+        pending.append(item)
+        if item[2]:
+            sampled_count += 1
+            if sampled_count >= batch_size:
+                yield pending
+                pending = []
+                sampled_count = 0
+
+    if pending:
+        yield pending
+
+def analyze_pending_frames(pending, options, detections=None):
+    """
+    Analyze the sampled frames of a batch together; returns {frame_number: analysis}, None where detection is skipped
+
+    detections holds results of an earlier run over the same frames, which are reused.
+    """
+    results = {frame_number: None for frame_number, _, is_sampled in pending if is_sampled}
+    if detections:
+        results.update((frame_number, detections[frame_number]) for frame_number in results if frame_number in detections)
+    sampled = [(frame_number, frame) for frame_number, frame, is_sampled in pending
+               if is_sampled and needs_detection(frame_number, options) and results[frame_number] is None]
+    analyses = analyze_frames([frame for _, frame in sampled], options) if sampled else []
+    results.update({frame_number: analysis for (frame_number, _), analysis in zip(sampled, analyses)})
+    return results
+
+def alarm_event(record):
+    """Summary of an alarm frame record for live notifications"""
+    return {
+        'frame_number': record['frame_number'],
+        'timestamp': record['timestamp'],
+        'formatted_time': record['formatted_time'],
+        'count': record['alarm']['count'],
+        'danger_level': record['alarm']['danger_level'],
+        'persons': [{'id': person['id'], 'emotion': person['emotion'], 'danger_level': person['danger_level']}
+                    for person in record['persons'] if person['is_dangerous']]
+    }
+
+def annotate_pending_frames(pending, results, fps, state, conn, options, alarm_callback=None, feed=None):
+    """Track, score and store the sampled frames of a batch in frame order; returns {frame_number: record}"""
+    records = {}
+    for frame_number, frame, is_sampled in pending:
+        if is_sampled:
+            record = analyze_sampled_frame(frame_number, frame, fps, results[frame_number], state, conn, options)
+            if alarm_callback and record['alarm'] is not None:
+                alarm_callback(alarm_event(record))
+            if feed is not None:
+                feed.write(record)
+            records[frame_number] = record
+    if feed is not None:
+        feed.flush()
+    return records
+
+def draw_pending_frames(pending, records):
+    """Draw the frame records of a batch onto their frames"""
+    for frame_number, frame, _ in pending:
+        if frame_number in records:
+            draw_frame_record(frame, records[frame_number])
+
+def run_frame_pipeline(batches, fps, state, conn, out, step, options, alarm_callback=None, feed=None):
+    """Decode, detect, annotate and encode in separate threads connected by bounded queues"""
+    def detect(pending):
+        return pending, analyze_pending_frames(pending, options)
+
+    def annotate(item):
+        pending, results = item
+        records = annotate_pending_frames(pending, results, fps, state, conn, options, alarm_callback, feed)
+        if out is not None:
+            draw_pending_frames(pending, records)
+        return pending
+
+    def encode(pending):
+        write_video_frames(out, pending, step)
+        return None
+
+    # Tracking state and the video writer are order dependent: one worker each
+    stages = [
+        ('detect', detect, options['pipeline_detect_workers']),
+        ('annotate', annotate, 1),
+    ]
+    # Headless (no writer): the pipeline ends after annotation
+    if out is not None:
+        stages.append(('encode', encode, 1))
+    run_pipeline(batches, stages, queue_size=options['pipeline_queue_size'])
+
+def split_video_segments(total_frames, shards, stride, overlap):
+    """Split [0, total_frames) into stride-aligned (index, warmup_start, start, end) segments"""
+    bounds = sorted({min(total_frames, int(round(total_frames * k / shards / stride)) * stride)
+                     for k in range(shards)} | {total_frames})
+    segments = []
+    for index, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        warmup_start = max(0, start - overlap * stride)
+        segments.append((index, warmup_start, start, end))
+    return segments
+
+def analyze_segment(video_path, segment, work_dir, options, state=None):
+    """
+    Analyze one video segment with its own tracker and database (runs in a worker process)
+
+    Given the end state of the previous segment, the segment continues it without a warm-up,
+    reusing the detections its first run saved in the work directory.
+    """
+    index, warmup_start, start_frame, end_frame = segment
+    db_path = os.path.join(work_dir, f"segment_{index}.db")
+    detections_path = os.path.join(work_dir, f"segment_{index}.detections.pkl")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = setup_database(db_path, options['storage_schema'], options['distance_blob'])
+    writer = open_database_writer(conn, db_path, options)
+
+    detections = {}
+    cached = None
+    if state is None:
+        state = create_analysis_state(options)
+    else:
+        state = dict(state, frame_results=[])
+        warmup_start = start_frame
+        if os.path.exists(detections_path):
+            with open(detections_path, 'rb') as f:
+                cached = pickle.load(f)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception(f"Could not open video file for segment {index}!")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    batch_size = options['batch_frames'] if options['analysis_mode'] != 'deepface' else 1
+    frames = iter_video_frames(cap, options, state, warmup_start, end_frame)
+    records = {}
+    start_snapshot = None
+    last_frame = None
+
+    for pending in iter_frame_batches(frames, batch_size):
+        results = analyze_pending_frames(pending, options, cached)
+        if not options['attribute_cache']:
+            # Face crops of the attribute cache are too large to keep
+            detections.update((frame_number, copy.deepcopy(analysis)) for frame_number, analysis in results.items()
+                              if frame_number >= start_frame and analysis is not None)
+
+        for frame_number, frame, is_sampled in pending:
+            if not is_sampled:
+                continue
+
+            if frame_number < start_frame:
+                # Warm-up frames overlap the previous segment: only the tracking state advances
+                analyze_sampled_frame(frame_number, frame, fps, results[frame_number], state, None, options)
+                last_frame = frame_number
+                continue
+
+            if start_snapshot is None:
+                start_snapshot = tracking_snapshot(state, last_frame)
+                state['processed_frames'] = 0
+                state['error_frames'] = 0
+                state['total_alarms'] = 0
+                state['max_danger_detected'] = 0
+
+            records[frame_number] = analyze_sampled_frame(frame_number, frame, fps, results[frame_number], state, writer, options)
+            last_frame = frame_number
+
+    cap.release()
+    close_database_writer(writer, conn)
+    conn.close()
+
+    if cached is None and detections:
+        with open(detections_path, 'wb') as f:
+            pickle.dump(detections, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    end_snapshot = tracking_snapshot(state, last_frame)
+    return {
+        'index': index,
+        'db_path': db_path,
+        'records': records,
+        'start_snapshot': start_snapshot or end_snapshot,
+        'end_snapshot': end_snapshot,
+        # Per-frame results are in the segment database: only what the next segment continues is kept
+        'state': {key: value for key, value in state.items() if key != 'frame_results'},
+        'unmatched_faces': any(person['id'] == -1 for record in records.values() for person in record['persons']),
+        'processed_frames': state['processed_frames'],
+        'error_frames': state['error_frames'],
+        'total_alarms': state['total_alarms'],
+        'max_danger_level': state['max_danger_detected']
+    }
+
+def tracking_snapshot(state, last_frame):
+    """
+    Everything the next sampled frame's result depends on, with track IDs left local
+
+    Compared across a segment boundary by match_tracking_snapshots. last_frame is the last
+    sampled frame that was processed (the adaptive sampler runs a batch ahead of it).
+    """
+    track_state = state['track_state']
+    cache = state['attribute_cache']
+    return {
+        # Norfair numbers tracks per tracker: the next ID it hands out follows this count
+        'id_count': state['tracker']._obj_factory.count,
+        'objects': [{
+            'id': obj.id,
+            'is_initializing': obj.is_initializing,
+            'hit_counter': obj.hit_counter,
+            'point_hit_counter': obj.point_hit_counter.copy(),
+            'detected_at_least_once_points': obj.detected_at_least_once_points.copy(),
+            'last_detection': obj.last_detection.points.copy(),
+            # Estimate and covariance, whichever Kalman filter implementation holds them
+            'filter': {name: value.copy() for name, value in vars(obj.filter).items() if isinstance(value, np.ndarray)}
+        } for obj in state['tracker'].tracked_objects],
+        'track_state': {track_id: (track_state.get_position(track_id), track_state.get_speeds(track_id))
+                        for track_id in track_state.rows},
+        'attributes': copy.deepcopy(cache['tracks']) if cache else None,
+        'tracked_faces': copy.deepcopy(state['tracked_faces']),
+        'alarm_active': state['alarm_active'],
+        'last_frame': last_frame
+    }
+
+def snapshot_values_equal(a, b):
+    """Compare snapshot values, allowing Kalman filter round-off in floats"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(snapshot_values_equal(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(snapshot_values_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        a, b = np.asarray(a), np.asarray(b)
+        if a.shape != b.shape:
+            return False
+        if a.dtype.kind != 'f' or b.dtype.kind != 'f':
+            return bool(np.array_equal(a, b))
+        return bool(np.allclose(a, b, rtol=0, atol=SHARD_STATE_TOLERANCE))
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, rel_tol=0, abs_tol=SHARD_STATE_TOLERANCE)
+    return a == b
+
+def match_tracking_snapshots(previous, current, unmatched_faces=True):
+    """
+    Map the track IDs of a segment's start state to the previous segment's end state
+
+    Returns {local_id: previous_id} when both states are the same up to track numbering (the
+    segment then continues exactly where the previous one stopped), otherwise None. The shared
+    motion row of faces without a track (-1) is only compared when the segment has such faces.
+    """
+    if len(previous['objects']) != len(current['objects']):
+        return None
+
+    id_map = {-1: -1}
+    for before, after in zip(previous['objects'], current['objects']):
+        if (before['id'] is None) != (after['id'] is None):
+            return None
+        if not snapshot_values_equal(dict(before, id=None), dict(after, id=None)):
+            return None
+        if after['id'] is not None:
+            id_map[after['id']] = before['id']
+
+    for key in ('track_state', 'attributes'):
+        values = current[key]
+        expected = previous[key]
+        if key == 'track_state' and not unmatched_faces:
+            values = {track_id: value for track_id, value in values.items() if track_id != -1}
+            expected = {track_id: value for track_id, value in expected.items() if track_id != -1}
+        if values is not None:
+            if any(track_id not in id_map for track_id in values):
+                return None
+            values = {id_map[track_id]: value for track_id, value in values.items()}
+        if not snapshot_values_equal(values, expected):
+            return None
+
+    faces = current['tracked_faces']
+    if faces is not None:
+        if any(face['id'] not in id_map for face in faces):
+            return None
+        faces = [dict(face, id=id_map[face['id']]) for face in faces]
+    if not snapshot_values_equal(faces, previous['tracked_faces']):
+        return None
+
+    if current['alarm_active'] != previous['alarm_active'] or current['last_frame'] != previous['last_frame']:
+        return None
+
+    id_map.pop(-1)
+    return id_map
+
+def stitch_segment_tracks(segment_results, boundary_maps):
+    """
+    Give every segment's tracks the IDs one tracker over the whole video would have given them
+
+    boundary_maps[k] maps the tracks alive when segment k starts to the previous segment's IDs;
+    tracks the segment creates afterwards continue the previous segment's numbering.
+    """
+    id_maps = []
+    offset = 0
+    for k, result in enumerate(segment_results):
+        start_count = result['start_snapshot']['id_count']
+        end_count = result['end_snapshot']['id_count']
+        id_map = {-1: -1}
+        if k > 0:
+            previous = segment_results[k - 1]
+            offset += previous['end_snapshot']['id_count'] - start_count
+            id_map.update((local_id, id_maps[k - 1][previous_id]) for local_id, previous_id in boundary_maps[k].items())
+        id_map.update((local_id, local_id + offset) for local_id in range(start_count + 1, end_count + 1))
+
+        for record in result['records'].values():
+            remap_record_ids(record, id_map)
+        id_maps.append(id_map)
+
+    return id_maps
+
+def remap_record_ids(record, id_map):
+    """Rewrite the track IDs of a frame record in place"""
+    for person in record['persons']:
+        person['id'] = id_map.get(person['id'], person['id'])
+
+def merge_segment_database(conn, segment_db_path, id_map, storage_schema='legacy'):
+    """Copy a segment database into the main one, rewriting track IDs"""
+    def remap(face_id):
+        return id_map.get(face_id, face_id)
+
+    source = sqlite3.connect(segment_db_path)
+    try:
+        if storage_schema == 'compact':
+            write_rows(conn, read_compact_rows(source, remap))
+            return
+
+        rows = {}
+
+        analysis_rows = source.execute('''
+            SELECT timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids,
+                   distances, analysis_date, alarm_triggered, alarm_reason
+            FROM video_analysis ORDER BY id
+        ''').fetchall()
+        rows['video_analysis'] = [row[:7] + (json.dumps([remap(i) for i in json.loads(row[7])]),) + row[8:]
+                                  for row in analysis_rows]
+
+        person_rows = source.execute('''
+            SELECT timestamp, face_id, gender, emotion, speed, angle, bbox_area, distance_category, x, y, width, height,
+                   danger_status, danger_level, alarm_triggered
+            FROM person_details ORDER BY id
+        ''').fetchall()
+        rows['person_details'] = [row[:1] + (remap(row[1]),) + row[2:] for row in person_rows]
+
+        distance_rows = source.execute('''
+            SELECT timestamp, person1_id, person2_id, distance, is_close FROM person_distances ORDER BY id
+        ''').fetchall()
+        rows['person_distances'] = [(row[0], remap(row[1]), remap(row[2])) + row[3:] for row in distance_rows]
+
+        alarm_rows = source.execute('''
+            SELECT timestamp, formatted_time, dangerous_person_id, dangerous_person_emotion, dangerous_person_speed,
+                   nearby_persons, alarm_reason, danger_level, analysis_date
+            FROM alarm_events ORDER BY id
+        ''').fetchall()
+        rows['alarm_events'] = []
+        for row in alarm_rows:
+            nearby_persons = [dict(person, id=remap(person['id'])) for person in json.loads(row[5])]
+            rows['alarm_events'].append(row[:2] + (remap(row[2]),) + row[3:5] + (json.dumps(nearby_persons),) + row[6:])
+
+        write_rows(conn, rows)
+    finally:
+        source.close()
+
+def render_segment(video_path, segment, records, output_path, options):
+    """Re-decode a segment and draw its (stitched) frame records (runs in a worker process)"""
+    _, _, start_frame, end_frame = segment
+    cap = cv2.VideoCapture(video_path)
+    output_fps, step = output_video_timing(cap.get(cv2.CAP_PROP_FPS), options)
+    out = open_video_encoder(output_path, output_fps, options, start_frame // step if step else 0)
+
+    adaptive = options['sampling_mode'] == 'adaptive'
+    if adaptive:
+        # Replay the frames picked during analysis instead of re-running motion detection
+        options = dict(options, sampling_mode='skip_decode', frame_stride=options['min_stride'])
+
+    state = {'frames_read': 0}
+    try:
+        for frame_number, frame, _ in iter_video_frames(cap, options, state, start_frame, end_frame):
+            if frame_number in records:
+                draw_frame_record(frame, records[frame_number])
+            elif adaptive or step is None:
+                continue
+            if step is None:
+                out.write(frame)
+            else:
+                out.write(frame, frame_number // step)
+
+        # Hold the last analyzed frame to the end of the segment
+        if step is not None:
+            out.hold_until(-(-(end_frame or state['frames_read']) // step))
+    finally:
+        cap.release()
+        out.close()
+    return output_path
+
+def render_annotated_video(video_path, output_dir, options=None):
+    """
+    Draw the frame feed of a finished analysis onto its video (on demand for headless jobs)
+
+    Returns the path of the annotated video, the one analyze_video would have written.
+    """
+    options = build_analysis_options(options)
+    records = load_feed_records(feed_path(output_dir))
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception("Could not open video file!")
+    cap.release()
+
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    output_video_path = os.path.join(output_dir, f"{video_filename}_analyzed.mp4")
+    # Written under another name so a download never sees a half-rendered video
+    rendering_path = os.path.join(output_dir, f"{video_filename}_analyzed.rendering.mp4")
+    render_segment(video_path, (0, 0, 0, None), records, rendering_path, options)
+    os.replace(rendering_path, output_video_path)
+    print(f"Rendered {len(records)} annotated frames: {output_video_path}")
+    return output_video_path
+
+def analyze_segments(executor, video_path, segments, work_dir, options, progress_callback=None):
+    """
+    Run analyze_segment for every segment in parallel, then check that each one continues the previous one
+
+    A segment whose warm-up did not rebuild the tracking state the previous segment ended with
+    is run again from that state. Returns the segment results in order and, per segment, the map
+    of the tracks alive at its start to the previous segment's IDs (see match_tracking_snapshots).
+    """
+    futures = [executor.submit(analyze_segment, video_path, segment, work_dir, options) for segment in segments]
+    segment_results = []
+    for done, future in enumerate(as_completed(futures), 1):
+        segment_results.append(future.result())
+        if progress_callback:
+            progress_callback(done / len(segments) * 90)
+    segment_results.sort(key=lambda result: result['index'])
+
+    boundary_maps = [{}]
+    for index in range(1, len(segment_results)):
+        previous = segment_results[index - 1]
+        result = segment_results[index]
+        id_map = match_tracking_snapshots(previous['end_snapshot'], result['start_snapshot'], result['unmatched_faces'])
+        if id_map is None:
+            print(f"Segment {index} does not continue segment {index - 1}: re-running it from its end state")
+            segment_results[index] = executor.submit(analyze_segment, video_path, segments[index], work_dir, options,
+                                                     previous['state']).result()
+            id_map = {obj['id']: obj['id'] for obj in previous['end_snapshot']['objects'] if obj['id'] is not None}
+        elif not result['unmatched_faces']:
+            # The segment never touched the -1 row: it still holds what the previous segment left there
+            unmatched = previous['end_snapshot']['track_state'].get(-1)
+            result['end_snapshot']['track_state'].pop(-1, None)
+            if unmatched is not None:
+                result['end_snapshot']['track_state'][-1] = unmatched
+            result['state']['track_state'].restore(-1, unmatched)
+        boundary_maps.append(id_map)
+
+    return segment_results, boundary_maps
+
+def analyze_video_sharded(video_path, output_dir, progress_callback, options, conn, feed=None):
+    """Analyze time segments of one video in a process pool, then stitch tracks, database and video"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception("Could not open video file!")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if total_frames <= 0:
+        raise Exception("Sharded analysis needs a video with a known frame count!")
+
+    segments = split_video_segments(total_frames, options['shards'], sampling_stride(options), options['shard_overlap'])
+    work_dir = os.path.join(output_dir, "segments")
+    os.makedirs(work_dir, exist_ok=True)
+
+    workers = options['shard_workers'] or os.cpu_count() or 1
+    output_fps, _ = output_video_timing(fps, options)
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    output_video_path = os.path.join(output_dir, f"{video_filename}_analyzed.mp4")
+
+    print(f"Sharded analysis: {len(segments)} segments on {workers} worker(s)")
+
+    # Spawned workers do not inherit TensorFlow state from a parent that already used it
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        segment_results, boundary_maps = analyze_segments(executor, video_path, segments, work_dir, options, progress_callback)
+        id_maps = stitch_segment_tracks(segment_results, boundary_maps)
+
+        for result, id_map in zip(segment_results, id_maps):
+            merge_segment_database(conn, result['db_path'], id_map, options['storage_schema'])
+            # Segments run in other processes: their frames reach the feed once stitched
+            if feed is not None:
+                for frame_number in sorted(result['records']):
+                    feed.write(result['records'][frame_number])
+                feed.flush()
+
+        if options['render_video']:
+            segment_paths = [os.path.join(work_dir, f"segment_{segment[0]}.mp4") for segment in segments]
+            futures = [executor.submit(render_segment, video_path, segment, result['records'], path, options)
+                       for segment, result, path in zip(segments, segment_results, segment_paths)]
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if progress_callback:
+                    progress_callback(90 + done / len(segments) * 9)
+
+    if options['render_video']:
+        concat_videos(segment_paths, output_video_path, output_fps, options)
+    else:
+        output_video_path = None
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'output_video_path': output_video_path,
+        'total_frames': total_frames,
+        'processed_frames': sum(result['processed_frames'] for result in segment_results),
+        'error_frames': sum(result['error_frames'] for result in segment_results),
+        'total_alarms': sum(result['total_alarms'] for result in segment_results),
+        'max_danger_level': max([result['max_danger_level'] for result in segment_results] + [0])
+    }
+
+def next_frame_number(frame_number, options):
+    """First frame a run resumed after frame_number starts reading at"""
+    if options['sampling_mode'] == 'decode_all':
+        return frame_number + 1
+    return frame_number + sampling_stride(options)
+
+def save_analysis_checkpoint(output_dir, video_path, options, state, conn, next_frame, video_parts, feed=None):
+    """Commit the rows written so far and save everything needed to resume at next_frame"""
+    if isinstance(conn, DatabaseWriter):
+        conn.flush()
+        reader = sqlite3.connect(conn.db_path)
+    else:
+        reader = conn
+    try:
+        db_marks = database_marks(reader, options['storage_schema'])
+    finally:
+        if reader is not conn:
+            reader.close()
+
+    save_checkpoint(output_dir, {
+        'version': ANALYSIS_VERSION,
+        'video_path': video_path,
+        'options': checkpoint_options(options),
+        'next_frame': next_frame,
+        # Per-frame results grow with the video and are already in the database: only counters are kept
+        'state': {key: value for key, value in state.items() if key != 'frame_results'},
+        'db_marks': db_marks,
+        'video_parts': list(video_parts),
+        'feed_offset': feed.offset() if feed is not None else None
+    })
+    print(f"Checkpoint saved at frame {next_frame}")
+
+def analyze_video_frames(video_path, output_dir, progress_callback, options, conn, checkpoint=None, alarm_callback=None,
+                         feed=None):
+    """
+    Analyze a whole video in this process (serial loop or threaded pipeline)
+
+    With checkpoint_interval set (serial loop), the output video is written in parts and a
+    checkpoint is saved every checkpoint_interval sampled frames; given the checkpoint of an
+    interrupted run, analysis continues from it.
+    """
+    # Tracking state
+    if checkpoint:
+        state = dict(checkpoint['state'], frame_results=[])
+    else:
+        state = create_analysis_state(options)
+
+    # Video
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception("Could not open video file!")
+
+    # Video properties
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    # Output video path
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    output_video_path = os.path.join(output_dir, f"{video_filename}_analyzed.mp4")
+
+    batch_size = options['batch_frames'] if options['analysis_mode'] != 'deepface' else 1
+    start_frame = checkpoint['next_frame'] if checkpoint else 0
+
+    # Output video encoder (one part per checkpoint interval when checkpointing, none when headless)
+    output_fps, step = output_video_timing(fps, options)
+    render = options['render_video']
+    checkpointing = options['checkpoint_interval'] > 0 and not options['pipeline']
+    video_parts = list(checkpoint['video_parts']) if checkpoint else []
+    out = None
+    if render:
+        out = open_video_encoder(video_part_path(output_video_path, len(video_parts)) if checkpointing else output_video_path,
+                                 output_fps, options, start_frame // step if step else 0)
+
+    def frames_with_progress():
+        for item in iter_video_frames(cap, options, state, start_frame):
+            # Progress callback
+            if progress_callback:
+                progress = (item[0] / total_frames) * 100
+                progress_callback(progress)
+            yield item
+
+    print("Video processing started...")
+
+    # Sampled frames are analyzed in batches; unsampled ones travel with them so output order is kept
+    batches = iter_frame_batches(frames_with_progress(), batch_size)
+
+    if options['pipeline']:
+        run_frame_pipeline(batches, fps, state, conn, out, step, options, alarm_callback, feed)
+    else:
+        sampled_since_checkpoint = 0
+        for pending in batches:
+            results = analyze_pending_frames(pending, options)
+            records = annotate_pending_frames(pending, results, fps, state, conn, options, alarm_callback, feed)
+
+            # Draw and write frames to video
+            if render:
+                draw_pending_frames(pending, records)
+                write_video_frames(out, pending, step)
+
+            if checkpointing:
+                sampled_since_checkpoint += len(records)
+                if sampled_since_checkpoint >= options['checkpoint_interval']:
+                    # Close the current video part so the checkpoint only references complete files
+                    if render:
+                        out.close()
+                        video_parts.append(video_part_path(output_video_path, len(video_parts)))
+                    save_analysis_checkpoint(output_dir, video_path, options, state, conn,
+                                             next_frame_number(pending[-1][0], options), video_parts, feed)
+                    if render:
+                        # The next part continues the timeline (a resumed run starts without the held frame)
+                        out = open_video_encoder(video_part_path(output_video_path, len(video_parts)),
+                                                 output_fps, options, out.index, out.last_frame)
+                    sampled_since_checkpoint = 0
+
+    print("End of video")
+
+    cache = state['attribute_cache']
+    if cache is not None:
+        print(f"Attribute cache: {cache['gender_calls']} gender / {cache['emotion_calls']} emotion classifications for {cache['faces']} faces")
+
+    # Clean up resources
+    cap.release()
+    if out is not None:
+        # Hold the last analyzed frame to the end of the video
+        if step is not None:
+            out.hold_until(-(-state['frames_read'] // step))
+        out.close()
+
+    if render and checkpointing:
+        # Splice the parts of all runs into the output video
+        video_parts.append(video_part_path(output_video_path, len(video_parts)))
+        if len(video_parts) == 1:
+            # Not resumed: the only part is the whole video
+            os.replace(video_parts[0], output_video_path)
+        else:
+            concat_videos(video_parts, output_video_path, output_fps, options)
+            for part in video_parts:
+                os.remove(part)
+
+    return {
+        'output_video_path': output_video_path if render else None,
+        'total_frames': state['frames_read'],
+        'processed_frames': state['processed_frames'],
+        'error_frames': state['error_frames'],
+        'total_alarms': state['total_alarms'],
+        'max_danger_level': state['max_danger_detected']
+    }
+
 # ANA FONKSİYON - FLASK İÇİN
-def analyze_video(video_path, output_dir="outputs", progress_callback=None):
+def analyze_video(video_path, output_dir="outputs", progress_callback=None, options=None, resume=False, alarm_callback=None):
     """
     Ana video analiz fonksiyonu - Flask'tan çağrılacak
     
@@ -394,316 +1986,82 @@ def analyze_video(video_path, output_dir="outputs", progress_callback=None):
         video_path (str): İşlenecek video dosyasının yolu
         output_dir (str): Çıktı dosyalarının kaydedileceği klasör
         progress_callback (function): İlerleme durumunu bildirmek için callback fonksiyonu
+        options (dict): DEFAULT_ANALYSIS_OPTIONS üzerine yazılacak iş bazlı ayarlar
+        resume (bool): output_dir'deki checkpoint'ten (varsa) devam et
+        alarm_callback (function): Alarm içeren her kare için alarm_event() özetiyle çağrılır (sharded modda yok)
     
     Returns:
         dict: Analiz sonuçları
     """
     try:
+        options = build_analysis_options(options)
+
         # Çıktı klasörünü oluştur
         os.makedirs(output_dir, exist_ok=True)
         
         # Database path
         db_path = os.path.join(output_dir, "alarm_analysis.db")
         
-        # Initialize database
-        conn = setup_database(db_path)
-        print("Database initialized successfully!")
-
-        # Variables
-        prev_positions = {}
-        speed_history = {}
-
-        # Video and tracker
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise Exception("Could not open video file!")
-
-        tracker = Tracker(distance_function="euclidean", distance_threshold=40)
-
-        # Video properties
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-        # Output video path
-        video_filename = os.path.splitext(os.path.basename(video_path))[0]
-        output_video_path = os.path.join(output_dir, f"{video_filename}_analyzed.mp4")
-        
-        # Output video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_video_path, fourcc, fps / 5, (1280, 720))
-
-        frame_number = 0
-        frame_results = []
-        total_alarms = 0
-        max_danger_detected = 0
-
-        print("Video processing started...")
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("End of video")
-                break
-
-            # Progress callback
-            if progress_callback:
-                progress = (frame_number / total_frames) * 100
-                progress_callback(progress)
-
-            # Process every 5th frame
-            if frame_number % 5 == 0:
+        # Interrupted run of the same job: keep its rows up to the checkpoint
+        checkpoint = None
+        if resume and options['shards'] == 1:
+            checkpoint = load_checkpoint(output_dir, video_path, options, ANALYSIS_VERSION)
+
+        if checkpoint:
+            conn = register_functions(sqlite3.connect(db_path))
+            trim_database(conn, options['storage_schema'], checkpoint['db_marks'], checkpoint['next_frame'])
+            feed = FrameFeed(feed_path(output_dir), checkpoint['feed_offset'])
+            print(f"Resuming from checkpoint at frame {checkpoint['next_frame']}")
+        else:
+            # Initialize database
+            conn = setup_database(db_path, options['storage_schema'], options['distance_blob'])
+            feed = FrameFeed(feed_path(output_dir))
+            print("Database initialized successfully!")
+
+        try:
+            if options['shards'] > 1:
+                stats = analyze_video_sharded(video_path, output_dir, progress_callback, options, conn, feed)
+            else:
+                writer = open_database_writer(conn, db_path, options)
                 try:
-                    # Resize frame
-                    frame = cv2.resize(frame, (1280, 720))
-
-                    # Calculate timestamp
-                    timestamp = frame_number / fps
-                    formatted_time = format_time(timestamp)
-
-                    # Face analysis
-                    analysis = DeepFace.analyze(frame,
-                                              actions=['gender', 'emotion'],
-                                              detector_backend="retinaface",
-                                              enforce_detection=False)
-
-                    if isinstance(analysis, dict):
-                        analysis = [analysis]
-
-                    if len(analysis) == 0:
-                        # No person detected
-                        cv2.putText(frame, f"{formatted_time} -> No person detected", (10, 30),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-                        out.write(frame)
-                        frame_number += 1
-                        continue
-
-                    # Calculate face centers and bbox areas
-                    face_centers = []
-                    bbox_areas = []
-
-                    for person in analysis:
-                        region = person.get('region', {})
-                        x, y, w, h = region.get('x', 0), region.get('y', 0), region.get('w', 50), region.get('h', 50)
-                        cx, cy = x + w // 2, y + h // 2
-                        bbox_area = w * h
-
-                        face_centers.append((cx, cy))
-                        bbox_areas.append(bbox_area)
-
-                    # Tracking
-                    norfair_detections = [Detection(points=np.array([[cx, cy]])) for cx, cy in face_centers]
-                    tracked_objects = tracker.update(detections=norfair_detections)
-
-                    # Face ID matching
-                    face_ids = []
-                    for cx, cy in face_centers:
-                        matched_id = -1
-                        min_dist = float("inf")
-                        for obj in tracked_objects:
-                            if len(obj.estimate) > 0:
-                                tx, ty = obj.estimate[0]
-                                dist = math.hypot(tx - cx, ty - cy)
-                                if dist < min_dist:
-                                    min_dist = dist
-                                    matched_id = obj.id
-                        face_ids.append(matched_id)
-
-                    # Motion analysis
-                    genders, emotions, speeds, angles = [], [], [], []
-                    alarm_active = False
-                    alarm_count = 0
-                    max_danger_level = 0
-                    alarm_data = None
-                    dangerous_persons = []
-
-                    for i, person in enumerate(analysis):
-                        dominant_gender = person.get('dominant_gender', '')
-                        dominant_emotion = person.get('dominant_emotion', '')
-                        region = person.get('region', {})
-                        x, y, w, h = region.get('x', 0), region.get('y', 0), region.get('w', 50), region.get('h', 50)
-                        cx, cy = x + w // 2, y + h // 2
-                        bbox_area = w * h
-
-                        matched_id = face_ids[i] if i < len(face_ids) else -1
-
-                        # Speed calculation
-                        if matched_id in prev_positions:
-                            prev_data = prev_positions[matched_id]
-                            px, py, prev_bbox_area, prev_timestamp = prev_data
-
-                            dx = cx - px
-                            dy = cy - py
-                            dt = timestamp - prev_timestamp
-
-                            if abs(dx) < 2 and abs(dy) < 2:
-                                speed = 0.0
-                                angle = 0.0
-                            else:
-                                speed = calculate_normalized_speed(dx, dy, bbox_area, dt)
-                                angle = math.degrees(math.atan2(dy, dx))
-
-                                # Speed smoothing
-                                if matched_id not in speed_history:
-                                    speed_history[matched_id] = []
-                                speed_history[matched_id].append(speed)
-                                if len(speed_history[matched_id]) > 5:
-                                    speed_history[matched_id].pop(0)
-
-                                smooth_speed = sum(speed_history[matched_id]) / len(speed_history[matched_id])
-                                speed = smooth_speed
-
-                                # Draw motion arrow
-                                cv2.arrowedLine(frame, (int(px), int(py)), (int(cx), int(cy)), (0, 255, 0), 2, tipLength=0.3)
-                        else:
-                            speed = 0.0
-                            angle = 0.0
-
-                        # Danger level calculation
-                        is_dangerous, danger_level, danger_reason = calculate_danger_level(dominant_emotion, speed, bbox_area)
-                        max_danger_detected = max(max_danger_detected, danger_level)
-
-                        # Choose box color based on danger level
-                        box_color = get_danger_color(danger_level)
-                        box_thickness = 3 if is_dangerous else 1
-
-                        # Draw bounding box
-                        cv2.rectangle(frame, (x, y), (x + w, y + h), box_color, box_thickness)
-
-                        # Clean label - only essential info
-                        distance_cat = get_distance_category(bbox_area)
-                        label = f"ID:{matched_id} {dominant_gender} {dominant_emotion} {distance_cat}"
-                        cv2.putText(frame, label, (x, y - 10),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 2)
-
-                        # Speed display
-                        if speed > 0:
-                            speed_color = get_danger_color(danger_level)
-                            speed_text = f"{speed:.1f} px/s"
-                            cv2.putText(frame, speed_text, (x, y - 30),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, speed_color, 2)
-
-                        # Danger level display for dangerous persons
-                        if is_dangerous:
-                            level_text = f"DANGER: {danger_level}/10"
-                            cv2.putText(frame, level_text, (x, y - 50),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-                        # Update position
-                        prev_positions[matched_id] = (cx, cy, bbox_area, timestamp)
-
-                        # Add to lists
-                        genders.append(dominant_gender)
-                        emotions.append(dominant_emotion)
-                        speeds.append(speed)
-                        angles.append(angle)
-
-                        # Alarm processing
-                        if is_dangerous:
-                            alarm_active = True
-                            alarm_count += 1
-                            max_danger_level = max(max_danger_level, danger_level)
-
-                            nearby_persons = find_nearby_persons(i, face_centers, face_ids)
-
-                            dangerous_persons.append({
-                                'id': matched_id,
-                                'emotion': dominant_emotion,
-                                'speed': speed,
-                                'nearby_persons': nearby_persons,
-                                'reason': danger_reason,
-                                'danger_level': danger_level
-                            })
-
-                            # Save alarm event
-                            save_alarm_event(conn, timestamp, formatted_time, matched_id,
-                                           dominant_emotion, speed, nearby_persons, danger_reason, danger_level)
-
-                            print(f"ALARM! Time: {formatted_time}, Person ID: {matched_id}, Level: {danger_level}")
-                            total_alarms += 1
-
-                    # Draw alarm warning
-                    if alarm_active:
-                        draw_alarm_warning(frame, True, alarm_count, max_danger_level)
-                        alarm_data = {
-                            'dangerous_person_id': dangerous_persons[0]['id'] if dangerous_persons else -1,
-                            'nearby_persons': dangerous_persons[0]['nearby_persons'] if dangerous_persons else [],
-                            'reason': f"{alarm_count} person(s) in dangerous state",
-                            'danger_level': max_danger_level
-                        }
-
-                    # Distance checking
-                    distances = []
-                    if len(face_centers) > 1:
-                        for i in range(len(face_centers)):
-                            for j in range(i + 1, len(face_centers)):
-                                x1, y1 = face_centers[i]
-                                x2, y2 = face_centers[j]
-                                distance = math.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
-
-                                if distance < 150:
-                                    mid_x, mid_y = (x1 + x2) // 2, (y1 + y2) // 2
-                                    cv2.line(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                                    cv2.putText(frame, f"{int(distance)} px", (mid_x, mid_y),
-                                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-                                distances.append((i, j, distance))
-
-                    # Time information
-                    cv2.putText(frame, f"{formatted_time} -> {len(analysis)} person(s)", (10, 30),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-
-                    # Save to database
-                    person_count = len(analysis)
-                    save_to_database(conn, timestamp, formatted_time, person_count, genders, emotions, speeds, angles, face_ids, distances, analysis, alarm_data)
-
-                    frame_results.append((timestamp, person_count, genders, emotions, speeds, distances, face_ids))
-
-                    # Progress
-                    if len(frame_results) % 20 == 0:
-                        print(f"Processed frames: {len(frame_results)}, Persons: {person_count}, Time: {formatted_time}")
-
-                except Exception as e:
-                    print(f"Frame {frame_number} error: {e}")
-                    print(traceback.format_exc())
-                    # Save error frame
-                    cv2.putText(frame, f"{format_time(frame_number/fps)} -> ERROR", (10, 30),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-            # Write frame to video
-            out.write(frame)
-            frame_number += 1
-
-        # Clean up resources
-        cap.release()
-        out.release()
+                    stats = analyze_video_frames(video_path, output_dir, progress_callback, options, writer, checkpoint,
+                                                 alarm_callback, feed)
+                finally:
+                    close_database_writer(writer, conn)
+        finally:
+            feed.close()
+        output_video_path = stats.pop('output_video_path')
+        remove_checkpoint(output_dir, output_video_path)
+
+        # Indexes for the results API, built once instead of maintained per insert
+        create_query_indexes(conn.cursor(), options['storage_schema'])
+        conn.commit()
 
         # Statistics
         print_database_stats(conn)
         conn.close()
 
+        files = {
+            'database': db_path,
+            'frame_feed': feed.path
+        }
+        # Headless jobs have no annotated video until render_annotated_video is asked for one
+        if output_video_path:
+            files['analyzed_video'] = output_video_path
+
         # Return results
         results = {
             'success': True,
             'message': 'Video analysis completed successfully!',
-            'stats': {
-                'total_frames': frame_number,
-                'processed_frames': len(frame_results),
-                'total_alarms': total_alarms,
-                'max_danger_level': max_danger_detected
-            },
-            'files': {
-                'analyzed_video': output_video_path,
-                'database': db_path
-            }
+            'stats': stats,
+            'files': files
         }
         
         print(f"\nAnalysis completed!")
-        print(f"Video: {output_video_path}")
+        print(f"Video: {output_video_path or 'not rendered (headless)'}")
         print(f"Database: {db_path}")
-        print(f"Processed frames: {len(frame_results)}")
-        print(f"Total alarms: {total_alarms}")
+        print(f"Processed frames: {stats['processed_frames']}")
+        print(f"Total alarms: {stats['total_alarms']}")
         
         return results
 
@@ -0,0 +1,90 @@
+import json
+import sqlite3
+
+from schema import register_functions
+
+MAX_PAGE_SIZE = 1000
+
+# Column names are shared by the legacy tables and the compact schema's views
+FRAME_COLUMNS = ('id', 'timestamp', 'formatted_time', 'person_count', 'genders', 'emotions', 'speeds',
+                 'angles', 'face_ids', 'distances', 'alarm_triggered', 'alarm_reason')
+PERSON_COLUMNS = ('id', 'timestamp', 'face_id', 'gender', 'emotion', 'speed', 'angle', 'bbox_area',
+                  'distance_category', 'x', 'y', 'width', 'height', 'danger_status', 'danger_level',
+                  'alarm_triggered')
+ALARM_COLUMNS = ('id', 'timestamp', 'formatted_time', 'dangerous_person_id', 'dangerous_person_emotion',
+                 'dangerous_person_speed', 'nearby_persons', 'alarm_reason', 'danger_level')
+
+JSON_COLUMNS = {'genders', 'emotions', 'speeds', 'angles', 'face_ids', 'distances', 'nearby_persons'}
+
+def open_results_database(db_path):
+    """Read-only connection to a finished analysis database"""
+    return register_functions(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True))
+
+def encode_cursor(row):
+    """Opaque keyset cursor of the last row of a page"""
+    return f"{row['timestamp']!r}_{row['id']}"
+
+def decode_cursor(cursor):
+    """(timestamp, id) of a cursor; raises ValueError for malformed cursors"""
+    timestamp, row_id = cursor.split('_')
+    return float(timestamp), int(row_id)
+
+def query_page(conn, table, columns, conditions, params, after=None, limit=100):
+    """
+    One page of rows ordered by (timestamp, id)
+
+    Keyset pagination: the next page starts after the (timestamp, id) of the previous page's
+    last row, so deep pages cost the same as the first one.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    conditions = list(conditions)
+    params = list(params)
+    if after:
+        conditions.append('(timestamp, id) > (?, ?)')
+        params.extend(decode_cursor(after))
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    rows = conn.execute(f'''
+        SELECT {', '.join(columns)} FROM {table} {where}
+        ORDER BY timestamp, id LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+
+    items = []
+    for row in rows[:limit]:
+        item = dict(zip(columns, row))
+        for column in JSON_COLUMNS.intersection(item):
+            item[column] = json.loads(item[column]) if item[column] else []
+        items.append(item)
+
+    return {
+        'items': items,
+        'next_cursor': encode_cursor(items[-1]) if len(rows) > limit else None
+    }
+
+def time_range_conditions(start=None, end=None):
+    """WHERE conditions and parameters for an optional [start, end] timestamp range"""
+    conditions, params = [], []
+    if start is not None:
+        conditions.append('timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append('timestamp <= ?')
+        params.append(end)
+    return conditions, params
+
+def query_frames(conn, start=None, end=None, after=None, limit=100):
+    """Per-frame analysis rows in a time range"""
+    conditions, params = time_range_conditions(start, end)
+    return query_page(conn, 'video_analysis', FRAME_COLUMNS, conditions, params, after, limit)
+
+def query_track(conn, face_id, start=None, end=None, after=None, limit=100):
+    """Detections of one tracked face"""
+    conditions, params = time_range_conditions(start, end)
+    return query_page(conn, 'person_details', PERSON_COLUMNS, ['face_id = ?'] + conditions, [face_id] + params,
+                      after, limit)
+
+def query_alarms(conn, min_level=0, start=None, end=None, after=None, limit=100):
+    """Alarm events at or above a danger level"""
+    conditions, params = time_range_conditions(start, end)
+    return query_page(conn, 'alarm_events', ALARM_COLUMNS, conditions + ['danger_level >= ?'], params + [min_level],
+                      after, limit)
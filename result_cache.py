@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from feed import feed_path
+
+# Options that change how a job runs but not its results; they are left out of the cache key
+EXECUTION_OPTIONS = {'inference_server_address', 'inference_server_authkey', 'pipeline', 'pipeline_detect_workers',
+                     'pipeline_queue_size', 'db_writer', 'db_batch_frames', 'db_flush_ms', 'shard_workers', 'crowd_size',
+                     'checkpoint_interval'}
+
+CHUNK_SIZE = 1024 * 1024
+
+class HashingFile:
+    """
+    Upload spool file that hashes the content while Werkzeug writes it
+
+    Created by the request's file stream factory in the upload folder, so the upload is
+    hashed as it streams to disk and can then be linked into place without another pass.
+    """
+
+    def __init__(self, directory):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, prefix='.upload_', suffix='.part')
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    def save_as(self, path):
+        """Give the spooled upload its final name (hard link, copy across file systems)"""
+        self.file.flush()
+        try:
+            os.link(self.file.name, path)
+        except OSError:
+            self.file.seek(0)
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(self.file, f, CHUNK_SIZE)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+def file_sha256(path):
+    """SHA-256 of a file's content"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def result_cache_key(content_hash, options, version):
+    """Cache key of an upload analyzed with the given (complete) options and analysis version"""
+    params = {key: value for key, value in options.items() if key not in EXECUTION_OPTIONS}
+    if params.get('scoring_rules'):
+        # The rules file's content matters, not its path
+        params['scoring_rules'] = file_sha256(params['scoring_rules'])
+    payload = json.dumps({'content': content_hash, 'options': params, 'version': version}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def link_or_copy(source, destination):
+    """Hard link a file (instant, no extra disk), copying when linking is not possible"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+class ResultCache:
+    """
+    Analysis results (analyzed video + database) by cache key, LRU-evicted within max_bytes
+
+    Entries live in cache_dir/<key>/ and are indexed in cache_dir/cache.db, so the cache is
+    shared by all web processes. Files are hard linked in and out, so a hit costs no copy.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used)')
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(os.path.join(self.cache_dir, 'cache.db'), timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def restore(self, key, output_dir, video_name):
+        """
+        Link a cached result into a task's output directory
+
+        Returns the result dict (as returned by analyze_video, with the task's file paths)
+        or None on a miss.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT result FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+        finally:
+            conn.close()
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        files = {'database': os.path.join(output_dir, 'alarm_analysis.db')}
+        # Headless jobs store no video, entries stored before the frame feed existed have no feed
+        optional = {
+            'analyzed_video': os.path.join(output_dir, f"{video_name}_analyzed.mp4"),
+            'frame_feed': feed_path(output_dir)
+        }
+        for name, path in optional.items():
+            if os.path.exists(os.path.join(entry_dir, name)):
+                files[name] = path
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            for name, path in files.items():
+                link_or_copy(os.path.join(entry_dir, name), path)
+        except OSError as e:
+            # Entry files are gone (evicted meanwhile or removed by hand)
+            print(f"Result cache entry {key} unusable: {e}")
+            self.remove(key)
+            return None
+
+        result = json.loads(row[0])
+        result['files'] = files
+        result['cached'] = True
+        return result
+
+    def store(self, key, result):
+        """Add a successful analysis result to the cache, then evict down to max_bytes"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            return
+
+        # Built under a temporary name so other processes never see a half-written entry
+        staging_dir = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}")
+        try:
+            os.makedirs(staging_dir)
+            size = 0
+            for name, path in result['files'].items():
+                link_or_copy(path, os.path.join(staging_dir, name))
+                size += os.path.getsize(path)
+            os.rename(staging_dir, entry_dir)
+        except OSError as e:
+            print(f"Result cache store error: {e}")
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return
+
+        cached = {k: v for k, v in result.items() if k not in ('files', 'cached')}
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO entries (key, size, result, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                         (key, size, json.dumps(cached), now, now))
+            conn.commit()
+        finally:
+            conn.close()
+        self.evict()
+
+    def remove(self, key):
+        """Drop one entry"""
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            conn.commit()
+        finally:
+            conn.close()
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT key, size FROM entries ORDER BY last_used DESC').fetchall()
+        finally:
+            conn.close()
+
+        total = 0
+        for key, size in rows:
+            total += size
+            if total > self.max_bytes:
+                self.remove(key)
+
+    def stats(self):
+        """Entry count and total size"""
+        conn = self._connect()
+        try:
+            count, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        finally:
+            conn.close()
+        return {'entries': count, 'bytes': size, 'max_bytes': self.max_bytes}
@@ -0,0 +1,292 @@
+import json
+import numpy as np
+
+# Storage schemas:
+#   legacy  - video_analysis / person_details / person_distances / alarm_events tables (JSON text columns)
+#   compact - integer-coded frames / persons / pair_distances / alarms tables, with the legacy
+#             names available as read-only views
+STORAGE_SCHEMAS = ('legacy', 'compact')
+
+# Enum codes (index = stored value); unknown labels are stored as 0
+GENDERS = ('', 'Woman', 'Man')
+EMOTIONS = ('', 'angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+DANGER_STATUSES = ('normal', 'at_risk', 'dangerous')
+
+LEGACY_TABLES = ('video_analysis', 'person_details', 'person_distances', 'alarm_events')
+COMPACT_TABLES = ('frames', 'persons', 'pair_distances', 'alarms',
+                  'gender_labels', 'emotion_labels', 'danger_status_labels')
+
+def enum_code(labels, label):
+    """Stored code of an enum label"""
+    try:
+        return labels.index(label)
+    except ValueError:
+        return 0
+
+def pack_distances(distances):
+    """Pairwise distances (i < j order) as a little-endian float32 blob"""
+    return np.asarray([distance for _, _, distance in distances], dtype='<f4').tobytes()
+
+def unpack_distances(blob, person_count):
+    """(i, j, distance) tuples from a pack_distances blob"""
+    values = np.frombuffer(blob, dtype='<f4') if blob else []
+    pairs = [(i, j) for i in range(person_count) for j in range(i + 1, person_count)]
+    return [(i, j, float(distance)) for (i, j), distance in zip(pairs, values)]
+
+def distances_json(blob, person_count):
+    """SQL function: video_analysis.distances JSON of a pack_distances blob"""
+    return json.dumps([list(pair) for pair in unpack_distances(blob, person_count)], separators=(',', ':'))
+
+def distance_at(blob, index):
+    """SQL function: distance at index of a pack_distances blob (pair i < j of n persons: i*n - i*(i+1)/2 + j-i-1)"""
+    if not blob or index < 0 or 4 * (index + 1) > len(blob):
+        return None
+    return float(np.frombuffer(blob, dtype='<f4', count=1, offset=4 * index)[0])
+
+def register_functions(conn):
+    """Register the SQL functions the views of a compact database with distance blobs call"""
+    conn.create_function('distances_json', 2, distances_json, deterministic=True)
+    conn.create_function('distance_at', 2, distance_at, deterministic=True)
+    return conn
+
+def drop_schema(cursor):
+    """Drop the tables and views of both schemas"""
+    for name in LEGACY_TABLES + COMPACT_TABLES:
+        row = cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+        if row and row[0] in ('table', 'view'):
+            cursor.execute(f'DROP {row[0].upper()} {name}')
+
+# SQL twin of process.format_time
+_FORMATTED_TIME = '''printf('%02d:%02d.%02d', CAST({0} / 60 AS INTEGER), CAST({0} AS INTEGER) % 60,
+                            CAST(({0} - CAST({0} AS INTEGER)) * 100 AS INTEGER))'''
+
+_ANALYSIS_DATE = "strftime('%Y-%m-%dT%H:%M:%f', {0}, 'unixepoch', 'localtime')"
+
+def create_compact_schema(cursor, distance_blob=False):
+    """Create the compact tables, their label tables and the legacy-compatible views"""
+    for table, labels in (('gender_labels', GENDERS), ('emotion_labels', EMOTIONS),
+                          ('danger_status_labels', DANGER_STATUSES)):
+        cursor.execute(f'CREATE TABLE {table} (code INTEGER PRIMARY KEY, label TEXT NOT NULL)')
+        cursor.executemany(f'INSERT INTO {table} VALUES (?, ?)', list(enumerate(labels)))
+
+    # One row per analyzed frame; distances holds pack_distances() when stored as a blob
+    cursor.execute('''
+        CREATE TABLE frames (
+            frame INTEGER PRIMARY KEY,
+            timestamp REAL NOT NULL,
+            person_count INTEGER NOT NULL,
+            alarm_reason TEXT,
+            analysis_time REAL,
+            distances BLOB
+        )
+    ''')
+
+    # Keyed by (frame, slot): face_id is -1 for unconfirmed tracks and is not unique per frame
+    cursor.execute('''
+        CREATE TABLE persons (
+            frame INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            face_id INTEGER NOT NULL,
+            gender INTEGER NOT NULL,
+            emotion INTEGER NOT NULL,
+            speed REAL,
+            angle REAL,
+            x INTEGER,
+            y INTEGER,
+            w INTEGER,
+            h INTEGER,
+            danger_status INTEGER NOT NULL,
+            danger_level INTEGER NOT NULL,
+            PRIMARY KEY (frame, slot)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE pair_distances (
+            frame INTEGER NOT NULL,
+            slot1 INTEGER NOT NULL,
+            slot2 INTEGER NOT NULL,
+            distance REAL NOT NULL,
+            PRIMARY KEY (frame, slot1, slot2)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE alarms (
+            frame INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            face_id INTEGER NOT NULL,
+            emotion INTEGER NOT NULL,
+            speed REAL,
+            nearby_persons TEXT,
+            alarm_reason TEXT,
+            danger_level INTEGER,
+            analysis_time REAL,
+            PRIMARY KEY (frame, slot)
+        ) WITHOUT ROWID
+    ''')
+
+    # View ids are derived from the keys (ordered like the legacy AUTOINCREMENT ids) instead of
+    # window functions, so filters on the views can still use the indexes of the base tables
+    formatted_time = _FORMATTED_TIME.format('f.timestamp')
+
+    # Blob distances are read through the register_functions() SQL functions
+    if distance_blob:
+        distances = 'distances_json(f.distances, f.person_count)'
+    else:
+        distances = '''(SELECT json_group_array(json_array(slot1, slot2, distance)) FROM
+                   (SELECT slot1, slot2, distance FROM pair_distances d WHERE d.frame = f.frame
+                    ORDER BY slot1, slot2))'''
+
+    cursor.execute(f'''
+        CREATE VIEW video_analysis AS
+        SELECT f.frame AS id,
+               f.timestamp,
+               {formatted_time} AS formatted_time,
+               f.person_count,
+               (SELECT json_group_array(label) FROM
+                   (SELECT l.label FROM persons p JOIN gender_labels l ON l.code = p.gender
+                    WHERE p.frame = f.frame ORDER BY p.slot)) AS genders,
+               (SELECT json_group_array(label) FROM
+                   (SELECT l.label FROM persons p JOIN emotion_labels l ON l.code = p.emotion
+                    WHERE p.frame = f.frame ORDER BY p.slot)) AS emotions,
+               (SELECT json_group_array(speed) FROM
+                   (SELECT speed FROM persons p WHERE p.frame = f.frame ORDER BY p.slot)) AS speeds,
+               (SELECT json_group_array(angle) FROM
+                   (SELECT angle FROM persons p WHERE p.frame = f.frame ORDER BY p.slot)) AS angles,
+               (SELECT json_group_array(face_id) FROM
+                   (SELECT face_id FROM persons p WHERE p.frame = f.frame ORDER BY p.slot)) AS face_ids,
+               {distances} AS distances,
+               {_ANALYSIS_DATE.format('f.analysis_time')} AS analysis_date,
+               f.alarm_reason IS NOT NULL AS alarm_triggered,
+               COALESCE(f.alarm_reason, '') AS alarm_reason
+        FROM frames f
+    ''')
+
+    cursor.execute('''
+        CREATE VIEW person_details AS
+        SELECT p.frame * 1000 + p.slot AS id,
+               f.timestamp,
+               p.face_id,
+               g.label AS gender,
+               e.label AS emotion,
+               p.speed,
+               p.angle,
+               p.w * p.h AS bbox_area,
+               CASE WHEN p.w * p.h > 8000 THEN 'Very Close'
+                    WHEN p.w * p.h > 5000 THEN 'Close'
+                    WHEN p.w * p.h > 2500 THEN 'Medium'
+                    WHEN p.w * p.h > 1200 THEN 'Far'
+                    ELSE 'Very Far' END AS distance_category,
+               p.x, p.y, p.w AS width, p.h AS height,
+               s.label AS danger_status,
+               p.danger_level,
+               s.label = 'dangerous' AS alarm_triggered
+        FROM persons p
+        JOIN frames f ON f.frame = p.frame
+        JOIN gender_labels g ON g.code = p.gender
+        JOIN emotion_labels e ON e.code = p.emotion
+        JOIN danger_status_labels s ON s.code = p.danger_status
+    ''')
+
+    if distance_blob:
+        cursor.execute('''
+            CREATE VIEW person_distances AS
+            SELECT id, timestamp, person1_id, person2_id, distance, distance < 150 AS is_close
+            FROM (SELECT (f.frame * 1000 + p1.slot) * 1000 + p2.slot AS id,
+                         f.timestamp,
+                         p1.face_id AS person1_id,
+                         p2.face_id AS person2_id,
+                         distance_at(f.distances, p1.slot * f.person_count - p1.slot * (p1.slot + 1) / 2
+                                                  + p2.slot - p1.slot - 1) AS distance
+                  FROM frames f
+                  JOIN persons p1 ON p1.frame = f.frame
+                  JOIN persons p2 ON p2.frame = f.frame AND p2.slot > p1.slot)
+        ''')
+    else:
+        cursor.execute('''
+            CREATE VIEW person_distances AS
+            SELECT (d.frame * 1000 + d.slot1) * 1000 + d.slot2 AS id,
+                   f.timestamp,
+                   p1.face_id AS person1_id,
+                   p2.face_id AS person2_id,
+                   d.distance,
+                   d.distance < 150 AS is_close
+            FROM pair_distances d
+            JOIN frames f ON f.frame = d.frame
+            JOIN persons p1 ON p1.frame = d.frame AND p1.slot = d.slot1
+            JOIN persons p2 ON p2.frame = d.frame AND p2.slot = d.slot2
+        ''')
+
+    cursor.execute(f'''
+        CREATE VIEW alarm_events AS
+        SELECT a.frame * 1000 + a.slot AS id,
+               f.timestamp,
+               {formatted_time} AS formatted_time,
+               a.face_id AS dangerous_person_id,
+               e.label AS dangerous_person_emotion,
+               a.speed AS dangerous_person_speed,
+               a.nearby_persons,
+               a.alarm_reason,
+               a.danger_level,
+               {_ANALYSIS_DATE.format('a.analysis_time')} AS analysis_date
+        FROM alarms a
+        JOIN frames f ON f.frame = a.frame
+        JOIN emotion_labels e ON e.code = a.emotion
+    ''')
+
+def create_query_indexes(cursor, storage_schema='legacy'):
+    """Indexes for the time-range, per-track and alarm queries (created once the rows are written)"""
+    if storage_schema == 'compact':
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_frames_timestamp ON frames (timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_persons_face_id ON persons (face_id, frame)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_alarms_danger_level ON alarms (danger_level, frame)')
+        return
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_person_details_face_id ON person_details (face_id, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alarm_events_timestamp ON alarm_events (timestamp, danger_level)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_video_analysis_timestamp ON video_analysis (timestamp)')
+
+COMPACT_INSERT_SQL = {
+    'frames': '''
+        INSERT INTO frames (frame, timestamp, person_count, alarm_reason, analysis_time, distances)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''',
+    'persons': '''
+        INSERT INTO persons (frame, slot, face_id, gender, emotion, speed, angle, x, y, w, h, danger_status, danger_level)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'pair_distances': '''
+        INSERT INTO pair_distances (frame, slot1, slot2, distance) VALUES (?, ?, ?, ?)
+    ''',
+    'alarms': '''
+        INSERT INTO alarms (frame, slot, face_id, emotion, speed, nearby_persons, alarm_reason, danger_level, analysis_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+}
+
+def read_compact_rows(source, remap):
+    """All compact rows of a database as {table: [row tuples]}, with track IDs passed through remap"""
+    rows = {
+        'frames': source.execute('''
+            SELECT frame, timestamp, person_count, alarm_reason, analysis_time, distances FROM frames ORDER BY frame
+        ''').fetchall(),
+        'pair_distances': source.execute('''
+            SELECT frame, slot1, slot2, distance FROM pair_distances ORDER BY frame, slot1, slot2
+        ''').fetchall()
+    }
+
+    rows['persons'] = [row[:2] + (remap(row[2]),) + row[3:] for row in source.execute('''
+        SELECT frame, slot, face_id, gender, emotion, speed, angle, x, y, w, h, danger_status, danger_level
+        FROM persons ORDER BY frame, slot
+    ''')]
+
+    rows['alarms'] = []
+    for row in source.execute('''
+        SELECT frame, slot, face_id, emotion, speed, nearby_persons, alarm_reason, danger_level, analysis_time
+        FROM alarms ORDER BY frame, slot
+    '''):
+        nearby_persons = [dict(person, id=remap(person['id'])) for person in json.loads(row[5])]
+        rows['alarms'].append(row[:2] + (remap(row[2]),) + row[3:5] + (json.dumps(nearby_persons),) + row[6:])
+
+    return rows
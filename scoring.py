@@ -0,0 +1,147 @@
+import json
+import numpy as np
+from schema import EMOTIONS
+from queries import time_range_conditions
+
+# Declarative danger scoring table (can be replaced by a JSON file with the same layout).
+# Tiers of a factor are checked in order and the first matching tier scores; every tier and
+# combination owns one bit of the reason mask, in table order.
+DEFAULT_SCORING_RULES = {
+    'emotion': [
+        {'emotion': 'fear', 'points': 4, 'reason': 'Fear detected'},
+        {'emotion': 'angry', 'points': 3, 'reason': 'Anger detected'},
+        {'emotion': 'sad', 'points': 2, 'reason': 'Sadness detected'}
+    ],
+    'speed': [
+        {'above': 100, 'points': 3, 'reason': 'Very high speed'},
+        {'above': 60, 'points': 2, 'reason': 'High speed'},
+        {'above': 30, 'points': 1, 'reason': 'Medium speed'}
+    ],
+    'bbox_area': [
+        {'above': 8000, 'points': 2, 'reason': 'Very close'},
+        {'above': 5000, 'points': 1, 'reason': 'Close'}
+    ],
+    'combinations': [
+        {'emotion': 'fear', 'speed_above': 60, 'points': 1, 'reason': 'CRITICAL: Fear + High speed'}
+    ],
+    'max_level': 10,
+    'alarm_level': 5
+}
+
+FACTORS = ('emotion', 'speed', 'bbox_area')
+
+def _emotion_code(label):
+    """EMOTIONS code of a rule's emotion label"""
+    label = str(label).lower()
+    if label not in EMOTIONS[1:]:
+        raise ValueError(f"unknown emotion {label!r}")
+    return EMOTIONS.index(label)
+
+def compile_scoring_rules(rules=None):
+    """Validate a rules table and turn it into lookup arrays; raises ValueError for bad tables"""
+    rules = rules or DEFAULT_SCORING_RULES
+    reasons = []
+    compiled = {'reasons': reasons}
+
+    try:
+        # Emotion: points and reason bit per emotion code
+        emotion_points = np.zeros(len(EMOTIONS), dtype=np.int64)
+        emotion_bits = np.zeros(len(EMOTIONS), dtype=np.int64)
+        for tier in rules.get('emotion', []):
+            code = _emotion_code(tier['emotion'])
+            if emotion_bits[code] == 0:
+                emotion_points[code] = int(tier['points'])
+                emotion_bits[code] = 1 << len(reasons)
+            reasons.append(tier['reason'])
+        compiled['emotion'] = (emotion_points, emotion_bits)
+
+        for factor in FACTORS[1:]:
+            tiers = []
+            for tier in rules.get(factor, []):
+                tiers.append((float(tier['above']), int(tier['points']), 1 << len(reasons)))
+                reasons.append(tier['reason'])
+            compiled[factor] = tiers
+
+        combinations = []
+        for combination in rules.get('combinations', []):
+            code = _emotion_code(combination['emotion'])
+            combinations.append((code, float(combination['speed_above']), int(combination['points']),
+                                 1 << len(reasons)))
+            reasons.append(combination['reason'])
+        compiled['combinations'] = combinations
+
+        compiled['max_level'] = int(rules.get('max_level', 10))
+        compiled['alarm_level'] = int(rules.get('alarm_level', 5))
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid scoring rules: {e}")
+
+    if len(reasons) > 63:
+        raise ValueError("Invalid scoring rules: more than 63 reasons")
+    return compiled
+
+def load_scoring_rules(path=''):
+    """Compiled rules from a JSON file (empty path = built-in table)"""
+    if not path:
+        return compile_scoring_rules()
+    with open(path, 'r', encoding='utf-8') as f:
+        return compile_scoring_rules(json.load(f))
+
+def emotion_codes(emotions):
+    """EMOTIONS codes of emotion labels (case-insensitive, unknown labels = 0)"""
+    lookup = {label: code for code, label in enumerate(EMOTIONS)}
+    return np.asarray([lookup.get((emotion or '').lower(), 0) for emotion in emotions], dtype=np.int64)
+
+def score_danger(emotions, speeds, bbox_areas, rules):
+    """
+    Danger levels and reason bitmasks of many persons in one call
+
+    emotions: EMOTIONS codes, speeds / bbox_areas: numbers, all of the same length (one frame
+    or a batch of frames). Returns (levels, reason_masks) as int64 arrays.
+    """
+    emotions = np.asarray(emotions, dtype=np.int64)
+    speeds = np.asarray(speeds, dtype=np.float64)
+    bbox_areas = np.asarray(bbox_areas, dtype=np.float64)
+
+    emotion_points, emotion_bits = rules['emotion']
+    levels = emotion_points[emotions]
+    masks = emotion_bits[emotions]
+
+    for factor, values in (('speed', speeds), ('bbox_area', bbox_areas)):
+        tiers = rules[factor]
+        if not tiers:
+            continue
+        conditions = [values > above for above, _, _ in tiers]
+        levels = levels + np.select(conditions, [points for _, points, _ in tiers], 0)
+        masks = masks | np.select(conditions, [bit for _, _, bit in tiers], 0)
+
+    for code, speed_above, points, bit in rules['combinations']:
+        matched = (emotions == code) & (speeds > speed_above)
+        levels = levels + np.where(matched, points, 0)
+        masks = masks | np.where(matched, bit, 0)
+
+    return np.minimum(levels, rules['max_level']), masks
+
+def render_reasons(mask, rules):
+    """Reason text of a reason bitmask"""
+    reasons = [reason for bit, reason in enumerate(rules['reasons']) if int(mask) >> bit & 1]
+    return " | ".join(reasons) if reasons else "Normal"
+
+def rescore_person_details(conn, rules, start=None, end=None):
+    """
+    Re-score stored person_details rows with another rules table
+
+    Works on both storage schemas (person_details is a view in the compact one) and returns
+    numpy arrays: ids, levels, reason_masks and is_dangerous.
+    """
+    conditions, params = time_range_conditions(start, end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    rows = conn.execute(f'''
+        SELECT id, emotion, speed, bbox_area FROM person_details {where} ORDER BY timestamp, id
+    ''', params).fetchall()
+
+    ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+    levels, masks = score_danger(emotion_codes([row[1] for row in rows]),
+                                 [row[2] or 0.0 for row in rows],
+                                 [row[3] or 0 for row in rows], rules)
+    return {'ids': ids, 'levels': levels, 'reason_masks': masks, 'is_dangerous': levels >= rules['alarm_level']}
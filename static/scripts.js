@@ -2,7 +2,15 @@
 let selectedFile = null;
 let currentTaskId = null;
 let pollInterval = null;
+let eventSource = null;
+let statusMessage = '';
+let lastAlarmNotice = 0;
 let isProcessing = false;
+let annotationFrames = [];
+let renderTimeout = null;
+
+// Seconds a frame's annotations stay on screen (until the next analyzed frame)
+const ANNOTATION_HOLD = 1.0;
 
 // DOM Elements
 const fileInput = document.getElementById('fileInput');
@@ -136,7 +144,7 @@ function uploadVideo() {
             document.getElementById('statusText').textContent = 'Analiz başlatılıyor...';
             
             showNotification('Video başarıyla yüklendi! Analiz başlatılıyor...', 'info');
-            startPolling();
+            startStatusUpdates();
         } else {
             throw new Error(data.message);
         }
@@ -147,6 +155,61 @@ function uploadVideo() {
     });
 }
 
+function startStatusUpdates() {
+    // Server-sent events when the browser supports them, polling otherwise
+    if (window.EventSource) {
+        startEventStream();
+    } else {
+        startPolling();
+    }
+}
+
+function startEventStream() {
+    closeEventStream();
+    eventSource = new EventSource(`/events/${currentTaskId}`);
+    
+    eventSource.addEventListener('status', event => {
+        handleStatus(JSON.parse(event.data));
+    });
+    
+    eventSource.addEventListener('progress', event => {
+        const data = JSON.parse(event.data);
+        document.getElementById('statusText').textContent = 'İşleniyor...';
+        updateProgress(statusMessage || 'İşleniyor...', data.progress);
+    });
+    
+    eventSource.addEventListener('alarm', event => {
+        showAlarm(JSON.parse(event.data));
+    });
+    
+    // The browser reconnects by itself after network errors; a closed stream means the endpoint is unusable
+    eventSource.onerror = () => {
+        if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+            closeEventStream();
+            if (isProcessing) startPolling();
+        }
+    };
+}
+
+function closeEventStream() {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+}
+
+function showAlarm(alarm) {
+    const riskLevel = alarm.danger_level >= 7 ? 'Yüksek' : 'Orta';
+    updateDangerStatus(`${alarm.count} kişi tehlikeli durumda (seviye ${alarm.danger_level})`, `Zaman: ${alarm.formatted_time}`, riskLevel);
+    
+    // At most one notification every 5 seconds
+    const now = Date.now();
+    if (now - lastAlarmNotice > 5000) {
+        lastAlarmNotice = now;
+        showNotification(`🚨 Alarm! ${alarm.formatted_time} - Seviye ${alarm.danger_level}`, 'warning');
+    }
+}
+
 function startPolling() {
     if (pollInterval) clearInterval(pollInterval);
     
@@ -162,19 +225,7 @@ function checkStatus() {
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            const status = data.data;
-            updateAnalysisStatus(status);
-            
-            if (status.status === 'completed') {
-                clearInterval(pollInterval);
-                showResults(status);
-                isProcessing = false;
-                stopBtn.disabled = true;
-            } else if (status.status === 'failed') {
-                clearInterval(pollInterval);
-                showNotification(`Analiz başarısız: ${status.message}`, 'error');
-                stopProcessing();
-            }
+            handleStatus(data.data);
         }
     })
     .catch(error => {
@@ -183,9 +234,27 @@ function checkStatus() {
     });
 }
 
+function handleStatus(status) {
+    updateAnalysisStatus(status);
+    
+    if (status.status === 'completed') {
+        clearInterval(pollInterval);
+        closeEventStream();
+        showResults(status);
+        isProcessing = false;
+        stopBtn.disabled = true;
+    } else if (status.status === 'failed') {
+        clearInterval(pollInterval);
+        closeEventStream();
+        showNotification(`Analiz başarısız: ${status.message}`, 'error');
+        stopProcessing();
+    }
+}
+
 function updateAnalysisStatus(status) {
     const progress = status.progress || 0;
     const message = status.message || 'İşleniyor...';
+    statusMessage = message;
     
     document.getElementById('statusText').textContent = status.status === 'processing' ? 'İşleniyor...' : 'Hazırlanıyor...';
     updateProgress(message, progress);
@@ -235,6 +304,9 @@ function showResults(status) {
     // Update database status
     updateDatabaseStatus('Güncel', 'Az önce', `${stats.processed_frames} frame`);
     
+    // Original video with the analysis drawn over it in the browser
+    showOverlayPlayer(status.download_links);
+    
     showNotification('🎉 Video analizi başarıyla tamamlandı!', 'success');
     
     // Reset for new analysis
@@ -247,6 +319,7 @@ function stopProcessing() {
         clearInterval(pollInterval);
         pollInterval = null;
     }
+    closeEventStream();
     
     isProcessing = false;
     startBtn.disabled = false;
@@ -262,12 +335,157 @@ function stopProcessing() {
     showNotification('Analiz durduruldu', 'warning');
 }
 
+function showOverlayPlayer(links) {
+    if (!links || !links.frame_feed) return;
+    
+    fetch(links.frame_feed)
+    .then(response => response.text())
+    .then(text => {
+        annotationFrames = text.split('\n').filter(line => line).map(line => JSON.parse(line));
+        
+        const video = document.getElementById('resultVideo');
+        video.src = links.original_video;
+        video.onplay = () => requestAnimationFrame(overlayLoop);
+        video.onseeked = drawOverlay;
+        video.onpause = drawOverlay;
+        video.onloadeddata = drawOverlay;
+        document.getElementById('overlayPlayer').style.display = 'block';
+    })
+    .catch(error => {
+        console.error('Annotation load error:', error);
+    });
+}
+
+function overlayLoop() {
+    const video = document.getElementById('resultVideo');
+    drawOverlay();
+    if (!video.paused && !video.ended) {
+        requestAnimationFrame(overlayLoop);
+    }
+}
+
+function findAnnotation(time) {
+    // Last analyzed frame at or before time (frames are in time order)
+    let low = 0;
+    let high = annotationFrames.length - 1;
+    let found = null;
+    while (low <= high) {
+        const middle = (low + high) >> 1;
+        if (annotationFrames[middle].timestamp <= time) {
+            found = annotationFrames[middle];
+            low = middle + 1;
+        } else {
+            high = middle - 1;
+        }
+    }
+    return found && time - found.timestamp <= ANNOTATION_HOLD ? found : null;
+}
+
+function dangerColor(level) {
+    // Same colors as the server-side rendering (get_danger_color)
+    if (level >= 8) return '#ff0000';
+    if (level >= 6) return '#ffa500';
+    if (level >= 4) return '#ffff00';
+    return '#00ff00';
+}
+
+function drawOverlay() {
+    const video = document.getElementById('resultVideo');
+    const canvas = document.getElementById('overlayCanvas');
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    
+    const record = findAnnotation(video.currentTime);
+    if (!record || record.error) return;
+    
+    ctx.font = 'bold 14px sans-serif';
+    record.persons.forEach(person => {
+        const [x, y, w, h] = person.box;
+        const color = dangerColor(person.danger_level);
+        
+        // Motion arrow from the previous position
+        if (person.prev_center) {
+            ctx.strokeStyle = '#00ff00';
+            ctx.lineWidth = 2;
+            ctx.beginPath();
+            ctx.moveTo(person.prev_center[0], person.prev_center[1]);
+            ctx.lineTo(x + w / 2, y + h / 2);
+            ctx.stroke();
+        }
+        
+        ctx.strokeStyle = color;
+        ctx.lineWidth = person.is_dangerous ? 3 : 1;
+        ctx.strokeRect(x, y, w, h);
+        
+        ctx.fillStyle = '#ffffff';
+        ctx.fillText(`ID:${person.id} ${person.gender} ${person.emotion} ${person.distance_category}`, x, y - 10);
+        if (person.speed > 0) {
+            ctx.fillStyle = color;
+            ctx.fillText(`${person.speed.toFixed(1)} px/s`, x, y - 30);
+        }
+        if (person.is_dangerous) {
+            ctx.fillStyle = '#ff0000';
+            ctx.fillText(`DANGER: ${person.danger_level}/10`, x, y - 50);
+        }
+    });
+    
+    // Close pairs
+    ctx.strokeStyle = '#ff0000';
+    ctx.fillStyle = '#ff0000';
+    ctx.lineWidth = 2;
+    record.close_pairs.forEach(([x1, y1, x2, y2, distance]) => {
+        ctx.beginPath();
+        ctx.moveTo(x1, y1);
+        ctx.lineTo(x2, y2);
+        ctx.stroke();
+        ctx.fillText(`${Math.round(distance)} px`, (x1 + x2) / 2, (y1 + y2) / 2);
+    });
+    
+    if (record.alarm) {
+        ctx.lineWidth = 8;
+        ctx.strokeRect(0, 0, canvas.width, canvas.height);
+        ctx.font = 'bold 28px sans-serif';
+        ctx.fillText(`ALARM! ${record.alarm.count} DANGEROUS PERSON(S)`, 50, 80);
+        ctx.font = 'bold 22px sans-serif';
+        ctx.fillText(`DANGER LEVEL: ${record.alarm.danger_level}/10`, 50, 120);
+    }
+}
+
 function downloadVideo() {
     if (!currentTaskId) {
         showNotification('İndirilebilir video bulunamadı', 'error');
         return;
     }
     
+    // Headless analyses render the annotated video on request
+    requestRender('POST');
+}
+
+function requestRender(method) {
+    fetch(`/render/${currentTaskId}`, { method: method })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            throw new Error(data.message);
+        }
+        if (data.render === 'completed') {
+            startVideoDownload();
+        } else if (data.render === 'failed') {
+            showNotification(`Video oluşturulamadı: ${data.error}`, 'error');
+        } else {
+            if (method === 'POST') {
+                showNotification('Analiz edilmiş video hazırlanıyor...', 'info');
+            }
+            clearTimeout(renderTimeout);
+            renderTimeout = setTimeout(() => requestRender('GET'), 2000);
+        }
+    })
+    .catch(error => {
+        showNotification(`Hata: ${error.message}`, 'error');
+    });
+}
+
+function startVideoDownload() {
     const downloadUrl = `/download/video/${currentTaskId}`;
     const link = document.createElement('a');
     link.href = downloadUrl;
@@ -297,6 +515,13 @@ function downloadDatabase() {
 }
 
 function resetAnalysisState() {
+    clearTimeout(renderTimeout);
+    annotationFrames = [];
+    const video = document.getElementById('resultVideo');
+    video.pause();
+    video.removeAttribute('src');
+    document.getElementById('overlayPlayer').style.display = 'none';
+    
     document.getElementById('analysisId').textContent = '-';
     document.getElementById('fileName').textContent = '-';
     document.getElementById('statusText').textContent = '-';
@@ -0,0 +1,242 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Task states that no longer change; they are evicted ttl seconds after their last update
+FINISHED_STATES = ('completed', 'failed')
+
+# Seconds between eviction sweeps
+EVICT_INTERVAL = 60
+
+# Seconds between event checks of a waiting SQLite reader
+EVENT_POLL_INTERVAL = 0.25
+
+# Event types that only matter in their latest version; publishing one replaces the previous
+COALESCED_EVENTS = ('progress',)
+
+class MemoryStatusStore:
+    """Task status dicts and events kept in this process (single web process only)"""
+
+    def __init__(self, ttl=7 * 24 * 3600):
+        self.ttl = ttl
+        self.tasks = {}
+        self.updated = {}
+        self.events = {}
+        self.last_event_id = 0
+        self.lock = threading.Condition()
+        self.last_evict = 0.0
+
+    def create(self, task_id, status):
+        """Store a new task's status"""
+        with self.lock:
+            self._maybe_evict()
+            self.tasks[task_id] = dict(status)
+            self.updated[task_id] = time.time()
+
+    def get(self, task_id):
+        """Copy of a task's status, or None"""
+        with self.lock:
+            status = self.tasks.get(task_id)
+            return dict(status) if status is not None else None
+
+    def update(self, task_id, **fields):
+        """Atomically merge fields into a task's status (None removes a field); returns it, or None"""
+        with self.lock:
+            status = self.tasks.get(task_id)
+            if status is None:
+                return None
+            merge_fields(status, fields)
+            self.updated[task_id] = time.time()
+            return dict(status)
+
+    def delete(self, task_id):
+        """Remove a task and its events; returns True if it existed"""
+        with self.lock:
+            self.updated.pop(task_id, None)
+            self.events.pop(task_id, None)
+            self.lock.notify_all()
+            return self.tasks.pop(task_id, None) is not None
+
+    def publish(self, task_id, event_type, data):
+        """Append an event to a task's event log (see COALESCED_EVENTS)"""
+        with self.lock:
+            events = self.events.setdefault(task_id, [])
+            if event_type in COALESCED_EVENTS:
+                events[:] = [event for event in events if event[1] != event_type]
+            self.last_event_id += 1
+            events.append((self.last_event_id, event_type, data))
+            self.lock.notify_all()
+
+    def latest_event_id(self, task_id):
+        """Id of a task's newest event (0 if none)"""
+        with self.lock:
+            events = self.events.get(task_id)
+            return events[-1][0] if events else 0
+
+    def wait_events(self, task_id, after=0, timeout=15.0):
+        """Events (id, type, data) of a task newer than after, waiting up to timeout seconds for one"""
+        def newer():
+            return [event for event in self.events.get(task_id, []) if event[0] > after]
+
+        with self.lock:
+            self.lock.wait_for(lambda: newer() or task_id not in self.tasks, timeout)
+            return newer()
+
+    def count(self):
+        """Number of stored tasks"""
+        with self.lock:
+            return len(self.tasks)
+
+    def _maybe_evict(self):
+        now = time.time()
+        if now - self.last_evict < EVICT_INTERVAL:
+            return
+        self.last_evict = now
+        for task_id in [t for t, status in self.tasks.items()
+                        if status.get('status') in FINISHED_STATES and self.updated[t] < now - self.ttl]:
+            del self.tasks[task_id]
+            del self.updated[task_id]
+            self.events.pop(task_id, None)
+
+class SQLiteStatusStore:
+    """
+    Task status dicts and events in a SQLite database (WAL), shared by all web processes on the host
+
+    Updates are read-modify-write inside one IMMEDIATE transaction, so concurrent
+    progress / state updates from different processes do not lose fields.
+    """
+
+    def __init__(self, db_path, ttl=7 * 24 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.local = threading.local()
+        self.last_evict = 0.0
+
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS task_status (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_task_status_updated ON task_status (status, updated)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS task_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_task_events_task ON task_events (task_id, id)')
+
+    def _connection(self):
+        """One connection per thread (autocommit; transactions are explicit)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def create(self, task_id, status):
+        """Store a new task's status"""
+        conn = self._connection()
+        self._maybe_evict(conn)
+        conn.execute('INSERT OR REPLACE INTO task_status (task_id, status, data, updated) VALUES (?, ?, ?, ?)',
+                     (task_id, status.get('status', ''), json.dumps(status), time.time()))
+
+    def get(self, task_id):
+        """A task's status, or None"""
+        row = self._connection().execute('SELECT data FROM task_status WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id, **fields):
+        """Atomically merge fields into a task's status (None removes a field); returns it, or None"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM task_status WHERE task_id = ?', (task_id,)).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return None
+            status = merge_fields(json.loads(row[0]), fields)
+            conn.execute('UPDATE task_status SET status = ?, data = ?, updated = ? WHERE task_id = ?',
+                         (status.get('status', ''), json.dumps(status), time.time(), task_id))
+            conn.execute('COMMIT')
+            return status
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, task_id):
+        """Remove a task and its events; returns True if it existed"""
+        conn = self._connection()
+        conn.execute('DELETE FROM task_events WHERE task_id = ?', (task_id,))
+        return conn.execute('DELETE FROM task_status WHERE task_id = ?', (task_id,)).rowcount > 0
+
+    def publish(self, task_id, event_type, data):
+        """Append an event to a task's event log (see COALESCED_EVENTS)"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if event_type in COALESCED_EVENTS:
+                conn.execute('DELETE FROM task_events WHERE task_id = ? AND type = ?', (task_id, event_type))
+            conn.execute('INSERT INTO task_events (task_id, type, data, created) VALUES (?, ?, ?, ?)',
+                         (task_id, event_type, json.dumps(data), time.time()))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def latest_event_id(self, task_id):
+        """Id of a task's newest event (0 if none)"""
+        row = self._connection().execute('SELECT MAX(id) FROM task_events WHERE task_id = ?', (task_id,)).fetchone()
+        return row[0] or 0
+
+    def wait_events(self, task_id, after=0, timeout=15.0):
+        """Events (id, type, data) of a task newer than after, polling up to timeout seconds for one"""
+        conn = self._connection()
+        deadline = time.monotonic() + timeout
+        while True:
+            rows = conn.execute('SELECT id, type, data FROM task_events WHERE task_id = ? AND id > ? ORDER BY id',
+                                (task_id, after)).fetchall()
+            if rows or time.monotonic() >= deadline:
+                return [(event_id, event_type, json.loads(data)) for event_id, event_type, data in rows]
+            time.sleep(EVENT_POLL_INTERVAL)
+
+    def count(self):
+        """Number of stored tasks"""
+        return self._connection().execute('SELECT COUNT(*) FROM task_status').fetchone()[0]
+
+    def _maybe_evict(self, conn):
+        now = time.time()
+        if now - self.last_evict < EVICT_INTERVAL:
+            return
+        self.last_evict = now
+        placeholders = ', '.join('?' * len(FINISHED_STATES))
+        conn.execute(f'DELETE FROM task_status WHERE status IN ({placeholders}) AND updated < ?',
+                     FINISHED_STATES + (now - self.ttl,))
+        conn.execute('DELETE FROM task_events WHERE task_id NOT IN (SELECT task_id FROM task_status)')
+
+def merge_fields(status, fields):
+    """Apply an update to a status dict in place (None values remove the field)"""
+    for key, value in fields.items():
+        if value is None:
+            status.pop(key, None)
+        else:
+            status[key] = value
+    return status
+
+def open_status_store(kind='sqlite', db_path='status.db', ttl=7 * 24 * 3600):
+    """Status store by name: 'sqlite' (default, shared between processes) or 'memory'"""
+    if kind == 'memory':
+        return MemoryStatusStore(ttl)
+    if kind == 'sqlite':
+        return SQLiteStatusStore(db_path, ttl)
+    raise ValueError(f"Unknown status store: {kind}")
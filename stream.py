@@ -0,0 +1,306 @@
+import collections
+import os
+import threading
+import time
+import traceback
+import cv2
+import numpy as np
+from process import (build_analysis_options, create_analysis_state, setup_database, open_database_writer,
+                     close_database_writer, analyze_frames, analyze_sampled_frame, draw_frame_record,
+                     print_database_stats)
+from schema import create_query_indexes
+from encoder import open_video_encoder
+
+# Live sources without a usable FPS (and file replay fallback)
+DEFAULT_SOURCE_FPS = 25.0
+
+# Latencies kept for the percentile in the stream statistics
+LATENCY_WINDOW = 1000
+
+# Processed frame records kept in memory (only their count is needed on a live stream)
+FRAME_RESULTS_LIMIT = 1000
+
+def parse_source(source):
+    """Camera index for '0', '1', ...; URLs (rtsp://, http://) and file paths as given"""
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+def is_file_source(source):
+    return isinstance(source, str) and os.path.isfile(source)
+
+class LatestFrameCapture:
+    """
+    Reads a live source in a background thread, keeping only the newest frame
+
+    Frames the analysis has not picked up before the next one arrives are dropped, so a slow
+    analysis never works through a backlog. A source that fails to open or stops delivering
+    frames is reopened with exponential backoff. File sources end at end of file; with
+    realtime they are replayed at their own frame rate, like a camera.
+    """
+
+    def __init__(self, source, realtime=True, reconnect_delay=1.0, max_reconnect_delay=30.0, read_timeout_ms=5000):
+        self.source = parse_source(source)
+        self.is_file = is_file_source(self.source)
+        self.realtime = realtime
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.read_timeout_ms = read_timeout_ms
+        self.fps = DEFAULT_SOURCE_FPS
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.reconnects = 0
+        self.ended = False
+        self._latest = None
+        self._taken = True
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stream-capture", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._thread.join()
+
+    def read(self, timeout=1.0):
+        """Newest frame not returned before as (index, captured_at, frame); None on timeout or end"""
+        with self._condition:
+            if self._taken and not self.ended:
+                self._condition.wait(timeout)
+            if self._taken:
+                return None
+            self._taken = True
+            return self._latest
+
+    def _open(self):
+        params = []
+        if not self.is_file:
+            # Bounded blocking so a dead camera is noticed and reconnected (FFmpeg/GStreamer backends)
+            params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, self.read_timeout_ms,
+                      cv2.CAP_PROP_READ_TIMEOUT_MSEC, self.read_timeout_ms]
+        cap = cv2.VideoCapture(self.source, cv2.CAP_ANY, params)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        # Keep the backend's own buffer short, old frames are useless here
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if 0 < fps < 1000:
+            self.fps = fps
+        return cap
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while not self._stop.is_set():
+            cap = self._open()
+            if cap is not None:
+                started = time.monotonic()
+                session_frames = 0
+                while not self._stop.is_set():
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    session_frames += 1
+                    if self.is_file and self.realtime:
+                        # Replay at the file's frame rate
+                        wait = started + session_frames / self.fps - time.monotonic()
+                        if wait > 0:
+                            self._stop.wait(wait)
+                    self._publish(frame)
+                cap.release()
+
+                if self.is_file or self._stop.is_set():
+                    break
+                self.reconnects += 1
+                if session_frames:
+                    delay = self.reconnect_delay
+
+            # Back off while the source keeps failing
+            print(f"Stream source unavailable, reconnecting in {delay:.0f}s: {self.source}")
+            self._stop.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+        with self._condition:
+            self.ended = True
+            self._condition.notify_all()
+
+    def _publish(self, frame):
+        with self._condition:
+            if not self._taken:
+                self.frames_dropped += 1
+            self._latest = (self.frames_read, time.monotonic(), frame)
+            self._taken = False
+            self.frames_read += 1
+            self._condition.notify_all()
+
+def latency_summary(latencies):
+    """Mean / p95 / max of end-to-end latencies (ms)"""
+    if not latencies:
+        return {'mean_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+    values = np.array(latencies)
+    return {
+        'mean_ms': round(float(values.mean()), 1),
+        'p95_ms': round(float(np.percentile(values, 95)), 1),
+        'max_ms': round(float(values.max()), 1)
+    }
+
+def analyze_stream(source, output_dir="outputs", options=None, duration=0, latency_budget_ms=500,
+                   realtime=True, record_video=True, video_fps=10, stop_event=None, progress_callback=None):
+    """
+    Analyze a live source (camera index, RTSP/HTTP URL, or a file replayed in real time)
+
+    Each loop analyzes the newest captured frame. A frame is skipped as stale when its age plus
+    the recent analysis time would exceed latency_budget_ms, so alarms are raised at most about
+    latency_budget_ms after the frame was captured. Runs until duration seconds have passed
+    (0 = no limit), stop_event is set or a file source ends.
+
+    Args:
+        source: Camera index, stream URL or video file path
+        output_dir (str): Folder for the database and the recorded video
+        options (dict): DEFAULT_ANALYSIS_OPTIONS overrides (sampling, pipeline, shards and
+            checkpoint settings do not apply to streams)
+        duration (float): Seconds to analyze, 0 = until stopped
+        latency_budget_ms (float): Max time from capture to the frame's alarm decision
+        realtime (bool): Replay file sources at their frame rate
+        record_video (bool): Write the annotated frames to <output_dir>/live_analyzed.mp4 (options['video_encoder'])
+        video_fps (float): Frame rate of the recorded video (analyzed frames are repeated to keep time)
+        stop_event (threading.Event): Set to end the analysis
+        progress_callback (function): Called with the elapsed percentage of duration
+
+    Returns:
+        dict: Analysis results, like analyze_video
+    """
+    capture = None
+    try:
+        options = build_analysis_options(options)
+        if options['shards'] > 1 or options['pipeline']:
+            raise ValueError("Live streams are analyzed frame by frame (no shards or pipeline)")
+
+        os.makedirs(output_dir, exist_ok=True)
+        db_path = os.path.join(output_dir, "alarm_analysis.db")
+        output_video_path = os.path.join(output_dir, "live_analyzed.mp4") if record_video else None
+
+        conn = setup_database(db_path, options['storage_schema'], options['distance_blob'])
+        writer = open_database_writer(conn, db_path, options)
+        state = create_analysis_state(options)
+        stop_event = stop_event or threading.Event()
+
+        out = None
+        processed = 0
+        stale = 0
+        over_budget = 0
+        expected_ms = 0.0
+        latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+        try:
+            capture = LatestFrameCapture(source, realtime=realtime).start()
+            print(f"Live analysis started: {source} (latency budget {latency_budget_ms} ms)")
+            started = time.monotonic()
+
+            while not stop_event.is_set():
+                elapsed = time.monotonic() - started
+                if duration and elapsed >= duration:
+                    break
+                if progress_callback and duration:
+                    progress_callback(min(100.0, elapsed / duration * 100))
+
+                item = capture.read(timeout=0.5)
+                if item is None:
+                    if capture.ended:
+                        break
+                    continue
+                index, captured_at, frame = item
+
+                # Too old to be decided within the budget: wait for a fresher frame
+                age_ms = (time.monotonic() - captured_at) * 1000
+                if age_ms + expected_ms > latency_budget_ms and expected_ms < latency_budget_ms:
+                    stale += 1
+                    continue
+
+                analysis_started = time.monotonic()
+                frame = cv2.resize(frame, (1280, 720))
+                detect = processed % options['detect_interval'] == 0
+                analysis = analyze_frames([frame], options)[0] if detect else None
+                record = analyze_sampled_frame(processed, frame, capture.fps, analysis, state, writer, options,
+                                               timestamp=captured_at - started)
+                processed += 1
+
+                done = time.monotonic()
+                latency_ms = (done - captured_at) * 1000
+                latencies.append(latency_ms)
+                if latency_ms > latency_budget_ms:
+                    over_budget += 1
+                # Smoothed analysis time, used to judge staleness before starting the next frame
+                analysis_ms = (done - analysis_started) * 1000
+                expected_ms = analysis_ms if processed == 1 else 0.8 * expected_ms + 0.2 * analysis_ms
+                if processed == 10 and expected_ms >= latency_budget_ms:
+                    print(f"Analysis takes {expected_ms:.0f} ms per frame, over the {latency_budget_ms} ms budget "
+                          f"(try the batched mode or a smaller detection_width)")
+
+                # Only the count of processed frames matters on an endless stream
+                if len(state['frame_results']) >= 2 * FRAME_RESULTS_LIMIT:
+                    del state['frame_results'][:FRAME_RESULTS_LIMIT]
+
+                if output_video_path:
+                    draw_frame_record(frame, record)
+                    if out is None:
+                        out = open_video_encoder(output_video_path, video_fps, options)
+                    # Placed at its capture time (the previous frame is held until then) so the recording plays in real time
+                    out.write(frame, int((captured_at - started) * video_fps))
+        finally:
+            if capture is not None:
+                capture.stop()
+            if out is not None:
+                out.close()
+            close_database_writer(writer, conn)
+
+        create_query_indexes(conn.cursor(), options['storage_schema'])
+        conn.commit()
+        print_database_stats(conn)
+        conn.close()
+
+        stats = {
+            'duration': round(time.monotonic() - started, 1),
+            'frames_captured': capture.frames_read,
+            'frames_dropped': capture.frames_dropped,
+            'frames_stale': stale,
+            'processed_frames': processed,
+            'over_budget': over_budget,
+            'latency': latency_summary(latencies),
+            'reconnects': capture.reconnects,
+            'total_alarms': state['total_alarms'],
+            'max_danger_level': state['max_danger_detected']
+        }
+        print(f"Live analysis finished: {processed} of {capture.frames_read} frames analyzed, "
+              f"p95 latency {stats['latency']['p95_ms']} ms")
+
+        files = {'database': db_path}
+        if out is not None and out.index:
+            files['analyzed_video'] = output_video_path
+        return {
+            'success': True,
+            'message': 'Live analysis completed successfully!',
+            'stats': stats,
+            'files': files
+        }
+
+    except Exception as e:
+        print(f"Live analysis error: {e}")
+        print(traceback.format_exc())
+        return {
+            'success': False,
+            'message': f'Live analysis failed: {str(e)}',
+            'error': str(e)
+        }
+
+if __name__ == "__main__":
+    import sys
+    result = analyze_stream(sys.argv[1] if len(sys.argv) > 1 else os.environ.get('STREAM_SOURCE', '0'),
+                            duration=float(os.environ.get('STREAM_DURATION', 0)),
+                            latency_budget_ms=float(os.environ.get('STREAM_LATENCY_BUDGET_MS', 500)))
+    print(result['message'])
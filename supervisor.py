@@ -0,0 +1,332 @@
+import collections
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from process import (build_analysis_options, create_analysis_state, setup_database, open_database_writer,
+                     close_database_writer, analyze_frames, analyze_sampled_frame, motion_frame,
+                     frame_changed, print_database_stats)
+from schema import create_query_indexes
+from stream import LatestFrameCapture, latency_summary, LATENCY_WINDOW, FRAME_RESULTS_LIMIT
+
+class CameraStream:
+    """Capture, tracking state and result database of one camera under a StreamSupervisor"""
+
+    def __init__(self, name, source, output_dir, options, realtime=True):
+        self.name = name
+        self.source = source
+        self.output_dir = output_dir
+        self.options = options
+        os.makedirs(output_dir, exist_ok=True)
+        self.db_path = os.path.join(output_dir, "alarm_analysis.db")
+        self.conn = setup_database(self.db_path, options['storage_schema'], options['distance_blob'])
+        self.writer = open_database_writer(self.conn, self.db_path, options)
+        self.state = create_analysis_state(options)
+        self.capture = LatestFrameCapture(source, realtime=realtime)
+
+        # Scheduling: at most one frame in flight per camera keeps its tracking in order
+        self.busy = False
+        self.started = None
+        self.last_analyzed = None
+        self.last_checked = None
+        self.last_alarm = None
+        self.reference = None
+
+        self.processed = 0
+        self.stale = 0
+        self.skipped_still = 0
+        self.over_budget = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def start(self):
+        self.started = time.monotonic()
+        self.capture.start()
+
+    def process(self, frame, item, analysis, latency_budget_ms):
+        """Track, score and store one analyzed frame; returns its record"""
+        _, captured_at, _ = item
+        record = analyze_sampled_frame(self.processed, frame, self.capture.fps, analysis, self.state, self.writer,
+                                       self.options, timestamp=captured_at - self.started)
+        self.processed += 1
+
+        done = time.monotonic()
+        latency_ms = (done - captured_at) * 1000
+        self.latencies.append(latency_ms)
+        if latency_ms > latency_budget_ms:
+            self.over_budget += 1
+        if record['alarm'] is not None:
+            self.last_alarm = done
+
+        # Only the count of processed frames matters on an endless stream
+        if len(self.state['frame_results']) >= 2 * FRAME_RESULTS_LIMIT:
+            del self.state['frame_results'][:FRAME_RESULTS_LIMIT]
+        return record
+
+    def close(self):
+        """Stop capturing and finish the camera's database"""
+        self.capture.stop()
+        close_database_writer(self.writer, self.conn)
+        create_query_indexes(self.conn.cursor(), self.options['storage_schema'])
+        self.conn.commit()
+        print(f"\nCamera {self.name}:")
+        print_database_stats(self.conn)
+        self.conn.close()
+
+    def stats(self):
+        return {
+            'source': str(self.source),
+            'frames_captured': self.capture.frames_read,
+            'processed_frames': self.processed,
+            'frames_stale': self.stale,
+            'skipped_still': self.skipped_still,
+            'over_budget': self.over_budget,
+            'latency': latency_summary(self.latencies),
+            'reconnects': self.capture.reconnects,
+            'total_alarms': self.state['total_alarms'],
+            'max_danger_level': self.state['max_danger_detected']
+        }
+
+class StreamSupervisor:
+    """
+    Analyzes many live cameras from one shared inference budget
+
+    Every camera keeps its own capture thread, tracker, track state and database. A single
+    scheduler hands the newest frames of due cameras to inference_workers threads in batches of
+    up to batch_frames frames (one analyze_frames call, so batched/server modes batch across
+    cameras), at most inference_fps frames per second in total (0 = as fast as workers allow).
+
+    A camera with an alarm in the last alarm_hold seconds is analyzed every min_interval
+    seconds. Other cameras are checked for motion every min_interval seconds and analyzed when
+    they changed, and at least every max_interval seconds. When more cameras are due than the
+    budget allows, the ones most overdue relative to their interval go first, so alarm cameras
+    get most of the budget without starving idle ones. Frames older than latency_budget_ms by
+    the time they would be analyzed are skipped.
+    """
+
+    def __init__(self, sources, output_dir="outputs/cameras", options=None, inference_workers=1, inference_fps=0,
+                 min_interval=0.2, max_interval=2.0, alarm_hold=10.0, latency_budget_ms=1000, realtime=True,
+                 on_alarm=None):
+        self.options = build_analysis_options(options)
+        if self.options['shards'] > 1 or self.options['pipeline']:
+            raise ValueError("Live streams are analyzed frame by frame (no shards or pipeline)")
+        if inference_workers < 1 or inference_fps < 0 or not 0 < min_interval <= max_interval:
+            raise ValueError("Invalid supervisor settings")
+
+        self.inference_workers = inference_workers
+        self.inference_fps = inference_fps
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alarm_hold = alarm_hold
+        self.latency_budget_ms = latency_budget_ms
+        self.on_alarm = on_alarm
+        self.batch_size = self.options['batch_frames'] if self.options['analysis_mode'] != 'deepface' else 1
+
+        self.cameras = [CameraStream(name, source, os.path.join(output_dir, name), self.options, realtime)
+                        for name, source in sources.items()]
+        self.executor = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="inference")
+        self.slots = threading.Semaphore(inference_workers)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stream-supervisor", daemon=True)
+        self.started = None
+        self.batches = 0
+
+    def start(self):
+        self.started = time.monotonic()
+        for camera in self.cameras:
+            camera.start()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop scheduling, wait for frames in flight and close all cameras"""
+        self.stop_event.set()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        for camera in self.cameras:
+            camera.close()
+
+    def wait(self, duration=0):
+        """Block until duration seconds passed (0 = until every source ended) or stop() was called"""
+        deadline = time.monotonic() + duration if duration else None
+        while not self.stop_event.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            if all(camera.capture.ended for camera in self.cameras):
+                return
+            self.stop_event.wait(0.2)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        cameras = {camera.name: camera.stats() for camera in self.cameras}
+        processed = sum(stats['processed_frames'] for stats in cameras.values())
+        return {
+            'duration': round(elapsed, 1),
+            'cameras': cameras,
+            'processed_frames': processed,
+            'analyzed_fps': round(processed / elapsed, 1) if elapsed else 0.0,
+            'batches': self.batches,
+            'total_alarms': sum(stats['total_alarms'] for stats in cameras.values())
+        }
+
+    def _alarm_recent(self, camera, now):
+        return camera.last_alarm is not None and now - camera.last_alarm < self.alarm_hold
+
+    def _priority(self, camera, now):
+        """(overdue ratio, alarm) sort key; a ratio below zero means the camera is not due yet"""
+        if camera.last_analyzed is None:
+            return (float('inf'), True)
+        elapsed = now - camera.last_analyzed
+        if self._alarm_recent(camera, now):
+            return (elapsed / self.min_interval - 1, True)
+        if elapsed >= self.max_interval:
+            return (elapsed / self.max_interval - 1, False)
+        if camera.last_checked is None or now - camera.last_checked >= self.min_interval:
+            # Motion check due (analyzed only if the frame changed)
+            return (elapsed / self.min_interval - 1, False)
+        return (-1.0, False)
+
+    def _select_batch(self, now, limit):
+        """Newest frames of the most urgent due cameras, up to limit"""
+        ranked = []
+        for camera in self.cameras:
+            if camera.busy:
+                continue
+            priority = self._priority(camera, now)
+            if priority[0] >= 0:
+                ranked.append((priority, camera))
+        ranked.sort(key=lambda entry: entry[0], reverse=True)
+
+        batch = []
+        for _, camera in ranked:
+            item = camera.capture.read(timeout=0)
+            if item is None:
+                continue
+            if (now - item[1]) * 1000 > self.latency_budget_ms:
+                camera.stale += 1
+                continue
+
+            # Idle cameras between their max_interval analyses only run when something moved
+            small = motion_frame(item[2], self.options['motion_width'])
+            must_analyze = (camera.last_analyzed is None or self._alarm_recent(camera, now)
+                            or now - camera.last_analyzed >= self.max_interval)
+            if not must_analyze:
+                camera.last_checked = now
+                if not frame_changed(small, camera.reference, self.options['motion_threshold']):
+                    camera.skipped_still += 1
+                    continue
+
+            camera.reference = small
+            camera.last_analyzed = camera.last_checked = now
+            camera.busy = True
+            batch.append((camera, item))
+            if len(batch) >= limit:
+                break
+        return batch
+
+    def _run(self):
+        tokens = float(self.batch_size)
+        last_refill = time.monotonic()
+        while not self.stop_event.is_set():
+            if not self.slots.acquire(timeout=0.05):
+                continue
+
+            now = time.monotonic()
+            limit = self.batch_size
+            if self.inference_fps:
+                # Token bucket shared by all cameras
+                tokens = min(float(self.batch_size), tokens + (now - last_refill) * self.inference_fps)
+                last_refill = now
+                limit = min(limit, int(tokens))
+
+            batch = self._select_batch(now, limit) if limit > 0 else []
+            if not batch:
+                self.slots.release()
+                self.stop_event.wait(0.01)
+                continue
+
+            tokens -= len(batch)
+            self.batches += 1
+            self.executor.submit(self._analyze_batch, batch)
+
+    def _analyze_batch(self, batch):
+        try:
+            frames = [cv2.resize(item[2], (1280, 720)) for _, item in batch]
+            analyses = [None] * len(batch)
+            detect = [i for i, (camera, _) in enumerate(batch)
+                      if camera.processed % self.options['detect_interval'] == 0]
+            if detect:
+                try:
+                    results = analyze_frames([frames[i] for i in detect], self.options)
+                except Exception as e:
+                    # Recorded as an error frame per camera, like a failed analysis in process.py
+                    results = [e] * len(detect)
+                for i, analysis in zip(detect, results):
+                    analyses[i] = analysis
+
+            for (camera, item), frame, analysis in zip(batch, frames, analyses):
+                record = camera.process(frame, item, analysis, self.latency_budget_ms)
+                if record['alarm'] is not None and self.on_alarm:
+                    self.on_alarm(camera.name, record)
+        except Exception as e:
+            print(f"Supervisor batch error: {e}")
+            print(traceback.format_exc())
+        finally:
+            for camera, _ in batch:
+                camera.busy = False
+            self.slots.release()
+
+def supervise_streams(sources, output_dir="outputs/cameras", options=None, duration=0, **settings):
+    """
+    Analyze several cameras for duration seconds (0 = until all sources end) with a StreamSupervisor
+
+    Args:
+        sources (dict): Camera name -> source (camera index, stream URL or video file)
+        output_dir (str): Each camera writes <output_dir>/<name>/alarm_analysis.db
+        options (dict): DEFAULT_ANALYSIS_OPTIONS overrides shared by all cameras
+        duration (float): Seconds to analyze
+        settings: StreamSupervisor scheduling settings
+
+    Returns:
+        dict: Success flag, message and per-camera statistics
+    """
+    supervisor = None
+    try:
+        supervisor = StreamSupervisor(sources, output_dir, options, **settings).start()
+        print(f"Supervising {len(sources)} cameras")
+        try:
+            supervisor.wait(duration)
+        finally:
+            supervisor.stop()
+
+        stats = supervisor.stats()
+        print(f"Supervisor finished: {stats['processed_frames']} frames analyzed "
+              f"({stats['analyzed_fps']} fps), {stats['total_alarms']} alarms")
+        return {
+            'success': True,
+            'message': 'Multi-camera analysis completed successfully!',
+            'stats': stats
+        }
+
+    except Exception as e:
+        print(f"Supervisor error: {e}")
+        print(traceback.format_exc())
+        return {
+            'success': False,
+            'message': f'Multi-camera analysis failed: {str(e)}',
+            'error': str(e)
+        }
+
+if __name__ == "__main__":
+    import sys
+    # cameras.json: {"entrance": "rtsp://...", "hall": "0"}
+    with open(sys.argv[1] if len(sys.argv) > 1 else os.environ.get('CAMERAS_FILE', 'cameras.json')) as f:
+        cameras = json.load(f)
+    result = supervise_streams(cameras,
+                               duration=float(os.environ.get('STREAM_DURATION', 0)),
+                               inference_workers=int(os.environ.get('INFERENCE_WORKERS', 1)),
+                               inference_fps=float(os.environ.get('INFERENCE_FPS', 0)),
+                               latency_budget_ms=float(os.environ.get('STREAM_LATENCY_BUDGET_MS', 1000)))
+    print(result['message'])
@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+import process
+from db_writer import DatabaseWriter
+
+
+def frame_rows(timestamp):
+    return process.build_analysis_rows(timestamp, '00:00', 0, [], [], [], [], [], [], [])
+
+
+def test_writer_commits_submitted_rows(tmp_path):
+    db_path = str(tmp_path / "alarm_analysis.db")
+    process.setup_database(db_path).close()
+
+    writer = DatabaseWriter(db_path, batch_frames=2)
+    for frame in range(5):
+        writer.submit(frame_rows(frame / 10))
+    writer.close()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM video_analysis').fetchone()[0] == 5
+    conn.close()
+
+
+def test_writer_raises_failed_batch(tmp_path):
+    # No tables: the first batch fails to commit
+    writer = DatabaseWriter(str(tmp_path / "empty.db"), batch_frames=1)
+    writer.submit(frame_rows(0.0))
+    with pytest.raises(sqlite3.OperationalError):
+        writer.flush()
+    with pytest.raises(sqlite3.OperationalError):
+        writer.submit(frame_rows(0.1))
+    with pytest.raises(sqlite3.OperationalError):
+        writer.close()
@@ -0,0 +1,164 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+import process
+
+FPS = 25
+FRAME_COUNT = 400
+CODE_BITS = 10
+
+
+def write_numbered_video(path):
+    """Video whose frames carry their frame number as black/white blocks"""
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), FPS, (640, 360))
+    for frame_number in range(FRAME_COUNT):
+        frame = np.zeros((360, 640, 3), dtype=np.uint8)
+        for bit in range(CODE_BITS):
+            if frame_number >> bit & 1:
+                frame[:40, bit * 60:bit * 60 + 40] = 255
+        out.write(frame)
+    out.release()
+
+
+def read_frame_number(frame):
+    """Frame number of a (1280x720) sampled frame of write_numbered_video"""
+    return sum(1 << bit for bit in range(CODE_BITS) if frame[40, bit * 120 + 40].mean() > 127)
+
+
+def face(x, y, size, emotion):
+    return {
+        'region': {'x': x, 'y': y, 'w': size, 'h': size},
+        'gender': {'Woman': 10.0, 'Man': 90.0},
+        'dominant_gender': 'Man',
+        'emotion': {emotion: 90.0},
+        'dominant_emotion': emotion
+    }
+
+
+def scripted_faces(frame_number):
+    """Faces that walk, run, flicker and jump, so tracks start, die and get lost across segments"""
+    f = frame_number
+    faces = []
+    if f < 360:
+        faces.append(face(60 + 3 * f, 300, 120, 'angry' if 100 <= f < 200 else 'neutral'))
+    if 80 <= f < 330:
+        faces.append(face(1100 - 4 * (f - 80), 150, 60, 'fear' if f >= 240 else 'neutral'))
+    if (f // 5) % 4 != 3:
+        faces.append(face(900, 500, 80, 'happy'))
+    if 150 <= f < 300:
+        faces.append(face(200 if (f // 40) % 2 else 1000, 560, 70, 'angry'))
+    return faces
+
+
+def settled_faces(frame_number):
+    """Two seated people; a visitor leaves early and another arrives late, so tracking has settled at the boundaries"""
+    f = frame_number
+    faces = [face(300, 300, 120, 'angry' if f >= 300 else 'neutral'), face(900, 200, 100, 'neutral')]
+    if f < 60:
+        faces.append(face(100 + 5 * f, 550, 80, 'neutral'))
+    if f >= 320:
+        faces.append(face(1100 - 6 * (f - 320), 550, 80, 'fear'))
+    return faces
+
+
+def scripted_detector(script):
+    def analyze_frames(frames, options):
+        return [script(read_frame_number(frame)) for frame in frames]
+    return analyze_frames
+
+
+def database_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        persons = conn.execute('''
+            SELECT timestamp, face_id, gender, emotion, speed, angle, bbox_area, distance_category, x, y, width, height,
+                   danger_status, danger_level, alarm_triggered
+            FROM person_details ORDER BY timestamp, id
+        ''').fetchall()
+        alarms = conn.execute('''
+            SELECT timestamp, dangerous_person_id, dangerous_person_emotion, dangerous_person_speed, nearby_persons,
+                   alarm_reason, danger_level
+            FROM alarm_events ORDER BY timestamp, id
+        ''').fetchall()
+    finally:
+        conn.close()
+    return persons, alarms
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    path = tmp_path / "numbered.mp4"
+    write_numbered_video(path)
+    # Segments run in threads so they see the fake detector
+    monkeypatch.setattr(process, 'ProcessPoolExecutor', lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+    return str(path)
+
+
+@pytest.fixture
+def segment_runs(monkeypatch):
+    """Segments analyzed (segment tuple and whether it continued a handed-over state)"""
+    runs = []
+    analyze_segment = process.analyze_segment
+
+    def counting_analyze_segment(video_path, segment, work_dir, options, state=None):
+        runs.append((segment, state is not None))
+        return analyze_segment(video_path, segment, work_dir, options, state)
+
+    monkeypatch.setattr(process, 'analyze_segment', counting_analyze_segment)
+    return runs
+
+
+def run_analysis(video, output_dir, options, sharded):
+    output_dir.mkdir()
+    db_path = str(output_dir / "alarm_analysis.db")
+    conn = process.setup_database(db_path)
+    if sharded:
+        stats = process.analyze_video_sharded(video, str(output_dir), None, options, conn)
+    else:
+        stats = process.analyze_video_frames(video, str(output_dir), None, options, conn)
+    conn.commit()
+    conn.close()
+    return stats, database_rows(db_path)
+
+
+def assert_same_analysis(video, tmp_path, options):
+    serial_stats, (serial_persons, serial_alarms) = run_analysis(video, tmp_path / "serial", options, sharded=False)
+    sharded_stats, (sharded_persons, sharded_alarms) = run_analysis(video, tmp_path / "sharded", options, sharded=True)
+
+    assert serial_alarms
+    assert sharded_alarms == serial_alarms
+    assert sharded_persons == serial_persons
+    for key in ('processed_frames', 'total_alarms', 'max_danger_level'):
+        assert sharded_stats[key] == serial_stats[key]
+
+
+def sharded_options(shards, overlap):
+    return process.build_analysis_options({'analysis_mode': 'batched', 'render_video': False, 'db_writer': False,
+                                           'shards': shards, 'shard_workers': 2, 'shard_overlap': overlap})
+
+
+@pytest.mark.parametrize('shards,overlap', [(3, 10), (4, 2), (5, 0)])
+def test_sharded_analysis_matches_serial(video, tmp_path, monkeypatch, shards, overlap):
+    monkeypatch.setattr(process, 'analyze_frames', scripted_detector(scripted_faces))
+    assert_same_analysis(video, tmp_path, sharded_options(shards, overlap))
+
+
+def test_settled_segments_are_stitched_without_rerun(video, tmp_path, monkeypatch, segment_runs):
+    monkeypatch.setattr(process, 'analyze_frames', scripted_detector(settled_faces))
+    assert_same_analysis(video, tmp_path, sharded_options(3, 40))
+
+    # Every warm-up rebuilt the tracking state: no segment had to continue a handed-over one
+    assert [continued for _, continued in segment_runs] == [False] * 3
+
+
+def test_split_video_segments_covers_video():
+    segments = process.split_video_segments(400, 3, 5, 10)
+    assert [segment[0] for segment in segments] == [0, 1, 2]
+    assert segments[0][1:3] == (0, 0)
+    assert all(previous[3] == segment[2] for previous, segment in zip(segments, segments[1:]))
+    assert segments[-1][3] == 400
+    assert all(segment[2] - segment[1] == 50 for segment in segments[1:])
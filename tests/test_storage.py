@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import process
+from queries import open_results_database, query_frames
+from test_sharding import scripted_detector, scripted_faces, video  # noqa: F401 (fixture)
+
+
+def compact_options(distance_blob, shards=1):
+    return process.build_analysis_options({'analysis_mode': 'batched', 'render_video': False, 'db_writer': False,
+                                           'storage_schema': 'compact', 'distance_blob': distance_blob,
+                                           'shards': shards, 'shard_workers': 2})
+
+
+def run_compact_analysis(video, output_dir, options):
+    output_dir.mkdir()
+    db_path = str(output_dir / "alarm_analysis.db")
+    conn = process.setup_database(db_path, options['storage_schema'], options['distance_blob'])
+    if options['shards'] > 1:
+        process.analyze_video_sharded(video, str(output_dir), None, options, conn)
+    else:
+        process.analyze_video_frames(video, str(output_dir), None, options, conn)
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def distance_rows(db_path):
+    conn = open_results_database(db_path)
+    try:
+        pairs = conn.execute('''
+            SELECT id, timestamp, person1_id, person2_id, distance, is_close FROM person_distances ORDER BY id
+        ''').fetchall()
+        frames = conn.execute('SELECT id, distances FROM video_analysis ORDER BY id').fetchall()
+        pair_rows = conn.execute('SELECT COUNT(*) FROM pair_distances').fetchone()[0]
+    finally:
+        conn.close()
+    return pairs, [(frame, json.loads(distances)) for frame, distances in frames], pair_rows
+
+
+def assert_close_rows(blob_rows, rows, distance_index):
+    assert len(blob_rows) == len(rows)
+    for blob_row, row in zip(blob_rows, rows):
+        assert blob_row[:distance_index] == row[:distance_index]
+        assert blob_row[distance_index] == pytest.approx(row[distance_index], rel=1e-6)
+        assert blob_row[distance_index + 1:] == row[distance_index + 1:]
+
+
+@pytest.mark.parametrize('shards', [1, 3])
+def test_distance_blob_round_trip(video, tmp_path, monkeypatch, shards):
+    monkeypatch.setattr(process, 'analyze_frames', scripted_detector(scripted_faces))
+    rows_db = run_compact_analysis(video, tmp_path / "rows", compact_options(False, shards))
+    blob_db = run_compact_analysis(video, tmp_path / "blob", compact_options(True, shards))
+
+    pairs, frames, pair_rows = distance_rows(rows_db)
+    blob_pairs, blob_frames, blob_pair_rows = distance_rows(blob_db)
+
+    assert pairs and pair_rows
+    assert blob_pair_rows == 0
+    assert_close_rows(blob_pairs, pairs, 4)
+
+    assert [frame for frame, _ in blob_frames] == [frame for frame, _ in frames]
+    for (_, blob_distances), (_, distances) in zip(blob_frames, frames):
+        assert_close_rows([tuple(pair) for pair in blob_distances], [tuple(pair) for pair in distances], 2)
+
+    conn = open_results_database(blob_db)
+    try:
+        page = query_frames(conn, limit=1000)
+    finally:
+        conn.close()
+    assert [item['distances'] for item in page['items']] == [distances for _, distances in blob_frames]
+
+
+def test_distance_blob_requires_compact_schema():
+    with pytest.raises(ValueError):
+        process.build_analysis_options({'distance_blob': True})
+    assert process.build_analysis_options({'storage_schema': 'compact', 'distance_blob': True})['distance_blob']
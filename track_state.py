@@ -0,0 +1,108 @@
+import numpy as np
+
+# Speeds averaged for smoothing (per track)
+SPEED_HISTORY = 5
+
+# Fields of the position rows
+POSITION_FIELDS = ('cx', 'cy', 'bbox_area', 'timestamp')
+
+class TrackStateStore:
+    """
+    Last position and speed smoothing window of every live track
+
+    Rows of preallocated arrays are handed out per track ID and returned to a free list when
+    the tracker drops the track, so memory follows the number of live tracks (not the length
+    of the video). Speeds are kept in a fixed-size ring buffer per row.
+    """
+    __slots__ = ('history', 'rows', 'free', 'positions', 'speeds', 'speed_count', 'speed_next', 'permanent')
+
+    def __init__(self, capacity=64, history=SPEED_HISTORY, permanent=(-1,)):
+        self.history = history
+        self.rows = {}
+        self.free = list(range(capacity - 1, -1, -1))
+        self.positions = np.zeros((capacity, len(POSITION_FIELDS)), dtype=np.float64)
+        self.speeds = np.zeros((capacity, history), dtype=np.float64)
+        self.speed_count = np.zeros(capacity, dtype=np.int64)
+        self.speed_next = np.zeros(capacity, dtype=np.int64)
+        # IDs that are not tracker tracks (-1 = unmatched face) and are never evicted
+        self.permanent = set(permanent)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, track_id):
+        return track_id in self.rows
+
+    def _grow(self):
+        """Double the capacity of the arrays"""
+        capacity = len(self.positions)
+        self.positions = np.concatenate([self.positions, np.zeros_like(self.positions)])
+        self.speeds = np.concatenate([self.speeds, np.zeros_like(self.speeds)])
+        self.speed_count = np.concatenate([self.speed_count, np.zeros_like(self.speed_count)])
+        self.speed_next = np.concatenate([self.speed_next, np.zeros_like(self.speed_next)])
+        self.free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def _row(self, track_id):
+        """Row of a track, allocated (and reset) on first use"""
+        row = self.rows.get(track_id)
+        if row is None:
+            if not self.free:
+                self._grow()
+            row = self.free.pop()
+            self.speed_count[row] = 0
+            self.speed_next[row] = 0
+            self.rows[track_id] = row
+        return row
+
+    def get_position(self, track_id):
+        """(cx, cy, bbox_area, timestamp) of the track's last observation, or None"""
+        row = self.rows.get(track_id)
+        if row is None:
+            return None
+        return tuple(self.positions[row].tolist())
+
+    def set_position(self, track_id, cx, cy, bbox_area, timestamp):
+        """Store the track's latest observation"""
+        self.positions[self._row(track_id)] = (cx, cy, bbox_area, timestamp)
+
+    def add_speed(self, track_id, speed):
+        """Push a speed into the track's ring buffer and return the smoothed (mean) speed"""
+        row = self._row(track_id)
+        self.speeds[row, self.speed_next[row]] = speed
+        self.speed_next[row] = (self.speed_next[row] + 1) % self.history
+        self.speed_count[row] = min(self.speed_count[row] + 1, self.history)
+
+        # Oldest to newest, so the mean is identical to the sum of a plain list
+        ordered = self.get_speeds(track_id)
+        return sum(ordered) / len(ordered)
+
+    def get_speeds(self, track_id):
+        """Speeds in the track's ring buffer, oldest to newest"""
+        row = self.rows.get(track_id)
+        if row is None:
+            return []
+        count = int(self.speed_count[row])
+        start = (self.speed_next[row] - count) % self.history
+        values = self.speeds[row].tolist()
+        return [values[(start + k) % self.history] for k in range(count)]
+
+    def restore(self, track_id, saved):
+        """Set a track back to a (position, speeds) pair of get_position/get_speeds; None removes it"""
+        if saved is None:
+            if track_id in self.rows:
+                self.free.append(self.rows.pop(track_id))
+            return
+        position, speeds = saved
+        row = self._row(track_id)
+        self.positions[row] = position
+        self.speeds[row] = 0
+        self.speeds[row, :len(speeds)] = speeds
+        self.speed_count[row] = len(speeds)
+        self.speed_next[row] = len(speeds) % self.history
+
+    def evict(self, alive_ids):
+        """Release the rows of tracks that are no longer alive; returns the number evicted"""
+        dead = [track_id for track_id in self.rows if track_id not in alive_ids and track_id not in self.permanent]
+        for track_id in dead:
+            self.free.append(self.rows.pop(track_id))
+        return len(dead)